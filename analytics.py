@@ -0,0 +1,103 @@
+"""Derived series for the analysis page: running balance, rolling averages, budget burn.
+
+Everything here works on whole columns. Records are bucketed per day (or,
+through ``periods.period_matrix``, per cycle) with one ``bincount``, and
+balances, averages and projections come from ``cumsum`` and ``rolling``
+over the resulting date-indexed series, so the cost grows with the number
+of records and days but never runs a Python loop over either.
+"""
+import metrics
+import periods
+from lazy_modules import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# How each type moves cash in hand (see the dashboard's cash_in_hand)
+CASH_SIGNS = {'Earning': 1.0, 'Spend': -1.0, 'Investment': -1.0, 'Savings': -1.0}
+# Months averaged by the rolling category averages
+ROLLING_WINDOWS = (3, 6, 12)
+
+
+def _days(dates):
+    values = np.asarray(dates)
+    if not np.issubdtype(values.dtype, np.datetime64):
+        values = np.asarray(pd.to_datetime(dates))
+    return values.astype('datetime64[D]')
+
+
+def daily_totals(days, amounts, first, last):
+    """Series of ``amounts`` summed per day, with a row for every day from ``first`` to ``last``."""
+    first, last = np.datetime64(first, 'D'), np.datetime64(last, 'D')
+    span = max(int((last - first).astype(np.int64)) + 1, 0)
+    offsets = (days - first).astype(np.int64)
+    keep = (offsets >= 0) & (offsets < span)
+    sums = np.bincount(offsets[keep], weights=np.asarray(amounts, dtype='float64')[keep], minlength=span)
+    return pd.Series(sums, index=pd.date_range(pd.Timestamp(first), periods=span, freq='D'))
+
+
+@metrics.timed('aggregate')
+def running_balance(dates, types, amounts, start_date=None, end_date=None):
+    """Cash in hand at the end of each day: earnings minus spends, investments and savings.
+
+    Days run from ``start_date`` (default: the first record) to ``end_date``
+    (default: the last record); records before ``start_date`` make up the
+    opening balance.
+    """
+    days = _days(dates)
+    valid = ~np.isnat(days)
+    if not valid.any():
+        return pd.Series(dtype='float64', index=pd.DatetimeIndex([]))
+    # Look the sign up once per distinct type rather than once per record
+    codes, values = pd.factorize(pd.Series(types))
+    signs = np.append([CASH_SIGNS.get(value, 0.0) for value in values], 0.0)[codes]
+    net = np.where(valid, signs * np.nan_to_num(np.asarray(amounts, dtype='float64')), 0.0)
+    first = np.datetime64(pd.Timestamp(start_date), 'D') if start_date else days[valid].min()
+    last = np.datetime64(pd.Timestamp(end_date), 'D') if end_date else days[valid].max()
+    opening = net[valid & (days < first)].sum()
+    return daily_totals(days[valid], net[valid], first, last).cumsum() + opening
+
+
+@metrics.timed('aggregate')
+def rolling_averages(matrix, windows=ROLLING_WINDOWS):
+    """{window: frame} of each column's mean over the last ``window`` rows of a cycles x keys frame.
+
+    A cycle with fewer than ``window`` cycles before it has no average (NaN).
+    """
+    return {window: matrix.rolling(window, min_periods=window).mean() for window in windows}
+
+
+@metrics.timed('aggregate')
+def budget_burn(dates, categories, amounts, budgets, start_day=1, today=None):
+    """Spend so far in the current billing cycle against ``budgets`` ({category: amount}).
+
+    Month-end spend is projected by extending the average daily spend so
+    far over the whole cycle. Returns the cycle's bounds, its cumulative
+    daily spend and a frame of spent / budget / projected per category.
+    """
+    today = np.datetime64(pd.Timestamp(today or pd.Timestamp.now()).normalize(), 'D')
+    edges = periods.period_edges(today, today, 'month', start_day)
+    current = np.searchsorted(edges, today, side='right') - 1
+    start, end = edges[current], edges[current + 1]
+    length = int((end - start).astype(np.int64))
+    elapsed = int((today - start).astype(np.int64)) + 1
+
+    days = _days(dates)
+    in_cycle = (days >= start) & (days <= today)
+    amounts = np.nan_to_num(np.asarray(amounts, dtype='float64'))[in_cycle]
+    spent_to_date = daily_totals(days[in_cycle], amounts, start, today).cumsum()
+    spent = pd.Series(amounts).groupby(np.asarray(categories, dtype=object)[in_cycle]).sum()
+
+    table = pd.DataFrame({'spent': spent, 'budget': pd.Series(budgets, dtype='float64')})
+    table['spent'] = table['spent'].fillna(0.0)
+    table['projected'] = table['spent'] / elapsed * length
+    table['remaining'] = table['budget'] - table['spent']
+    return {
+        'period': periods.period_labels(edges[current:current + 1], 'month')[0],
+        'start': pd.Timestamp(start),
+        'end': pd.Timestamp(end - 1),
+        'days_elapsed': elapsed,
+        'days_in_period': length,
+        'spent_to_date': spent_to_date,
+        'categories': table.sort_index(),
+    }
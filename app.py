@@ -1,20 +1,69 @@
 import os
 import json
-import csv
-import pandas as pd
+import base64
+import cProfile
+import hashlib
+import logging
+import threading
+import time
+import zlib
+import click
 import yaml
-from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, send_file
+from collections import OrderedDict
+from flask import (Flask, Response, before_render_template, g, render_template, request, redirect, url_for,
+                   flash, jsonify, session, send_file, stream_with_context, template_rendered)
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from dotenv import load_dotenv
+import analytics
+import household
+from importer import run_import
+from jobs import JobLimitError, JobRunner
+from lazy_modules import lazy_import
+import metrics
+import periods
+from storage import (EXPENSE_COLUMNS, EXPENSE_TYPES, LedgerCache, SORTABLE_COLUMNS, atomic_write_json,
+                     create_store, empty_expenses_frame, expand_expenses, expense_records, filter_expenses,
+                     format_expense_dates, memory_report, migrate_csv_ledgers)
+from user_settings import SettingsError, SettingsStore
+
+# Imported on first use; see lazy_modules.py
+pd = lazy_import('pandas')
 
 # Load environment variables from .env file
 load_dotenv()
 
+# LOG_LEVEL=DEBUG shows per-request timings and storage details
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+log = logging.getLogger(__name__)
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'default-secret-key')
-app.config['DATA_DIR'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+app.config['DATA_DIR'] = os.getenv('DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+app.config['CONFIG_FILE'] = os.getenv('CONFIG_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.yaml'))
+# Ledger backend: 'csv' (default) or 'sqlite'
+app.config['STORAGE_BACKEND'] = os.getenv('STORAGE_BACKEND', 'csv')
+# Parsed ledgers kept in memory across requests (per process)
+app.config['LEDGER_CACHE_MAX_USERS'] = int(os.getenv('LEDGER_CACHE_MAX_USERS', '32'))
+app.config['LEDGER_CACHE_MAX_MB'] = int(os.getenv('LEDGER_CACHE_MAX_MB', '256'))
+# Serialised JSON responses (API results, chart data) kept in memory (per process)
+app.config['RESPONSE_CACHE_MAX_ENTRIES'] = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '1024'))
+app.config['RESPONSE_CACHE_MAX_MB'] = int(os.getenv('RESPONSE_CACHE_MAX_MB', '64'))
+# Background jobs (large imports/exports, index rebuilds): pool size, jobs running
+# per user, jobs a user may have waiting, and the sizes above which imports and
+# exports leave the request thread
+app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', '2'))
+app.config['JOB_PER_USER'] = int(os.getenv('JOB_PER_USER', '1'))
+app.config['JOB_MAX_QUEUED'] = int(os.getenv('JOB_MAX_QUEUED', '5'))
+app.config['JOB_IMPORT_MIN_MB'] = float(os.getenv('JOB_IMPORT_MIN_MB', '2'))
+app.config['JOB_EXPORT_MIN_ROWS'] = int(os.getenv('JOB_EXPORT_MIN_ROWS', '50000'))
+# Per-request phase timings, rows scanned and bytes moved, served at /metrics
+app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', '').lower() in ('1', 'true', 'yes')
+# Worker processes for the household report (0 or 1: compute in the web process)
+app.config['REPORT_WORKERS'] = int(os.getenv('REPORT_WORKERS', str(min(4, os.cpu_count() or 1))))
+# Allow an X-Profile request header from an admin to save a profile of that request under data/profiles
+app.config['PROFILE_REQUESTS'] = os.getenv('PROFILE_REQUESTS', '').lower() in ('1', 'true', 'yes')
 
 # Ensure data directory exists
 os.makedirs(app.config['DATA_DIR'], exist_ok=True)
@@ -25,111 +74,318 @@ login_manager.init_app(app)
 login_manager.login_view = 'login'
 
 class User(UserMixin):
-    def __init__(self, id, username, password_hash):
+    def __init__(self, id, username, password_hash, is_admin=False):
         self.id = id
         self.username = username
         self.password_hash = password_hash
+        self.is_admin = is_admin  # may view the household report
+
+def get_credentials_cache_path():
+    return os.path.join(app.config['DATA_DIR'], '.credentials_cache.json')
+
+def load_password_hashes(checksum):
+    """Password hashes saved for the config file with this checksum, by user id."""
+    try:
+        with open(get_credentials_cache_path(), 'r') as file:
+            cached = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return cached.get('hashes', {}) if cached.get('config') == checksum else {}
+
+def save_password_hashes(checksum, hashes):
+    path = get_credentials_cache_path()
+    try:
+        # Owner-only from creation, so the hashes are never readable by others
+        atomic_write_json(path, {'config': checksum, 'hashes': hashes}, mode=0o600)
+    except OSError as e:
+        log.warning('Could not cache password hashes in %s: %s', path, e)
 
 # Load users from config.yaml
 def load_users_from_config():
-    config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.yaml')
+    """Users from CONFIG_FILE, keyed by id.
+
+    Hashing a password takes a few hundred milliseconds, so the hashes are
+    kept in DATA_DIR, stamped with the config file's checksum, and worker
+    boots after the first reuse them until config.yaml changes.
+    """
+    config_path = app.config['CONFIG_FILE']
     if os.path.exists(config_path):
-        with open(config_path, 'r') as file:
-            config = yaml.safe_load(file)
-            user_list = config.get('users', [])
-            users_dict = {}
-            for user in user_list:
-                user_id = user.get('id')
-                username = user.get('username')
-                password = user.get('password')
-                if user_id and username and password:
-                    users_dict[user_id] = User(user_id, username, generate_password_hash(password))
-            return users_dict
+        with open(config_path, 'rb') as file:
+            raw = file.read()
+        config = yaml.safe_load(raw) or {}
+        checksum = hashlib.sha256(raw).hexdigest()
+        cached = load_password_hashes(checksum)
+        hashes = {}
+        users_dict = {}
+        for user in config.get('users', []):
+            user_id = user.get('id')
+            username = user.get('username')
+            password = user.get('password')
+            if user_id and username and password:
+                key = str(user_id)  # JSON object keys are strings
+                hashes[key] = cached.get(key) or generate_password_hash(password)
+                users_dict[user_id] = User(user_id, username, hashes[key], bool(user.get('admin')))
+        if hashes != cached:
+            save_password_hashes(checksum, hashes)
+        return users_dict
     return {}
 
 # Initialize users from config
 users = load_users_from_config()
+# username -> User, for logins
+users_by_name = {user.username: user for user in users.values()}
 
 @login_manager.user_loader
 def load_user(user_id):
     return users.get(user_id)
 
-# Default settings
-DEFAULT_CATEGORIES = [
-    "Food", "Groceries", "Travel", "Rent", "Utilities", 
-    "Entertainment", "Healthcare", "Shopping", "Miscellaneous", "Income"
-]
+# Paging for the expenses table
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Rows serialised per step of a streamed export / validated per step of an import
+EXPORT_CHUNK_SIZE = 5000
+IMPORT_CHUNK_SIZE = 5000
 
 # Helper functions for data operations
-def get_user_data_path(username):
-    return os.path.join(app.config['DATA_DIR'], f"{username}_expenses.csv")
+def get_ledger_store():
+    """Return the storage backend for the configured STORAGE_BACKEND and DATA_DIR."""
+    key = (app.config['STORAGE_BACKEND'], app.config['DATA_DIR'])
+    store = _ledger_stores.get(key)
+    if store is None:
+        store = _ledger_stores[key] = create_store(key[0], key[1], ledger_cache, ledger_categories)
+    return store
+
+_ledger_stores = {}
+
+def get_settings_store():
+    """Return the cached, validated per-user settings for the configured DATA_DIR."""
+    data_dir = app.config['DATA_DIR']
+    store = _settings_stores.get(data_dir)
+    if store is None:
+        store = _settings_stores[data_dir] = SettingsStore(data_dir)
+    return store
+
+_settings_stores = {}
+
+def get_household_report():
+    """Return the household report builder (per-user partials, worker pool) for the current store."""
+    store = get_ledger_store()
+    key = (store.name, store.data_dir)
+    report = _household_reports.get(key)
+    if report is None:
+        report = _household_reports[key] = household.HouseholdReport(store, app.config['REPORT_WORKERS'])
+    return report
+
+_household_reports = {}
+
+def get_job_runner():
+    """Return the background job runner for the configured DATA_DIR."""
+    data_dir = app.config['DATA_DIR']
+    runner = _job_runners.get(data_dir)
+    if runner is None:
+        runner = _job_runners[data_dir] = JobRunner(os.path.join(data_dir, 'jobs'), app.config['JOB_WORKERS'],
+                                                    app.config['JOB_PER_USER'], app.config['JOB_MAX_QUEUED'])
+    return runner
+
+_job_runners = {}
+ledger_cache = LedgerCache(app.config['LEDGER_CACHE_MAX_USERS'],
+                           app.config['LEDGER_CACHE_MAX_MB'] * 1024 * 1024)
+
+class ResponseCache:
+    """LRU of serialised JSON payloads, bounded by entry count and size.
+
+    Entries are stored with the ledger data version they were built from; a
+    write bumps the version, so stale entries are never served and simply
+    age out.
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (data version, body)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, version, body):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= len(old[1])
+            if len(body) > self.max_bytes:
+                return
+            self._entries[key] = (version, body)
+            self._total_bytes += len(body)
+            while len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes:
+                _, (_, oldest) = self._entries.popitem(last=False)
+                self._total_bytes -= len(oldest)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def usage(self):
+        with self._lock:
+            return len(self._entries), self._total_bytes
 
-def get_user_settings_path(username):
-    return os.path.join(app.config['DATA_DIR'], f"{username}_settings.json")
+response_cache = ResponseCache(app.config['RESPONSE_CACHE_MAX_ENTRIES'],
+                               app.config['RESPONSE_CACHE_MAX_MB'] * 1024 * 1024)
+
+def payload_key(kind, params=()):
+    """Return (cache key, data version, ETag) for a JSON payload of the current user's data.
+
+    Only the ledger's data version is read, so working out the ETag never
+    loads any records.
+    """
+    store = get_ledger_store()
+    username = current_user.username
+    key = (store.name, store.data_dir, username, kind, params)
+    version = store.data_version(username)
+    etag = hashlib.sha1(repr((key, version)).encode('utf-8')).hexdigest()[:24]
+    return key, version, etag
+
+def _cached_body(key, version, build):
+    body = response_cache.get(key, version)
+    if body is None:
+        data = build()
+        with metrics.phase('serialize'):
+            body = app.json.dumps(data)
+        response_cache.put(key, version, body)
+    return body
+
+def cached_json_response(kind, params, build):
+    """JSON response with an ETag; answers If-None-Match with 304 without loading data."""
+    key, version, etag = payload_key(kind, params)
+    return versioned_json_response(key, version, etag, build)
+
+def versioned_json_response(key, version, etag, build):
+    """JSON response for ``build()`` cached under ``key`` until ``version`` changes."""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(_cached_body(key, version, build), mimetype='application/json')
+    response.set_etag(etag)
+    # Per-user data: browsers may keep it but must revalidate each time
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+def ledger_categories(username):
+    """Categories the in-memory ledger's categorical column is built from."""
+    return load_user_settings(username)['categories']
+
+def get_user_import_report_path(username):
+    return os.path.join(app.config['DATA_DIR'], f"{username}_import_errors.csv")
 
 def initialize_user_data(username):
-    data_path = get_user_data_path(username)
-    if not os.path.exists(data_path):
-        with open(data_path, 'w', newline='') as file:
-            writer = csv.writer(file)
-            writer.writerow(['id', 'date', 'type', 'category', 'amount', 'description'])
-    
-    settings_path = get_user_settings_path(username)
-    if not os.path.exists(settings_path):
-        settings = {
-            'categories': DEFAULT_CATEGORIES,
-            'currency': 'INR (₹)',
-            'start_date': 1  # Day of month to start tracking
-        }
-        with open(settings_path, 'w') as file:
-            json.dump(settings, file)
-    
+    get_ledger_store().initialize(username)
+    get_settings_store().initialize(username)
     return True
 
 def load_user_expenses(username):
     try:
-        data_path = get_user_data_path(username)
-        if os.path.exists(data_path):
-            # Open the file with explicit encoding and verify it has content
-            with open(data_path, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-                if not content:  # If file is empty, initialize it
-                    df = pd.DataFrame(columns=['id', 'date', 'type', 'category', 'amount', 'description'])
-                    df.to_csv(data_path, index=False)
-                    return df
-            
-            # Read the CSV with specified parameters
-            df = pd.read_csv(data_path, encoding='utf-8')
-            
-            # Debug: Print record count
-            print(f"Loaded {len(df)} records from {data_path}")
-            
-            # Convert date strings to datetime objects with more flexible parsing
-            df['date'] = pd.to_datetime(df['date'], errors='coerce')
-            # Drop any rows with invalid dates
-            df = df.dropna(subset=['date'])
-            return df
-        return pd.DataFrame(columns=['id', 'date', 'type', 'category', 'amount', 'description'])
+        return get_ledger_store().load(username)
     except Exception as e:
-        print(f"Error loading expenses: {str(e)}")
-        return pd.DataFrame(columns=['id', 'date', 'type', 'category', 'amount', 'description'])
+        log.error('Error loading expenses for %s: %s', username, e)
+        return empty_expenses_frame()
 
 def load_user_settings(username):
-    settings_path = get_user_settings_path(username)
-    if os.path.exists(settings_path):
-        with open(settings_path, 'r') as file:
-            return json.load(file)
-    return {
-        'categories': DEFAULT_CATEGORIES,
-        'currency': 'INR (₹)',
-        'start_date': 1
-    }
+    """The user's settings, validated and cached (see user_settings.py); don't modify the dict."""
+    return get_settings_store().get(username)
 
-def save_user_settings(username, settings):
-    settings_path = get_user_settings_path(username)
-    with open(settings_path, 'w') as file:
-        json.dump(settings, file)
-    return True
+def cycle_settings(username):
+    """(month start day, financial year start month) the user's periods are cut on."""
+    settings = load_user_settings(username)
+    return settings['start_date'], settings['financial_year_start']
+
+def update_user_settings(username, changes):
+    """Save ``changes`` (field -> value) in one write; raises SettingsError if any is invalid."""
+    return get_settings_store().update(username, changes)
+
+# Instrumentation (see metrics.py); all of it is skipped unless enabled
+metrics_registry = metrics.Registry()
+metrics_registry.gauge('ledger_cache_entries', 'Parsed ledgers held in memory.', lambda: ledger_cache.usage()[0])
+metrics_registry.gauge('ledger_cache_bytes', 'Estimated size of the parsed ledgers held in memory.',
+                       lambda: ledger_cache.usage()[1])
+metrics_registry.gauge('response_cache_entries', 'Serialised JSON responses held in memory.',
+                       lambda: response_cache.usage()[0])
+metrics_registry.gauge('response_cache_bytes', 'Size of the serialised JSON responses held in memory.',
+                       lambda: response_cache.usage()[1])
+UNMEASURED_ENDPOINTS = ('static', 'prometheus_metrics')
+PROFILE_HEADER = 'X-Profile'
+
+def profiling_allowed():
+    return current_user.is_authenticated and current_user.is_admin
+
+@app.before_request
+def start_instrumentation():
+    if app.config['METRICS_ENABLED'] and request.endpoint not in UNMEASURED_ENDPOINTS:
+        g.request_stats = metrics.begin_request()
+    # Only admins may ask: every profile is a file on disk and a slower request
+    if app.config['PROFILE_REQUESTS'] and request.headers.get(PROFILE_HEADER) and profiling_allowed():
+        profile_dir = os.path.join(app.config['DATA_DIR'], 'profiles')
+        os.makedirs(profile_dir, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.endpoint or 'unknown'}-{os.getpid()}-{threading.get_ident()}"
+        g.profile_path = os.path.join(profile_dir, f"{name}.prof")
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def report_instrumentation(response):
+    stats = g.get('request_stats')
+    if stats is not None:
+        stats.status = response.status_code
+        # Phases so far; a streamed body is still to come
+        if stats.phases:
+            response.headers['Server-Timing'] = stats.server_timing()
+    if g.get('profiler') is not None:
+        response.headers['X-Profile-Dump'] = os.path.basename(g.profile_path)
+    return response
+
+@app.teardown_request
+def finish_instrumentation(exc):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(g.profile_path)
+        log.info('Saved profile of %s to %s', request.path, g.profile_path)
+    if g.pop('request_stats', None) is not None:
+        # Teardown runs after a streamed response has been sent, so this covers the whole body
+        stats = metrics.end_request()
+        if exc is not None:
+            stats.status = 500
+        metrics_registry.observe(request.endpoint or 'unknown', request.method, stats)
+        log.debug('%s %s %s in %.1fms: %d rows scanned, %d bytes read, %d bytes written (%s)',
+                  request.method, request.path, stats.status, stats.elapsed() * 1000, stats.rows,
+                  stats.bytes_read, stats.bytes_written, stats.server_timing())
+
+def _start_render_phase(sender, template, context, **extra):
+    if g.get('request_stats') is not None:
+        g.render_phase = metrics.phase('render')
+        g.render_phase.__enter__()
+
+def _end_render_phase(sender, template, context, **extra):
+    render_phase = g.pop('render_phase', None)
+    if render_phase is not None:
+        render_phase.__exit__(None, None, None)
+
+before_render_template.connect(_start_render_phase, app)
+template_rendered.connect(_end_render_phase, app)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    if not app.config['METRICS_ENABLED']:
+        return jsonify({'success': False, 'message': 'Metrics are disabled; set METRICS_ENABLED=1'}), 404
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
 
 # Routes
 @app.route('/')
@@ -147,7 +403,7 @@ def login():
         username = request.form.get('username')
         password = request.form.get('password')
         
-        user = next((u for u in users.values() if u.username == username), None)
+        user = users_by_name.get(username)
         
         if user and check_password_hash(user.password_hash, password):
             login_user(user)
@@ -167,37 +423,31 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    df = load_user_expenses(current_user.username)
+    store = get_ledger_store()
     settings = load_user_settings(current_user.username)
     
     # Calculate summary stats
-    if not df.empty:
-        # Force amount to numeric to ensure proper calculation
-        df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
-        
-        # Calculate totals with explicit grouping
-        earnings = df[df['type'] == 'Earning']['amount'].sum()
-        spends = df[df['type'] == 'Spend']['amount'].sum()
-        investments = df[df['type'] == 'Investment']['amount'].sum()
-        savings_type = df[df['type'] == 'Savings']['amount'].sum()
+    totals = store.totals_by_type(current_user.username)
+    if totals:
+        earnings = totals.get('Earning', 0)
+        spends = totals.get('Spend', 0)
+        investments = totals.get('Investment', 0)
+        savings_type = totals.get('Savings', 0)
         savings = earnings - spends - investments 
         cash_in_hand = earnings - spends - investments - savings_type
         
-        print(f"Dashboard calculations - Earnings: {earnings}, Spends: {spends}, Investments: {investments}, Savings Type: {savings_type}, Cash in Hand: {cash_in_hand}")
+        log.debug('Dashboard calculations - Earnings: %s, Spends: %s, Investments: %s, Savings Type: %s, '
+                  'Cash in Hand: %s', earnings, spends, investments, savings_type, cash_in_hand)
         
         # Get latest 5 records and ensure they have the right format for template
-        latest_records = df.sort_values('date', ascending=False).head(5)
-        latest_records_list = latest_records.to_dict('records')
+        latest_records_list = expand_expenses(store.latest(current_user.username, 5)).to_dict('records')
         
-        # Monthly breakdown for chart (last 12 months)
-        df['month'] = df['date'].dt.strftime('%Y-%m')
-        monthly_data = {}
-        for type_val in ['Earning', 'Spend', 'Investment', 'Savings']:
-            type_df = df[df['type'] == type_val]
-            monthly_data[type_val] = type_df.groupby('month')['amount'].sum().to_dict()
-        
-        # Calculate monthly savings and cash in hand for current month
-        current_month = datetime.now().strftime('%Y-%m')
+        # Totals for the current billing cycle (see settings start_date); the
+        # chart itself fetches /api/charts/monthly once the page has loaded
+        cycle = cycle_settings(current_user.username)
+        cycle_start = periods.recent_start(1, 'month', *cycle).strftime('%Y-%m-%d')
+        monthly_data = monthly_chart_data(store, current_user.username, cycle, (cycle_start, None))
+        current_month = periods.current_period('month', *cycle)
         current_monthly_earnings = monthly_data['Earning'].get(current_month, 0)
         current_monthly_spends = monthly_data['Spend'].get(current_month, 0)
         current_monthly_investments = monthly_data['Investment'].get(current_month, 0)
@@ -209,7 +459,6 @@ def dashboard():
         earnings, spends, investments, savings, cash_in_hand = 0, 0, 0, 0, 0
         current_monthly_savings, current_monthly_cash_in_hand = 0, 0
         latest_records_list = []
-        monthly_data = {'Earning': {}, 'Spend': {}, 'Investment': {}, 'Savings': {}}
     
     return render_template('dashboard.html', 
                           earnings=earnings, spends=spends, 
@@ -218,89 +467,248 @@ def dashboard():
                           current_monthly_savings=current_monthly_savings,
                           current_monthly_cash_in_hand=current_monthly_cash_in_hand,
                           latest_records=latest_records_list,
-                          monthly_data=json.dumps(monthly_data),
                           settings=settings)
 
+def pivot_period_totals(period_totals):
+    """Turn (period, type, amount) rows into {period: {type: amount}}."""
+    if period_totals.empty:
+        return {}
+    pivot = period_totals.pivot(index='period', columns='type', values='amount').fillna(0)
+    return pivot.to_dict('index')
+
+def monthly_chart_data(store, username, cycle, window=(None, None)):
+    """{type: {YYYY-MM: amount}} for the dashboard chart; months are billing cycles."""
+    monthly_totals = store.period_totals(username, 'month', *cycle, *window)
+    monthly_data = {}
+    for type_val in EXPENSE_TYPES:
+        type_df = monthly_totals[monthly_totals['type'] == type_val]
+        monthly_data[type_val] = dict(zip(type_df['period'], type_df['amount']))
+    return monthly_data
+
+def period_trends(period):
+    return lambda store, username, cycle, window: pivot_period_totals(
+        store.period_totals(username, period, *cycle, *window))
+
+def category_chart(expense_type):
+    return lambda store, username, cycle, window: store.category_totals(username, expense_type, *window)
+
+def series_payload(series):
+    """{YYYY-MM-DD: value} for a date-indexed series."""
+    return dict(zip(series.index.strftime('%Y-%m-%d'), series.round(2).tolist()))
+
+def frame_payload(frame, orient):
+    """``frame.to_dict(orient)`` rounded to cents, with null for missing values."""
+    return frame.round(2).astype(object).where(frame.notna(), None).to_dict(orient)
+
+def user_budgets(username):
+    """{category: monthly budget} from the user's settings."""
+    return load_user_settings(username)['budgets']
+
+def cash_in_hand_chart(store, username, cycle, window):
+    """{date: cash in hand at the end of that day}."""
+    df = store.dated_amounts(username)
+    return series_payload(analytics.running_balance(df['date'], df['type'], df['amount'], *window))
+
+def spend_rolling_averages(store, username, cycle, window):
+    """Spend per category per billing cycle, with its 3/6/12-cycle rolling averages."""
+    # Averages at the start of the window look back before it, so roll over
+    # the whole history and cut the window out afterwards
+    matrix = store.category_period_totals(username, 'Spend', 'month', *cycle)
+    averages = analytics.rolling_averages(matrix)
+    start_date, end_date = window
+    rows = pd.Series(True, index=matrix.index)
+    if start_date:
+        rows &= matrix.index >= periods.current_period('month', *cycle, today=start_date)
+    if end_date:
+        rows &= matrix.index <= periods.current_period('month', *cycle, today=end_date)
+    return {
+        'periods': matrix.index[rows].tolist(),
+        'totals': frame_payload(matrix[rows.to_numpy()], 'list'),
+        'averages': {str(months): frame_payload(frame[rows.to_numpy()], 'list') for months, frame in averages.items()},
+    }
+
+def budget_burn_chart(store, username, cycle, window):
+    """Current billing cycle's spend against the monthly budgets, projected to the cycle's end."""
+    spends = filter_expenses(store.dated_amounts(username), expense_type='Spend')
+    burn = analytics.budget_burn(spends['date'], spends['category'], spends['amount'],
+                                 user_budgets(username), cycle[0])
+    table = burn['categories']
+    return {
+        'period': burn['period'],
+        'start': burn['start'].strftime('%Y-%m-%d'),
+        'end': burn['end'].strftime('%Y-%m-%d'),
+        'days_elapsed': burn['days_elapsed'],
+        'days_in_period': burn['days_in_period'],
+        'spent': round(float(table['spent'].sum()), 2),
+        'projected': round(float(table['projected'].sum()), 2),
+        'budget': round(float(table['budget'].sum()), 2) if table['budget'].notna().any() else None,
+        'spent_to_date': series_payload(burn['spent_to_date']),
+        'categories': frame_payload(table, 'index'),
+    }
+
+# Chart payloads served by /api/charts/<name>; builders take the user's
+# (start day, financial year start) cycle settings and a (start, end) date window
+CHARTS = {
+    'monthly': monthly_chart_data,
+    'spend_categories': category_chart('Spend'),
+    'investment_categories': category_chart('Investment'),
+    'savings_categories': category_chart('Savings'),
+    'weekly_trends': period_trends('week'),
+    'monthly_trends': period_trends('month'),
+    'quarterly_trends': period_trends('quarter'),
+    'yearly_trends': period_trends('year'),
+    'financial_year_trends': period_trends('financial_year'),
+    'cash_in_hand': cash_in_hand_chart,
+    'spend_rolling_averages': spend_rolling_averages,
+    'budget_burn': budget_burn_chart,
+}
+
+def chart_inputs(name, username):
+    """What a chart depends on besides the ledger, cycle settings and window (part of its cache key)."""
+    if name == 'budget_burn':
+        # The projection moves every day, and with the budgets
+        return (pd.Timestamp.now().strftime('%Y-%m-%d'), tuple(sorted(user_budgets(username).items())))
+    return ()
+# What ?last=N counts for each chart (default: months)
+CHART_PERIODS = {'weekly_trends': 'week', 'quarterly_trends': 'quarter', 'yearly_trends': 'year',
+                 'financial_year_trends': 'financial_year'}
+
+def chart_window(name, cycle):
+    """(start_date, end_date) from ?start_date=&end_date= or ?last=N (the N most recent cycles)."""
+    start_date = request.args.get('start_date') or None
+    end_date = request.args.get('end_date') or None
+    last = request.args.get('last', type=int)
+    if last and last > 0:
+        start_date = periods.recent_start(last, CHART_PERIODS.get(name, 'month'), *cycle).strftime('%Y-%m-%d')
+    # Normalise so equivalent requests share a cache entry; raises ValueError on bad dates
+    start_date, end_date = (pd.Timestamp(value).strftime('%Y-%m-%d') if value else None
+                            for value in (start_date, end_date))
+    return start_date, end_date
+
+@app.route('/api/charts/<name>')
+@login_required
+def api_chart(name):
+    if name not in CHARTS:
+        return jsonify({'success': False, 'message': f'Unknown chart {name}'}), 404
+    cycle = cycle_settings(current_user.username)
+    try:
+        window = chart_window(name, cycle)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Invalid date range: {str(e)}'}), 400
+    # Cycle settings are part of the key, so changing start_date rebuilds the charts
+    build = lambda: CHARTS[name](get_ledger_store(), current_user.username, cycle, window)
+    return cached_json_response(f'chart:{name}', (*cycle, *window, *chart_inputs(name, current_user.username)),
+                                build)
+
 @app.route('/analysis')
 @login_required
 def analysis():
-    df = load_user_expenses(current_user.username)
     settings = load_user_settings(current_user.username)
     
-    # Process data for charts
-    if not df.empty:
-        # Category breakdown for pie charts
-        spend_category_data = df[df['type'] == 'Spend'].groupby('category')['amount'].sum().to_dict()
-        investment_category_data = df[df['type'] == 'Investment'].groupby('category')['amount'].sum().to_dict()
-        savings_category_data = df[df['type'] == 'Savings'].groupby('category')['amount'].sum().to_dict()
-        
-        # Monthly trend for all types
-        df['month'] = df['date'].dt.strftime('%Y-%m')
-        monthly_trends = df.groupby(['month', 'type'])['amount'].sum().reset_index()
-        monthly_trends_dict = monthly_trends.pivot(index='month', columns='type', values='amount').fillna(0).to_dict('index')
-        
-        # Yearly trends
-        df['year'] = df['date'].dt.year
-        yearly_trends = df.groupby(['year', 'type'])['amount'].sum().reset_index()
-        yearly_trends_dict = yearly_trends.pivot(index='year', columns='type', values='amount').fillna(0).to_dict('index')
-    else:
-        spend_category_data = {}
-        investment_category_data = {}
-        savings_category_data = {}
-        monthly_trends_dict = {}
-        yearly_trends_dict = {}
-    
-    return render_template('analysis.html', 
-                          spend_category_data=json.dumps(spend_category_data),
-                          investment_category_data=json.dumps(investment_category_data),
-                          savings_category_data=json.dumps(savings_category_data),
-                          monthly_trends=json.dumps(monthly_trends_dict),
-                          yearly_trends=json.dumps(yearly_trends_dict),
-                          settings=settings)
+    # Only the page shell: each chart fetches its own /api/charts/<name> data
+    return render_template('analysis.html', settings=settings)
+
+# Periods the household report can be broken down by; all are whole calendar
+# months, since every member may cut their own billing cycles differently
+HOUSEHOLD_PERIODS = ('month', 'quarter', 'year', 'financial_year')
+
+def household_usernames():
+    return sorted(user.username for user in users.values())
+
+def household_report_data(usernames, window, period, fiscal_start, versions):
+    """Combined totals over every member's ledger, plus each member's totals by type."""
+    partials, unavailable = get_household_report().partials(usernames, *window, versions=versions)
+    with metrics.phase('aggregate'):
+        combined = household.combine(partials.values())
+        trends = periods.period_totals(pd.to_datetime(combined['period'], format='%Y-%m'), combined['type'],
+                                       combined['amount'], period, 1, fiscal_start)
+        return {
+            'types': combined.groupby('type')['amount'].sum().to_dict(),
+            'trends': pivot_period_totals(trends),
+            'categories': {expense_type: combined[combined['type'] == expense_type]
+                           .groupby('category')['amount'].sum().to_dict()
+                           for expense_type in EXPENSE_TYPES},
+            'members': {username: partial.groupby('type')['amount'].sum().to_dict()
+                        for username, partial in partials.items()},
+            'records': int(combined['count'].sum()),
+            'unavailable': unavailable,
+        }
+
+@app.route('/household')
+@login_required
+def household_report():
+    if not current_user.is_admin:
+        flash('The household report is only available to admins')
+        return redirect(url_for('dashboard'))
+    settings = load_user_settings(current_user.username)
+    return render_template('household.html', settings=settings, members=household_usernames())
+
+@app.route('/api/household')
+@login_required
+def api_household():
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'The household report is only available to admins'}), 403
+    period = request.args.get('period', 'month')
+    if period not in HOUSEHOLD_PERIODS:
+        return jsonify({'success': False, 'message': f'Unknown period {period}'}), 400
+    try:
+        window = tuple(pd.Timestamp(value).strftime('%Y-%m-%d') if value else None
+                       for value in (request.args.get('start_date'), request.args.get('end_date')))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Invalid date range: {str(e)}'}), 400
+    fiscal_start = cycle_settings(current_user.username)[1]
+    usernames = household_usernames()
+
+    # The report changes whenever any member's ledger does; their data
+    # versions are cheap to read, so a revalidation loads no records
+    store = get_ledger_store()
+    versions = get_household_report().versions(usernames)
+    key = (store.name, store.data_dir, 'household', (*window, period, fiscal_start))
+    version = tuple(sorted(versions.items()))
+    etag = hashlib.sha1(repr((key, version)).encode('utf-8')).hexdigest()[:24]
+    build = lambda: household_report_data(usernames, window, period, fiscal_start, versions)
+    return versioned_json_response(key, version, etag, build)
+
+def settings_changes(form):
+    """Fields a settings form submission sets; fields it doesn't carry are left alone."""
+    changes = {}
+    if 'categories[]' in form:
+        changes['categories'] = [cat.strip() for cat in form.getlist('categories[]') if cat.strip()]
+    for field in ('currency', 'start_date', 'financial_year_start'):
+        if form.get(field):
+            changes[field] = form[field]
+    if 'budget_categories[]' in form:
+        # A blank amount means no budget for that category
+        changes['budgets'] = {category: amount for category, amount
+                              in zip(form.getlist('budget_categories[]'), form.getlist('budget_amounts[]'))
+                              if amount.strip()}
+    return changes
 
 @app.route('/settings', methods=['GET', 'POST'])
 @login_required
 def settings():
-    current_settings = load_user_settings(current_user.username)
-    
     if request.method == 'POST':
-        action = request.form.get('action')
-        
-        if action == 'save_categories':
-            categories = [cat.strip() for cat in request.form.getlist('categories[]') if cat.strip()]
-            current_settings['categories'] = categories
-            save_user_settings(current_user.username, current_settings)
-            flash('Categories saved successfully')
-        
-        elif action == 'save_currency':
-            currency = request.form.get('currency')
-            if currency:
-                current_settings['currency'] = currency
-                save_user_settings(current_user.username, current_settings)
-                flash('Currency setting saved successfully')
-        
-        elif action == 'save_start_date':
-            start_date = request.form.get('start_date')
-            if start_date and start_date.isdigit() and 1 <= int(start_date) <= 31:
-                current_settings['start_date'] = int(start_date)
-                save_user_settings(current_user.username, current_settings)
-                flash('Start date setting saved successfully')
-        
+        # The whole form is saved in one validated, atomic write
+        changes = settings_changes(request.form)
+        if changes:
+            try:
+                update_user_settings(current_user.username, changes)
+                flash('Settings saved successfully')
+            except SettingsError as e:
+                flash(f'Settings not saved: {e}')
         return redirect(url_for('settings'))
     
-    return render_template('settings.html', settings=current_settings)
+    return render_template('settings.html', settings=load_user_settings(current_user.username))
 
 @app.route('/expenses', methods=['GET', 'POST', 'PUT', 'DELETE'])
 @login_required
 def manage_expenses():
     if request.method == 'GET':
-        df = load_user_expenses(current_user.username)
         settings = load_user_settings(current_user.username)
-        return render_template('expenses.html', expenses=df.to_dict('records'), settings=settings)
+        # Rows are fetched page by page from /api/expenses/page
+        return render_template('expenses.html', settings=settings, page_size=DEFAULT_PAGE_SIZE)
     
     elif request.method == 'POST':
-        data_path = get_user_data_path(current_user.username)
-        
         date = request.form.get('date')
         expense_type = request.form.get('type')
         category = request.form.get('category')
@@ -315,63 +723,22 @@ def manage_expenses():
             # Force amount to be float
             amount = float(amount)
             
-            # Read existing data first to ensure we don't lose records
-            existing_data = []
-            if os.path.exists(data_path) and os.path.getsize(data_path) > 0:
-                try:
-                    with open(data_path, 'r', encoding='utf-8') as f:
-                        # Read and parse CSV manually to avoid pandas issues
-                        import csv
-                        reader = csv.DictReader(f)
-                        for row in reader:
-                            existing_data.append(row)
-                except Exception as e:
-                    print(f"Error reading existing file: {str(e)}")
-            
-            # Find the highest ID or start at 1
-            max_id = 0
-            for record in existing_data:
-                try:
-                    record_id = int(record['id'])
-                    if record_id > max_id:
-                        max_id = record_id
-                except (ValueError, KeyError):
-                    pass
-            
-            new_id = max_id + 1
-            
-            # Format the date consistently (without time component)
-            formatted_date = date  # Already in YYYY-MM-DD format from the form
-            
-            # Create new record
+            # Create new record (date is already in YYYY-MM-DD format from the form)
             new_record = {
-                'id': str(new_id),
-                'date': formatted_date,
+                'date': date,
                 'type': expense_type,
                 'category': category,
                 'amount': str(amount),
                 'description': description or ''
             }
-            
-            # Add to existing data
-            existing_data.append(new_record)
-            
-            # Write all data back to file
-            with open(data_path, 'w', newline='', encoding='utf-8') as f:
-                if existing_data:
-                    writer = csv.DictWriter(f, fieldnames=['id', 'date', 'type', 'category', 'amount', 'description'])
-                    writer.writeheader()
-                    writer.writerows(existing_data)
-            
-            # Print debug info
-            print(f"Added new record with ID {new_id}. Total records: {len(existing_data)}")
-            print(f"CSV file size after write: {os.path.getsize(data_path)} bytes")
+            new_id = get_ledger_store().add(current_user.username, new_record)
+            log.debug('Added new record with ID %s', new_id)
             
             flash('Expense added successfully')
             
         except Exception as e:
             error_msg = f'Error adding expense: {str(e)}'
-            print(f"EXCEPTION: {error_msg}")
+            log.exception(error_msg)
             flash(error_msg)
         
         return redirect(url_for('manage_expenses'))
@@ -379,20 +746,15 @@ def manage_expenses():
 @app.route('/expenses/<int:expense_id>', methods=['PUT', 'DELETE'])
 @login_required
 def expense_operations(expense_id):
-    data_path = get_user_data_path(current_user.username)
-    df = load_user_expenses(current_user.username)
+    store = get_ledger_store()
     
     if request.method == 'PUT':
         data = request.get_json()
         
         try:
             # Find the record by ID and update it
-            idx = df[df['id'] == expense_id].index[0]
-            for key, value in data.items():
-                if key in df.columns:
-                    df.at[idx, key] = value
-            
-            df.to_csv(data_path, index=False)
+            if not store.update(current_user.username, expense_id, data):
+                return jsonify({'success': False, 'message': 'Expense not found'}), 404
             return jsonify({'success': True, 'message': 'Expense updated successfully'})
         except Exception as e:
             return jsonify({'success': False, 'message': f'Error updating expense: {str(e)}'}), 400
@@ -400,36 +762,217 @@ def expense_operations(expense_id):
     elif request.method == 'DELETE':
         try:
             # Remove the record by ID
-            df = df[df['id'] != expense_id]
-            df.to_csv(data_path, index=False)
+            if not store.delete(current_user.username, expense_id):
+                return jsonify({'success': False, 'message': 'Expense not found'}), 404
             return jsonify({'success': True, 'message': 'Expense deleted successfully'})
         except Exception as e:
             return jsonify({'success': False, 'message': f'Error deleting expense: {str(e)}'}), 400
 
+def expense_filters_from_args(args):
+    """Read the /api/expenses filter parameters from a request's query string.
+
+    Dates come back as YYYY-MM-DD; raises ValueError if one isn't a date.
+    """
+    start_date, end_date = (pd.Timestamp(value).strftime('%Y-%m-%d') if value else None
+                            for value in (args.get('start_date'), args.get('end_date')))
+    return {
+        'start_date': start_date,
+        'end_date': end_date,
+        'category': args.get('category'),
+        'expense_type': args.get('type'),
+        'min_amount': args.get('min_amount', type=float),
+        'max_amount': args.get('max_amount', type=float),
+        'search': args.get('search'),
+    }
+
+def encode_page_cursor(record, sort):
+    value = record[sort]
+    if sort == 'date':
+        value = value.strftime('%Y-%m-%d %H:%M:%S')
+    elif sort == 'amount':
+        value = 0 if pd.isna(value) else float(value)
+    elif sort == 'id':
+        value = int(value)
+    payload = json.dumps([sort, value, int(record['id'])]).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii')
+
+def decode_page_cursor(token, sort):
+    sort_field, value, last_id = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    if sort_field != sort:
+        raise ValueError('Cursor was issued for a different sort order')
+    return value, int(last_id)
+
+def filters_cache_params(filters):
+    return tuple(sorted((key, value) for key, value in filters.items() if value not in (None, '')))
+
 @app.route('/api/expenses')
 @login_required
 def api_expenses():
-    df = load_user_expenses(current_user.username)
+    try:
+        filters = expense_filters_from_args(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Invalid date range: {str(e)}'}), 400
+    # Ranked full-text search over descriptions, best match first (see search.py)
+    query = request.args.get('q', '').strip()
     
-    # Apply filters if provided
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
-    category = request.args.get('category')
-    expense_type = request.args.get('type')
+    def build():
+        store = get_ledger_store()
+        if query:
+            df = store.search(current_user.username, query, **filters)
+        else:
+            # Apply filters if provided
+            df = store.query(current_user.username, **filters)
+        # Dates as strings for JSON serialization
+        return expense_records(df)
     
-    if start_date:
-        df = df[df['date'] >= pd.to_datetime(start_date)]
-    if end_date:
-        df = df[df['date'] <= pd.to_datetime(end_date)]
-    if category:
-        df = df[df['category'] == category]
-    if expense_type:
-        df = df[df['type'] == expense_type]
+    return cached_json_response('expenses', (filters_cache_params(filters), query), build)
+
+@app.route('/api/expenses/page')
+@login_required
+def api_expenses_page():
+    """One page of records for the expenses table, sorted and filtered server-side."""
+    sort = request.args.get('sort', 'date')
+    descending = request.args.get('order', 'desc') != 'asc'
+    limit = min(max(request.args.get('limit', 50, type=int), 1), MAX_PAGE_SIZE)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    if sort not in SORTABLE_COLUMNS:
+        return jsonify({'success': False, 'message': f'Cannot sort by {sort}'}), 400
+    
+    cursor = None
+    if request.args.get('cursor'):
+        try:
+            cursor = decode_page_cursor(request.args['cursor'], sort)
+        except (ValueError, TypeError):
+            return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
+    
+    try:
+        filters = expense_filters_from_args(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Invalid date range: {str(e)}'}), 400
     
-    # Convert dates to string for JSON serialization
-    df['date'] = df['date'].dt.strftime('%Y-%m-%d')
+    def build():
+        df, total, has_more = get_ledger_store().page(current_user.username, filters=filters,
+                                                      sort=sort, descending=descending,
+                                                      limit=limit, offset=offset, cursor=cursor)
+        next_cursor = encode_page_cursor(df.iloc[-1], sort) if has_more else None
+        return {
+            'items': expense_records(df),
+            'total': total,
+            'limit': limit,
+            'offset': None if cursor else offset,
+            'next_cursor': next_cursor,
+        }
     
-    return jsonify(df.to_dict('records'))
+    params = (filters_cache_params(filters), sort, descending, limit, offset, cursor)
+    return cached_json_response('expenses_page', params, build)
+
+def iter_csv_export(chunks):
+    yield (','.join(EXPENSE_COLUMNS) + '\n').encode('utf-8')
+    for chunk in chunks:
+        chunk = chunk.assign(date=format_expense_dates(chunk['date']))
+        yield chunk.to_csv(index=False, header=False, columns=EXPENSE_COLUMNS).encode('utf-8')
+
+def iter_json_export(chunks):
+    yield b'['
+    first = True
+    for chunk in chunks:
+        chunk = chunk.assign(date=format_expense_dates(chunk['date']))
+        # to_json renders a "[...]" array; splice its contents into ours
+        records = chunk[EXPENSE_COLUMNS].to_json(orient='records')[1:-1]
+        yield (records if first else ',' + records).encode('utf-8')
+        first = False
+    yield b']'
+
+def iter_gzip(parts):
+    compressor = zlib.compressobj(wbits=31)  # 31 selects the gzip container
+    for part in parts:
+        compressed = compressor.compress(part)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def export_body(chunks, username, fmt, compress=False):
+    """(byte chunks, mimetype, filename) of a CSV or JSON export of ``chunks``."""
+    if fmt == 'csv':
+        body, mimetype = iter_csv_export(chunks), 'text/csv'
+    else:
+        body, mimetype = iter_json_export(chunks), 'application/json'
+    filename = f"{username}_expenses.{fmt}"
+    if compress:
+        body, mimetype, filename = iter_gzip(body), 'application/gzip', f"{filename}.gz"
+    return body, mimetype, filename
+
+def export_response(store, username, fmt, filters, compress=False):
+    """Stream the user's ledger as a CSV or JSON download, chunk by chunk."""
+    chunks = store.iter_chunks(username, filters, chunk_size=EXPORT_CHUNK_SIZE)
+    body, mimetype, filename = export_body(chunks, username, fmt, compress)
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+def export_job(job, store, username, fmt, filters, compress):
+    """Background export: writes the file next to the job for /jobs/<id>/download."""
+    total = max(store.count(username), 1)
+    exported = 0
+
+    def counted(chunks):
+        nonlocal exported
+        for chunk in chunks:
+            yield chunk
+            exported += len(chunk)
+            job.update(exported / total, f"{exported:,} records exported")
+
+    chunks = counted(store.iter_chunks(username, filters, chunk_size=EXPORT_CHUNK_SIZE))
+    body, mimetype, filename = export_body(chunks, username, fmt, compress)
+    path = get_job_runner().output_path(job.id)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as file:
+        for part in body:
+            file.write(part)
+    os.replace(tmp_path, path)
+    job.set_output(filename, mimetype)
+    return {'records': exported, 'message': f'Exported {exported:,} records'}
+
+def import_summary(username, report):
+    """Save (or clear) the import error report and describe the import for the user."""
+    report_path = get_user_import_report_path(username)
+    if report.errors:
+        report.write_errors(report_path)
+    elif os.path.exists(report_path):
+        os.remove(report_path)
+    
+    message = f'Imported {report.imported:,} records in {report.seconds:.2f}s ({report.rows_per_second:,.0f} rows/sec)'
+    if report.duplicates:
+        message += f', skipped {report.duplicates:,} duplicates'
+    if report.failed:
+        message += f', {report.failed:,} rows had errors (see the error report)'
+    return message
+
+def import_job(job, store, username, upload_path, fmt, mode):
+    """Background import of an upload staged at ``upload_path``."""
+    size = os.path.getsize(upload_path)
+    try:
+        with open(upload_path, 'rb') as file:
+            def progress(report):
+                job.update(file.tell() / size if size else 1.0, f"{report.imported:,} records imported")
+            report = run_import(store, username, file, fmt, mode=mode, chunk_size=IMPORT_CHUNK_SIZE,
+                                progress=progress)
+    finally:
+        os.remove(upload_path)
+    return {'imported': report.imported, 'duplicates': report.duplicates, 'failed': report.failed,
+            'message': import_summary(username, report)}
+
+def rebuild_job(job, store, username):
+    records = store.rebuild_indexes(username)
+    return {'records': records, 'message': f'Rebuilt indexes over {records:,} records'}
+
+def submit_job(kind, func, *args, description=''):
+    """Queue a job for the current user; flashes and returns None if they have too many."""
+    try:
+        return get_job_runner().submit(current_user.username, kind, func, get_ledger_store(),
+                                       current_user.username, *args, description=description)
+    except JobLimitError as e:
+        flash(str(e))
+        return None
 
 @app.route('/import_export', methods=['GET', 'POST'])
 @login_required
@@ -439,31 +982,28 @@ def import_export():
     if request.method == 'POST':
         action = request.form.get('action')
         
-        if action == 'export_csv':
-            # We'll return the current data as a download
-            data_path = get_user_data_path(current_user.username)
-            if os.path.exists(data_path):
-                return send_file(data_path, as_attachment=True, download_name=f"{current_user.username}_expenses.csv")
-            else:
+        if action in ('export_csv', 'export_json'):
+            store = get_ledger_store()
+            count = store.count(current_user.username)
+            if count == 0:
                 flash('No data to export')
-        
-        elif action == 'export_json':
-            df = load_user_expenses(current_user.username)
-            if not df.empty:
-                # Convert to JSON format
-                df['date'] = df['date'].dt.strftime('%Y-%m-%d')
-                json_data = df.to_dict('records')
-                
-                # Save to temp file and return
-                json_path = os.path.join(app.config['DATA_DIR'], f"{current_user.username}_expenses.json")
-                with open(json_path, 'w') as f:
-                    json.dump(json_data, f)
-                
-                return send_file(json_path, as_attachment=True, download_name=f"{current_user.username}_expenses.json")
             else:
-                flash('No data to export')
+                # Exports accept the same filters as /api/expenses
+                try:
+                    filters = expense_filters_from_args(request.form)
+                except ValueError as e:
+                    flash(f'Invalid date range: {str(e)}')
+                    return redirect(request.url)
+                fmt, compress = action[len('export_'):], bool(request.form.get('gzip'))
+                if count < app.config['JOB_EXPORT_MIN_ROWS']:
+                    return export_response(store, current_user.username, fmt, filters, compress=compress)
+                # Large ledgers are written out in the background and downloaded from the job list
+                if submit_job('export', export_job, fmt, filters, compress,
+                              description=f'{fmt.upper()} export of {count:,} records'):
+                    flash('Your export is being prepared; download it from Background Jobs below when it is ready')
         
-        elif action == 'import_csv':
+        elif action in ('import_csv', 'import_json'):
+            fmt = action[len('import_'):]
             if 'file' not in request.files:
                 flash('No file selected')
                 return redirect(request.url)
@@ -473,93 +1013,129 @@ def import_export():
                 flash('No file selected')
                 return redirect(request.url)
             
-            if not file.filename.endswith('.csv'):
-                flash('Only CSV files are allowed')
+            if not file.filename.endswith(f'.{fmt}'):
+                flash(f'Only {fmt.upper()} files are allowed')
                 return redirect(request.url)
             
+            mode = 'merge' if request.form.get('mode') == 'merge' else 'replace'
+            if (request.content_length or 0) >= app.config['JOB_IMPORT_MIN_MB'] * 1024 * 1024:
+                # Stage the upload and import it in the background
+                runner = get_job_runner()
+                job_id = runner.new_id()
+                upload_path = runner.output_path(job_id, f'.upload.{fmt}')
+                file.save(upload_path)
+                try:
+                    runner.submit(current_user.username, 'import', import_job, get_ledger_store(),
+                                  current_user.username, upload_path, fmt, mode, job_id=job_id,
+                                  description=f'{fmt.upper()} import ({mode}) of {file.filename}')
+                except JobLimitError as e:
+                    os.remove(upload_path)
+                    flash(str(e))
+                else:
+                    flash(f'Importing {file.filename} in the background; progress is shown under Background Jobs')
+                return redirect(request.url)
             try:
-                # Read the uploaded file
-                df = pd.read_csv(file)
-                
-                # Validate required columns
-                required_cols = ['date', 'type', 'category', 'amount', 'description']
-                if not all(col in df.columns for col in required_cols):
-                    flash('Invalid format: Missing required columns')
-                    return redirect(request.url)
-                
-                # Convert date strings to datetime objects
-                df['date'] = pd.to_datetime(df['date'])
-                
-                # Generate IDs if not present
-                if 'id' not in df.columns:
-                    df['id'] = range(1, len(df) + 1)
-                
-                # Save to user's data file
-                data_path = get_user_data_path(current_user.username)
-                df.to_csv(data_path, index=False)
-                
-                flash('Data imported successfully')
+                report = run_import(get_ledger_store(), current_user.username, file.stream, fmt,
+                                    mode=mode, chunk_size=IMPORT_CHUNK_SIZE)
             except Exception as e:
                 flash(f'Error importing data: {str(e)}')
-        
-        elif action == 'import_json':
-            if 'file' not in request.files:
-                flash('No file selected')
-                return redirect(request.url)
-            
-            file = request.files['file']
-            if file.filename == '':
-                flash('No file selected')
                 return redirect(request.url)
             
-            if not file.filename.endswith('.json'):
-                flash('Only JSON files are allowed')
-                return redirect(request.url)
-            
-            try:
-                # Read the uploaded JSON file
-                json_data = json.load(file)
-                
-                # Convert to DataFrame
-                df = pd.DataFrame(json_data)
-                
-                # Validate required columns
-                required_cols = ['date', 'type', 'category', 'amount', 'description']
-                if not all(col in df.columns for col in required_cols):
-                    flash('Invalid format: Missing required columns')
-                    return redirect(request.url)
-                
-                # Convert date strings to datetime objects
-                df['date'] = pd.to_datetime(df['date'])
-                
-                # Generate IDs if not present
-                if 'id' not in df.columns:
-                    df['id'] = range(1, len(df) + 1)
-                
-                # Save to user's data file
-                data_path = get_user_data_path(current_user.username)
-                df.to_csv(data_path, index=False)
-                
-                flash('Data imported successfully')
-            except Exception as e:
-                flash(f'Error importing data: {str(e)}')
+            flash(import_summary(current_user.username, report))
+            return redirect(request.url)
+        
+        elif action == 'rebuild_indexes':
+            if submit_job('rebuild', rebuild_job, description='Rebuild indexes'):
+                flash('Rebuilding indexes in the background')
+            return redirect(request.url)
     
-    return render_template('import_export.html', settings=settings)
+    has_error_report = os.path.exists(get_user_import_report_path(current_user.username))
+    jobs = [job_status(job) for job in get_job_runner().jobs_for(current_user.username)]
+    return render_template('import_export.html', settings=settings, has_error_report=has_error_report,
+                           jobs=jobs)
+
+def job_status(job):
+    status = job.to_dict()
+    del status['username'], status['owner']
+    status['url'] = url_for('job_detail', job_id=job.id)
+    status['download_url'] = (url_for('job_download', job_id=job.id)
+                              if job.status == 'done' and job.output_name else None)
+    return status
+
+def current_user_job(job_id):
+    job = get_job_runner().get(job_id)
+    return job if job is not None and job.username == current_user.username else None
+
+@app.route('/jobs')
+@login_required
+def job_list():
+    return jsonify([job_status(job) for job in get_job_runner().jobs_for(current_user.username)])
+
+@app.route('/jobs/<job_id>')
+@login_required
+def job_detail(job_id):
+    job = current_user_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    return jsonify(job_status(job))
+
+@app.route('/jobs/<job_id>/download')
+@login_required
+def job_download(job_id):
+    job = current_user_job(job_id)
+    path = get_job_runner().output_path(job_id) if job else None
+    if job is None or job.status != 'done' or not job.output_name or not os.path.exists(path):
+        flash('That export is not available')
+        return redirect(url_for('import_export'))
+    return send_file(path, mimetype=job.output_mimetype, as_attachment=True, download_name=job.output_name)
+
+@app.route('/import_export/errors')
+@login_required
+def import_error_report():
+    report_path = get_user_import_report_path(current_user.username)
+    if not os.path.exists(report_path):
+        flash('No import error report available')
+        return redirect(url_for('import_export'))
+    return send_file(report_path, mimetype='text/csv', as_attachment=True,
+                     download_name=f"{current_user.username}_import_errors.csv")
 
 @app.route('/profile')
 @login_required
 def profile():
     # Load user settings and expenses to display in profile
     settings = load_user_settings(current_user.username)
-    df = load_user_expenses(current_user.username)
-    expenses = df.to_dict('records') if not df.empty else []
+    expense_count = get_ledger_store().count(current_user.username)
     
-    return render_template('profile.html', user=current_user, settings=settings, expenses=expenses)
+    return render_template('profile.html', user=current_user, settings=settings, expense_count=expense_count)
 
 @app.route('/contact')
 def contact():
     return render_template('contact.html')
 
+@app.cli.command('migrate-storage')
+@click.option('--to', 'backend', default='sqlite', show_default=True,
+              help='Storage backend to copy the CSV ledgers into.')
+@click.option('--overwrite', is_flag=True, help='Replace records already present in the target.')
+def migrate_storage(backend, overwrite):
+    """Copy every *_expenses.csv in DATA_DIR into another storage backend."""
+    target = create_store(backend, app.config['DATA_DIR'], ledger_cache, ledger_categories)
+    migrated = migrate_csv_ledgers(app.config['DATA_DIR'], target, overwrite=overwrite)
+    for username, count in migrated:
+        click.echo(f"Migrated {count} records for {username}")
+    click.echo(f"Done. Set STORAGE_BACKEND={backend} to use the migrated data.")
+
+@app.cli.command('memory-report')
+def memory_report_command():
+    """Show how much memory each configured user's ledger takes once loaded."""
+    store = get_ledger_store()
+    for user in users.values():
+        report = memory_report(store.load(user.username))
+        click.echo(f"{user.username}: {report['rows']:,} records, {report['bytes'] / 1024:,.1f} KiB "
+                   f"({report['default_bytes'] / 1024:,.1f} KiB with default dtypes)")
+        for column, info in report['columns'].items():
+            click.echo(f"  {column:<12} {info['dtype']:<16} {info['bytes'] / 1024:>10,.1f} KiB "
+                       f"(was {info['default_bytes'] / 1024:,.1f} KiB)")
+
 if __name__ == '__main__':
     ttrack = r"""
         _____                              _____               _             
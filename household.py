@@ -0,0 +1,157 @@
+"""Household report: every configured user's ledger rolled into one set of totals.
+
+Each user contributes a partial, the amount and record count per
+(month, type, category) over the requested date range, and the report is
+just those partials merged. For whole months a partial is a slice of the
+user's persisted rollup; a range that splits a month needs every record,
+so those partials are computed in a process pool and the ledgers load and
+reduce on separate cores instead of one after another. The parent process
+only merges the results, which are a few hundred rows each.
+
+Partials are cached per (user, date range) against the user's data
+version, so a repeat report recomputes only the users whose ledgers
+changed since. Workers are started with 'spawn': forking a web server that
+already runs request and job threads could copy a lock one of them holds.
+"""
+import logging
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+from lazy_modules import lazy_import
+from storage import ROLLUP_COLUMNS, LedgerCache, compute_rollups, create_store, filter_expenses, merge_rollups
+
+pd = lazy_import('pandas')
+
+log = logging.getLogger(__name__)
+
+# Stores opened by this worker process, by (backend, data_dir); they keep
+# their rollup memos between tasks, but no parsed ledgers
+_worker_stores = {}
+
+
+def ledger_partial(store, username, start_date=None, end_date=None):
+    """Amount and count per (month, type, category) of ``username``'s records in the range."""
+    rollups = store.rollups_between(username, start_date, end_date)
+    if rollups is None:
+        df = filter_expenses(store.dated_amounts(username), start_date=start_date, end_date=end_date)
+        rollups = compute_rollups(df)
+    return pd.DataFrame(rollups, columns=ROLLUP_COLUMNS).reset_index(drop=True)
+
+
+def worker_partial(backend, data_dir, username, start_date=None, end_date=None):
+    """``ledger_partial`` run inside a pool worker, against its own store."""
+    key = (backend, data_dir)
+    store = _worker_stores.get(key)
+    if store is None:
+        store = _worker_stores[key] = create_store(backend, data_dir, LedgerCache(max_users=1, max_bytes=0))
+    return ledger_partial(store, username, start_date, end_date)
+
+
+class HouseholdReport:
+    """Per-user partials for one store, cached and computed in parallel; see the module docstring."""
+
+    def __init__(self, store, max_workers=4, max_entries=256):
+        self.store = store
+        self.max_workers = max_workers
+        self.max_entries = max_entries
+        self._partials = OrderedDict()  # (username, start_date, end_date) -> (data version, partial)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def versions(self, usernames):
+        """{username: data version}; reads no records."""
+        return {username: self.store.data_version(username) for username in usernames}
+
+    def partials(self, usernames, start_date=None, end_date=None, versions=None):
+        """Return ({username: partial}, [usernames whose ledger couldn't be read])."""
+        if versions is None:
+            versions = self.versions(usernames)
+        found, stale = {}, []
+        with self._lock:
+            for username in usernames:
+                key = (username, start_date, end_date)
+                entry = self._partials.get(key)
+                if entry is not None and entry[0] == versions[username]:
+                    self._partials.move_to_end(key)
+                    found[username] = entry[1]
+                else:
+                    stale.append(username)
+
+        with metrics.phase('aggregate'):
+            computed, failed = self._compute(stale, start_date, end_date)
+        with self._lock:
+            for username, partial in computed.items():
+                # Tagged with the version read before computing: a write that
+                # lands meanwhile makes the next report recompute this user
+                self._partials[(username, start_date, end_date)] = (versions[username], partial)
+                self._partials.move_to_end((username, start_date, end_date))
+            while len(self._partials) > self.max_entries:
+                self._partials.popitem(last=False)
+        found.update(computed)
+        return found, failed
+
+    def _compute(self, usernames, start_date, end_date):
+        computed, failed = {}, []
+        # Whole months come straight from each user's rollup, a small read
+        # that costs less than the round trip to another process; only
+        # ranges that need every record are worth fanning out
+        parallel = len(usernames) > 1 and not self.store.covers_whole_months(start_date, end_date)
+        executor = self._pool() if parallel else None
+        if executor is None:
+            self._compute_here(usernames, start_date, end_date, computed, failed)
+            return computed, failed
+
+        futures = {username: executor.submit(worker_partial, self.store.name, self.store.data_dir,
+                                              username, start_date, end_date)
+                   for username in usernames}
+        retry = []
+        for username, future in futures.items():
+            try:
+                computed[username] = future.result()
+            except BrokenProcessPool:
+                retry.append(username)
+            except Exception:
+                log.exception('Household report: could not read the ledger of %s', username)
+                failed.append(username)
+        if retry:
+            # A worker died (killed, out of memory); start a new pool next
+            # time and finish this report in-process
+            log.warning('Household report: worker pool broke, computing %d ledgers in-process', len(retry))
+            self._discard_pool(executor)
+            self._compute_here(retry, start_date, end_date, computed, failed)
+        return computed, failed
+
+    def _compute_here(self, usernames, start_date, end_date, computed, failed):
+        for username in usernames:
+            try:
+                computed[username] = ledger_partial(self.store, username, start_date, end_date)
+            except Exception:
+                log.exception('Household report: could not read the ledger of %s', username)
+                failed.append(username)
+
+    def _pool(self):
+        if self.max_workers <= 1:
+            return None
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.max_workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _discard_pool(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def combine(partials):
+    """Merge per-user partials into one (period, type, category, amount, count) frame."""
+    frames = [partial for partial in partials if not partial.empty]
+    if not frames:
+        return pd.DataFrame(columns=ROLLUP_COLUMNS)
+    return merge_rollups(*frames)
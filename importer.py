@@ -0,0 +1,241 @@
+"""Streaming import of CSV/JSON uploads into a user's ledger.
+
+Uploads are read in fixed-size chunks, every row is validated and coerced
+on its own, and bad rows are collected into an error report instead of
+aborting the whole import. In merge mode rows already present in the
+ledger (same date, amount and description) are skipped.
+"""
+import codecs
+import csv
+import json
+import time
+
+from lazy_modules import lazy_import
+from storage import EXPENSE_TYPES, format_expense_dates, parse_expense_dates
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+IMPORT_COLUMNS = ['date', 'type', 'category', 'amount', 'description']
+REQUIRED_COLUMNS = ['date', 'type', 'category', 'amount']
+# Keep the report bounded even for a file where every row is wrong
+MAX_REPORTED_ERRORS = 10000
+
+_TYPE_LOOKUP = {expense_type.lower(): expense_type for expense_type in EXPENSE_TYPES}
+
+
+class ImportFormatError(ValueError):
+    """The upload as a whole cannot be imported (bad header, not JSON, ...)."""
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.errors = []  # (row number, field, value, message)
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        processed = self.imported + self.duplicates + self.failed
+        return processed / self.seconds if self.seconds else 0.0
+
+    def add_errors(self, errors):
+        self.failed += len({error[0] for error in errors})
+        room = MAX_REPORTED_ERRORS - len(self.errors)
+        self.errors.extend(errors[:max(room, 0)])
+
+    def write_errors(self, path):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['row', 'field', 'value', 'error'])
+            writer.writerows(self.errors)
+
+
+def iter_csv_upload(stream, chunk_size):
+    try:
+        reader = pd.read_csv(stream, dtype=str, keep_default_na=False, chunksize=chunk_size)
+        for chunk in reader:
+            yield chunk
+    except pd.errors.EmptyDataError:
+        raise ImportFormatError('The file is empty')
+    except pd.errors.ParserError as e:
+        raise ImportFormatError(f'Could not parse CSV: {e}')
+
+
+def iter_json_records(stream, read_size=65536):
+    """Yield the objects of a top-level JSON array without loading it whole."""
+    decoder = json.JSONDecoder()
+    # Incremental, so a multi-byte character split across two reads survives
+    text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    buffer, pos, eof = '', 0, False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        data = stream.read(read_size)
+        eof = not data
+        if isinstance(data, bytes):
+            data = text_decoder.decode(data, final=eof)
+        buffer, pos = buffer[pos:] + data, 0
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+
+    fill()
+    skip_whitespace()
+    if buffer[pos:pos + 1] != '[':
+        raise ImportFormatError('Expected a JSON array of records')
+    pos += 1
+    expect_value = True
+    while True:
+        skip_whitespace()
+        if pos >= len(buffer):
+            raise ImportFormatError('Unexpected end of JSON file')
+        if buffer[pos] == ']':
+            return
+        if not expect_value:
+            if buffer[pos] != ',':
+                raise ImportFormatError(f'Expected "," between records at offset {pos}')
+            pos += 1
+            expect_value = True
+            continue
+        try:
+            record, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise ImportFormatError('Invalid JSON record')
+            fill()
+            continue
+        if end == len(buffer) and not eof:
+            # A number may continue in the next block; decode it again with more data
+            fill()
+            continue
+        pos = end
+        expect_value = False
+        yield record
+
+
+def iter_json_upload(stream, chunk_size):
+    batch = []
+    for record in iter_json_records(stream):
+        if not isinstance(record, dict):
+            raise ImportFormatError('Each JSON record must be an object')
+        batch.append(record)
+        if len(batch) == chunk_size:
+            yield pd.DataFrame(batch)
+            batch = []
+    if batch:
+        yield pd.DataFrame(batch)
+
+
+def _as_text(column):
+    return column.astype(object).where(column.notna(), '').astype(str).str.strip()
+
+
+def validate_chunk(chunk, first_row):
+    """Coerce one chunk of raw rows; return (valid frame, list of row errors)."""
+    rows = pd.Series(np.arange(first_row, first_row + len(chunk)), index=chunk.index)
+    text = {column: _as_text(chunk[column]) if column in chunk else pd.Series('', index=chunk.index)
+            for column in IMPORT_COLUMNS}
+
+    dates = parse_expense_dates(text['date'].mask(text['date'] == ''))
+    types = text['type'].str.lower().map(_TYPE_LOOKUP)
+    # Tolerate thousands separators and currency symbols ("₹1,200.50")
+    amounts = pd.to_numeric(text['amount'].str.replace(r'[^0-9.\-]', '', regex=True), errors='coerce')
+
+    checks = [
+        ('date', dates.isna(), 'Invalid or missing date'),
+        ('type', types.isna(), f"Type must be one of {', '.join(EXPENSE_TYPES)}"),
+        ('category', text['category'] == '', 'Missing category'),
+        ('amount', amounts.isna(), 'Invalid or missing amount'),
+    ]
+    errors = []
+    invalid = pd.Series(False, index=chunk.index)
+    for field, failed, message in checks:
+        invalid |= failed
+        for row, value in zip(rows[failed], text[field][failed]):
+            errors.append((int(row), field, value, message))
+    errors.sort(key=lambda error: error[0])
+
+    valid = pd.DataFrame({
+        'date': dates,
+        'type': types,
+        'category': text['category'],
+        'amount': amounts,
+        'description': text['description'],
+    })[~invalid]
+    return valid, errors
+
+
+def record_hashes(df):
+    """Hash each record's (date, amount, description) for duplicate detection."""
+    key = pd.DataFrame({
+        'date': format_expense_dates(df['date']),
+        'amount': df['amount'].astype(float).round(2),
+        'description': df['description'].fillna('').astype(str).str.strip(),
+    })
+    return pd.util.hash_pandas_object(key, index=False).to_numpy()
+
+
+def run_import(store, username, stream, fmt, mode='replace', chunk_size=5000, progress=None):
+    """Import an uploaded CSV or JSON stream; returns an ImportReport.
+
+    ``mode`` is 'replace' (the upload becomes the ledger) or 'merge' (rows
+    are appended, skipping ones already in the ledger). Imported records
+    get fresh ids. The ledger is only changed if the upload as a whole is
+    readable; individual bad rows end up in the report. ``progress``, if
+    given, is called with the report after every chunk.
+    """
+    if fmt == 'csv':
+        chunks = iter_csv_upload(stream, chunk_size)
+        first_row = 2  # Line numbers, counting the header as line 1
+    else:
+        chunks = iter_json_upload(stream, chunk_size)
+        first_row = 1  # Position of the record in the array
+
+    report = ImportReport()
+    started = time.perf_counter()
+    writer = store.begin_import(username, replace=(mode == 'replace'))
+    try:
+        # Read the existing rows only once the writer holds the ledger, so a
+        # record added just before the import can't slip past the dedupe
+        seen = set()
+        if mode == 'merge':
+            for existing in store.iter_chunks(username, chunk_size=chunk_size):
+                seen.update(record_hashes(existing).tolist())
+
+        for chunk in chunks:
+            chunk.columns = [str(column).strip().lower() for column in chunk.columns]
+            missing = [column for column in REQUIRED_COLUMNS if column not in chunk.columns]
+            if missing:
+                raise ImportFormatError(f"Invalid format: Missing required columns ({', '.join(missing)})")
+            valid, errors = validate_chunk(chunk, first_row)
+            first_row += len(chunk)
+            report.add_errors(errors)
+
+            if mode == 'merge' and not valid.empty:
+                hashes = record_hashes(valid)
+                fresh = np.array([value not in seen for value in hashes.tolist()], dtype=bool)
+                report.duplicates += int((~fresh).sum())
+                valid = valid[fresh]
+            if not valid.empty:
+                report.imported += writer.write(valid)
+            if progress:
+                progress(report)
+        if mode == 'replace' and report.imported == 0:
+            # Keep the ledger rather than replace it with nothing
+            raise ImportFormatError(f'No valid records to import ({report.failed:,} rows had errors); '
+                                    'your existing records were kept')
+        writer.commit()
+    except BaseException:
+        writer.rollback()
+        raise
+    report.seconds = time.perf_counter() - started
+    return report
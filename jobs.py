@@ -0,0 +1,303 @@
+"""Background jobs: imports, exports and index rebuilds off the request thread.
+
+A JobRunner owns a small thread pool; no broker or extra process is
+involved. At most ``per_user`` of one user's jobs run at a time, so one
+person's large import can't occupy every worker, and at most
+``max_workers`` run in total so the web server's own threads stay free
+for interactive requests.
+
+Each job's state is mirrored to ``<jobs_dir>/<id>.json``, so any worker
+process sharing the data directory can report on it; output files (finished
+exports) and staged uploads live next to it until the job expires. The
+limits are counted from those files too, under a lock on the directory,
+so they hold across every gunicorn worker rather than per process: each
+process queues its own jobs and starts one only when the running jobs on
+disk leave room. A job whose process has exited, or that has been running
+longer than ``max_run_seconds``, is marked failed so it stops taking a slot.
+"""
+import json
+import logging
+import os
+import re
+import socket
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import UserWriteLock, atomic_write_json
+
+log = logging.getLogger(__name__)
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+FINISHED_STATES = ('done', 'failed')
+# Which process queued a job: "<host>:<pid>"
+PROCESS_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobLimitError(RuntimeError):
+    """The user already has as many jobs queued as allowed."""
+
+
+class Job:
+    """One unit of background work; ``update()`` is how the work reports progress."""
+
+    # Write progress to disk at most this often
+    SAVE_INTERVAL = 0.5
+
+    def __init__(self, job_id, username, kind, description=''):
+        self.id = job_id
+        self.username = username
+        self.kind = kind
+        self.description = description
+        self.status = 'queued'
+        self.progress = 0.0
+        self.message = ''
+        self.result = {}
+        self.error = None
+        self.output_name = None
+        self.output_mimetype = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.owner = None  # PROCESS_OWNER of the process that queued it
+        self._runner = None
+        self._saved = 0.0
+
+    def update(self, progress=None, message=None):
+        """Report progress (0..1) and/or a status message."""
+        if progress is not None:
+            self.progress = min(max(float(progress), 0.0), 1.0)
+        if message is not None:
+            self.message = message
+        now = time.monotonic()
+        if self._runner is not None and now - self._saved >= self.SAVE_INTERVAL:
+            self._saved = now
+            self._runner.save(self)
+
+    def set_output(self, name, mimetype):
+        """Mark the job's output file (see JobRunner.output_path) as downloadable."""
+        self.output_name = name
+        self.output_mimetype = mimetype
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'username': self.username,
+            'kind': self.kind,
+            'description': self.description,
+            'status': self.status,
+            'progress': round(self.progress, 4),
+            'message': self.message,
+            'result': self.result,
+            'error': self.error,
+            'output_name': self.output_name,
+            'output_mimetype': self.output_mimetype,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'owner': self.owner,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(data['id'], data['username'], data['kind'], data.get('description', ''))
+        for key in ('status', 'progress', 'message', 'result', 'error', 'output_name',
+                    'output_mimetype', 'created', 'started', 'finished', 'owner'):
+            setattr(job, key, data.get(key, getattr(job, key)))
+        return job
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # Exists, but belongs to someone else
+    return True
+
+
+class JobRunner:
+    """Thread pool whose limits hold across processes; see the module docstring."""
+
+    # How often a process with queued jobs checks whether another process freed a slot
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, jobs_dir, max_workers=2, per_user=1, max_queued=5, keep_seconds=24 * 3600,
+                 max_run_seconds=6 * 3600):
+        self.jobs_dir = jobs_dir
+        self.max_workers = max_workers
+        self.per_user = per_user
+        self.max_queued = max_queued
+        self.keep_seconds = keep_seconds
+        self.max_run_seconds = max_run_seconds
+        os.makedirs(jobs_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='job')
+        self._jobs = {}  # id -> Job, for jobs queued by this process
+        self._waiting = []  # (job, func, args) queued here and not started yet, oldest first
+        self._poller = None
+        self._lock = threading.Lock()
+        # Held while counting jobs on disk and claiming a slot, by every process
+        self._shared = UserWriteLock(os.path.join(jobs_dir, '.lock'))
+
+    def state_path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def output_path(self, job_id, suffix='.out'):
+        """Where a job writes its output (or stages its input)."""
+        return os.path.join(self.jobs_dir, f"{job_id}{suffix}")
+
+    def new_id(self):
+        return uuid.uuid4().hex
+
+    def submit(self, username, kind, func, *args, description='', job_id=None):
+        """Queue ``func(job, *args)``; its return value (a dict) becomes ``job.result``.
+
+        Raises JobLimitError if the user already has ``per_user + max_queued``
+        unfinished jobs, counting those of every process.
+        """
+        self.prune()
+        with self._shared:
+            unfinished = [job for job in self._unfinished_jobs() if job.username == username]
+            if len(unfinished) >= self.per_user + self.max_queued:
+                raise JobLimitError(f'You already have {self.per_user + self.max_queued} jobs waiting; '
+                                    'try again when one finishes')
+            job = Job(job_id or self.new_id(), username, kind, description)
+            job.owner = PROCESS_OWNER
+            job._runner = self
+            self.save(job)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._waiting.append((job, func, args))
+        self._dispatch()
+        return job
+
+    def _dispatch(self):
+        """Start the queued jobs the limits leave room for; poll for room if some must wait."""
+        with self._lock, self._shared:
+            if not self._waiting:
+                return
+            running = Counter(job.username for job in self._unfinished_jobs() if job.status == 'running')
+            total = sum(running.values())
+            for entry in list(self._waiting):
+                job, func, args = entry
+                if total >= self.max_workers:
+                    break
+                if running[job.username] >= self.per_user:
+                    continue
+                self._waiting.remove(entry)
+                # Claimed on disk before the lock is released, so other processes count it
+                job.status, job.started = 'running', time.time()
+                self.save(job)
+                running[job.username] += 1
+                total += 1
+                self._executor.submit(self._run, job, func, args)
+            if self._waiting and self._poller is None:
+                self._poller = threading.Thread(target=self._poll, name='job-poller', daemon=True)
+                self._poller.start()
+
+    def _poll(self):
+        # A slot freed by another process can't notify this one; look again now and then
+        while True:
+            time.sleep(self.POLL_INTERVAL)
+            with self._lock:
+                if not self._waiting:
+                    self._poller = None
+                    return
+            self._dispatch()
+
+    def _run(self, job, func, args):
+        try:
+            job.result = func(job, *args) or {}
+            job.status, job.progress = 'done', 1.0
+        except Exception as e:
+            job.status, job.error = 'failed', str(e)
+            log.exception('Job %s (%s) for %s failed', job.id, job.kind, job.username)
+        finally:
+            job.finished = time.time()
+            self.save(job)
+            # Hand the freed slot to the next queued job
+            self._dispatch()
+
+    def save(self, job):
+        atomic_write_json(self.state_path(job.id), job.to_dict())
+
+    def get(self, job_id):
+        """Return the job, whichever worker process ran it, or None."""
+        if not JOB_ID_PATTERN.match(job_id or ''):
+            return None
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        try:
+            with open(self.state_path(job_id), 'r') as file:
+                return Job.from_dict(json.load(file))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _all_jobs(self):
+        jobs = []
+        for name in os.listdir(self.jobs_dir):
+            if name.endswith('.json'):
+                job = self.get(name[:-len('.json')])
+                if job is not None:
+                    jobs.append(job)
+        return jobs
+
+    def _unfinished_jobs(self):
+        """Queued and running jobs of every process, after expiring abandoned ones."""
+        jobs = []
+        for job in self._all_jobs():
+            if job.status in FINISHED_STATES:
+                continue
+            reason = self._abandoned(job)
+            if reason:
+                job.status, job.error, job.finished = 'failed', reason, time.time()
+                self.save(job)
+                log.warning('Job %s (%s) for %s: %s', job.id, job.kind, job.username, reason)
+            else:
+                jobs.append(job)
+        return jobs
+
+    def _abandoned(self, job):
+        """Why an unfinished job will never finish, or None if it still may."""
+        if job.id in self._jobs:
+            return None  # Ours, and we're running
+        host, _, pid = (job.owner or '').rpartition(':')
+        # Not in our own list, so a job with our pid was left by an earlier process that had it
+        if host == socket.gethostname() and pid.isdigit() and (int(pid) == os.getpid()
+                                                               or not _process_alive(int(pid))):
+            return 'Stopped: the worker process running it exited'
+        # Owned by another machine (or by a version that didn't record owners): go by age
+        if time.time() - (job.started or job.created) > self.max_run_seconds:
+            return 'Stopped: it ran for too long' if job.status == 'running' else 'Stopped: it never started'
+        return None
+
+    def jobs_for(self, username, limit=20):
+        """The user's most recent jobs, newest first (from every worker process)."""
+        with self._shared:
+            self._unfinished_jobs()  # So abandoned jobs show as failed
+        jobs = [job for job in self._all_jobs() if job.username == username]
+        jobs.sort(key=lambda job: job.created, reverse=True)
+        return jobs[:limit]
+
+    def prune(self):
+        """Forget finished jobs older than ``keep_seconds`` and delete their files."""
+        cutoff = time.time() - self.keep_seconds
+        for name in os.listdir(self.jobs_dir):
+            if name.startswith('.'):
+                continue  # The directory's lock file
+            job_id = name.split('.', 1)[0]
+            path = os.path.join(self.jobs_dir, name)
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+                job = self.get(job_id)
+                if job is not None and job.status not in FINISHED_STATES:
+                    continue
+                os.remove(path)
+            except OSError:
+                continue
+            self._jobs.pop(job_id, None)
@@ -0,0 +1,45 @@
+"""Defer importing heavy modules until they are first used.
+
+pandas and numpy account for most of the app's import time, yet a worker
+can answer the login page, /metrics or a 304 revalidation without either.
+Modules on the app's import path bind ``pd = lazy_import('pandas')`` and
+the real import happens on the first attribute access, under a lock so
+two threads racing on a cold worker never see a half-imported module.
+Afterwards the attributes are copied onto the stand-in, so lookups cost
+the same as on the module itself.
+"""
+import importlib
+import sys
+import threading
+import types
+
+
+class LazyModule(types.ModuleType):
+    """Stand-in for a module that is imported on first attribute access."""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._lazy_lock = threading.Lock()
+        self._lazy_module = None
+
+    def _load(self):
+        with self._lazy_lock:
+            if self._lazy_module is None:
+                module = importlib.import_module(self.__name__)
+                self.__dict__.update(module.__dict__)
+                self._lazy_module = module
+        return self._lazy_module
+
+    def __getattr__(self, attr):
+        # Only reached for names not copied over yet (or that the module
+        # itself resolves lazily through a module-level __getattr__)
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_import(name):
+    """Return ``name`` if it is already imported, else a LazyModule for it."""
+    module = sys.modules.get(name)
+    return module if module is not None else LazyModule(name)
@@ -0,0 +1,217 @@
+"""Opt-in request instrumentation, exported in the Prometheus text format.
+
+While a request is being measured (see ``begin_request``), the storage
+layer and the routes mark their work with ``phase('load')`` blocks or the
+``@timed('filter')`` decorator and report ``count_rows`` / ``count_read`` /
+``count_written``. Phases nest, and each records only its own time: a load
+inside a filter counts as load, not as both. With instrumentation off (or
+on a background thread, which never has a request) every hook is a single
+context-variable lookup.
+
+``Registry`` accumulates the finished requests per endpoint and renders
+them for ``/metrics``.
+"""
+import contextvars
+import functools
+import threading
+import time
+from collections import defaultdict
+
+PHASES = ('load', 'filter', 'aggregate', 'write', 'render', 'serialize')
+# Upper bounds (seconds) of the request duration histogram
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current = contextvars.ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    """What one request spent its time on."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = defaultdict(float)  # phase -> seconds, excluding nested phases
+        self.rows = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.status = None
+        self._stack = []  # [phase, started, seconds spent in nested phases]
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        """Value for a Server-Timing header (milliseconds per phase)."""
+        return ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.phases.items())
+
+
+class _Phase:
+    __slots__ = ('stats', 'name')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.stats._stack.append([self.name, time.perf_counter(), 0.0])
+        return self
+
+    def __exit__(self, *exc_info):
+        name, started, nested = self.stats._stack.pop()
+        elapsed = time.perf_counter() - started
+        self.stats.phases[name] += elapsed - nested
+        if self.stats._stack:
+            self.stats._stack[-1][2] += elapsed
+
+
+class _NoPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return None
+
+
+_NO_PHASE = _NoPhase()
+
+
+def begin_request():
+    """Start measuring the current request; returns its RequestStats."""
+    stats = RequestStats()
+    _current.set(stats)
+    return stats
+
+
+def end_request():
+    """Stop measuring; returns the RequestStats, or None if none was started."""
+    stats = _current.get()
+    _current.set(None)
+    return stats
+
+
+def current():
+    return _current.get()
+
+
+def phase(name):
+    """Context manager timing a block as ``name`` (a no-op unless measuring)."""
+    stats = _current.get()
+    return _NO_PHASE if stats is None else _Phase(stats, name)
+
+
+def timed(name):
+    """Decorator form of ``phase``."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stats = _current.get()
+            if stats is None:
+                return func(*args, **kwargs)
+            with _Phase(stats, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count_rows(rows):
+    """Record ``rows`` records scanned by the current request."""
+    stats = _current.get()
+    if stats is not None:
+        stats.rows += rows
+
+
+def count_read(nbytes):
+    stats = _current.get()
+    if stats is not None:
+        stats.bytes_read += nbytes
+
+
+def count_written(nbytes):
+    stats = _current.get()
+    if stats is not None:
+        stats.bytes_written += nbytes
+
+
+def _labels(**labels):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+
+class Registry:
+    """Totals over every measured request, per endpoint (thread-safe)."""
+
+    def __init__(self, prefix='expense_tracker'):
+        self.prefix = prefix
+        self._requests = defaultdict(int)  # (endpoint, method, status) -> count
+        self._durations = {}  # endpoint -> [bucket counts..., +Inf count, sum]
+        self._phases = defaultdict(float)  # (endpoint, phase) -> seconds
+        self._rows = defaultdict(int)
+        self._bytes = defaultdict(int)  # (endpoint, 'read' | 'written') -> bytes
+        self._gauges = []  # (name, help, callable returning a number)
+        self._lock = threading.Lock()
+
+    def gauge(self, name, help_text, func):
+        """Report ``func()`` as a gauge every time the metrics are rendered."""
+        self._gauges.append((name, help_text, func))
+
+    def observe(self, endpoint, method, stats):
+        seconds = stats.elapsed()
+        with self._lock:
+            self._requests[(endpoint, method, stats.status or 0)] += 1
+            histogram = self._durations.setdefault(endpoint, [0] * (len(DURATION_BUCKETS) + 1) + [0.0])
+            for position, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    histogram[position] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+            for name, phase_seconds in stats.phases.items():
+                self._phases[(endpoint, name)] += phase_seconds
+            self._rows[endpoint] += stats.rows
+            self._bytes[(endpoint, 'read')] += stats.bytes_read
+            self._bytes[(endpoint, 'written')] += stats.bytes_written
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        prefix = self.prefix
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+        with self._lock:
+            family('requests_total', 'counter', 'Requests measured, by endpoint, method and status.')
+            for (endpoint, method, status), count in sorted(self._requests.items()):
+                lines.append(f"{prefix}_requests_total"
+                             f"{_labels(endpoint=endpoint, method=method, status=status)} {count}")
+
+            family('request_duration_seconds', 'histogram', 'Time from request start to the last byte sent.')
+            for endpoint, histogram in sorted(self._durations.items()):
+                for bound, count in zip(DURATION_BUCKETS, histogram):
+                    lines.append(f"{prefix}_request_duration_seconds_bucket"
+                                 f"{_labels(endpoint=endpoint, le=bound)} {count}")
+                lines.append(f"{prefix}_request_duration_seconds_bucket"
+                             f"{_labels(endpoint=endpoint, le='+Inf')} {histogram[-2]}")
+                lines.append(f"{prefix}_request_duration_seconds_sum{_labels(endpoint=endpoint)} {histogram[-1]:.6f}")
+                lines.append(f"{prefix}_request_duration_seconds_count{_labels(endpoint=endpoint)} {histogram[-2]}")
+
+            family('phase_seconds_total', 'counter',
+                   'Time spent per phase (load, filter, aggregate, write, render, serialize).')
+            for (endpoint, name), seconds in sorted(self._phases.items()):
+                lines.append(f"{prefix}_phase_seconds_total{_labels(endpoint=endpoint, phase=name)} {seconds:.6f}")
+
+            family('rows_scanned_total', 'counter', 'Ledger records scanned while answering requests.')
+            for endpoint, rows in sorted(self._rows.items()):
+                lines.append(f"{prefix}_rows_scanned_total{_labels(endpoint=endpoint)} {rows}")
+
+            family('storage_bytes_total', 'counter', 'Bytes of ledger files read and written.')
+            for (endpoint, direction), nbytes in sorted(self._bytes.items()):
+                lines.append(f"{prefix}_storage_bytes_total"
+                             f"{_labels(endpoint=endpoint, direction=direction)} {nbytes}")
+
+        for name, help_text, func in self._gauges:
+            family(name, 'gauge', help_text)
+            lines.append(f"{prefix}_{name} {func()}")
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,152 @@
+"""Billing-cycle periods: bucket dates into months, weeks, quarters or years.
+
+A cycle is described by its kind and, for the month-based kinds, the day of
+the month it starts on (the ``start_date`` user setting; days past the end
+of a short month fall on its last day) and the month a financial year
+starts in. Bucketing never formats per-row strings: the cycle edges
+covering the data are generated with NumPy date arithmetic, every date is
+placed with one ``searchsorted`` over them, and only the (few) cycles are
+labelled.
+
+Labels name the cycle by where it starts: ``2024-03`` (month), the week's
+Monday (``2024-03-04``), ``2024-Q1``, ``2024`` and ``FY2024-25`` (``FY2024``
+for a financial year starting in January).
+"""
+from lazy_modules import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+PERIOD_KINDS = ('week', 'month', 'quarter', 'year', 'financial_year')
+# Months per cycle for the month-based kinds
+MONTH_STEPS = {'month': 1, 'quarter': 3, 'year': 12, 'financial_year': 12}
+DEFAULT_FINANCIAL_YEAR_START = 4  # April
+
+_MONDAY = 4  # 1970-01-01 was a Thursday; day 4 since the epoch is a Monday
+
+
+def _as_days(dates):
+    return np.asarray(pd.to_datetime(dates), dtype='datetime64[D]')
+
+
+def _anchor_month(kind, fiscal_start):
+    return fiscal_start - 1 if kind == 'financial_year' else 0
+
+
+def period_edges(first, last, kind='month', start_day=1, fiscal_start=DEFAULT_FINANCIAL_YEAR_START):
+    """Start dates (datetime64[D]) of every cycle from the one holding ``first``
+    up to the one after ``last``, so each date in between falls inside two edges."""
+    if kind not in PERIOD_KINDS:
+        raise ValueError(f"Unknown period {kind!r}; expected one of {', '.join(PERIOD_KINDS)}")
+    first, last = np.datetime64(first, 'D'), np.datetime64(last, 'D')
+    if kind == 'week':
+        days = first.astype(np.int64)
+        start = days - (days - _MONDAY) % 7
+        return np.arange(start, last.astype(np.int64) + 8, 7).astype('datetime64[D]')
+
+    step, anchor = MONTH_STEPS[kind], _anchor_month(kind, fiscal_start)
+    # One cycle of slack either side: with a late start day, a date early in
+    # a month still belongs to the cycle that began the month before
+    low = first.astype('datetime64[M]').astype(np.int64) - step
+    high = last.astype('datetime64[M]').astype(np.int64) + step
+    low -= (low - anchor) % step
+    months = np.arange(low, high + 1, step)
+    month_starts = months.astype('datetime64[M]').astype('datetime64[D]')
+    lengths = ((months + 1).astype('datetime64[M]').astype('datetime64[D]') - month_starts).astype(np.int64)
+    return month_starts + (np.minimum(start_day, lengths) - 1)
+
+
+def period_labels(edges, kind='month'):
+    """One label per cycle starting at ``edges``."""
+    if kind == 'week':
+        return np.datetime_as_string(edges, unit='D').astype(object)
+    months = edges.astype('datetime64[M]').astype(np.int64)
+    years, month = months // 12 + 1970, months % 12 + 1
+    if kind == 'month':
+        return np.array([f"{y:04d}-{m:02d}" for y, m in zip(years, month)], dtype=object)
+    if kind == 'quarter':
+        return np.array([f"{y:04d}-Q{(m - 1) // 3 + 1}" for y, m in zip(years, month)], dtype=object)
+    if kind == 'year':
+        return np.array([f"{y:04d}" for y in years], dtype=object)
+    # A financial year starting in January is just the calendar year
+    return np.array([f"FY{y:04d}" if m == 1 else f"FY{y:04d}-{(y + 1) % 100:02d}"
+                     for y, m in zip(years, month)], dtype=object)
+
+
+def assign_periods(dates, kind='month', start_day=1, fiscal_start=DEFAULT_FINANCIAL_YEAR_START):
+    """Bucket ``dates`` into cycles; returns (codes, labels).
+
+    ``codes[i]`` indexes ``labels`` (-1 for a missing date); labels are in
+    chronological order and cover every cycle between the first and last date.
+    """
+    days = _as_days(dates)
+    valid = ~np.isnat(days)
+    if not valid.any():
+        return np.full(len(days), -1, dtype=np.int64), np.array([], dtype=object)
+    edges = period_edges(days[valid].min(), days[valid].max(), kind, start_day, fiscal_start)
+    codes = np.searchsorted(edges, days, side='right') - 1
+    codes[~valid] = -1
+    # Drop the slack cycles no date landed in at either end
+    used = codes[valid]
+    low, high = used.min(), used.max()
+    codes[valid] -= low
+    return codes, period_labels(edges[low:high + 1], kind)
+
+
+def period_matrix(dates, keys, amounts, kind='month', start_day=1, fiscal_start=DEFAULT_FINANCIAL_YEAR_START):
+    """Sum ``amounts`` per (cycle, key) into a cycles x keys frame indexed by label.
+
+    Every cycle from the first date to the last gets a row, zero where
+    nothing was recorded, so rolling windows over the rows span real time.
+    """
+    codes, labels = assign_periods(dates, kind, start_day, fiscal_start)
+    key_codes, key_values = pd.factorize(pd.Series(keys), sort=True)
+    amounts = np.asarray(amounts, dtype='float64')
+    keep = (codes >= 0) & (key_codes >= 0)
+    width = len(key_values)
+    sums = np.bincount(codes[keep] * width + key_codes[keep], weights=amounts[keep],
+                       minlength=len(labels) * width)
+    return pd.DataFrame(sums.reshape(len(labels), width), index=pd.Index(labels, name='period'),
+                        columns=pd.Index(np.asarray(key_values, dtype=object)))
+
+
+def current_period(kind='month', start_day=1, fiscal_start=DEFAULT_FINANCIAL_YEAR_START, today=None):
+    """Label of the cycle holding ``today`` (default: now)."""
+    _, labels = assign_periods([pd.Timestamp(today or pd.Timestamp.now()).normalize()],
+                               kind, start_day, fiscal_start)
+    return labels[0]
+
+
+def recent_start(count, kind='month', start_day=1, fiscal_start=DEFAULT_FINANCIAL_YEAR_START, today=None):
+    """First day of the last ``count`` cycles, the current one included."""
+    today = np.datetime64(pd.Timestamp(today or pd.Timestamp.now()).normalize(), 'D')
+    longest = 7 if kind == 'week' else 31 * MONTH_STEPS.get(kind, 1)
+    edges = period_edges(today - longest * max(count, 1), today, kind, start_day, fiscal_start)
+    current = np.searchsorted(edges, today, side='right') - 1
+    return pd.Timestamp(edges[max(current - count + 1, 0)])
+
+
+def aligns_with_months(kind, start_day):
+    """True if every cycle is a whole number of calendar months, so monthly
+    totals can be bucketed instead of individual records."""
+    return kind != 'week' and start_day == 1
+
+
+def period_totals(dates, types, amounts, kind='month', start_day=1, fiscal_start=DEFAULT_FINANCIAL_YEAR_START):
+    """Sum ``amounts`` per (cycle, type); returns a period/type/amount frame in cycle order."""
+    codes, labels = assign_periods(dates, kind, start_day, fiscal_start)
+    type_codes, type_values = pd.factorize(pd.Series(types), sort=True)
+    amounts = np.asarray(amounts, dtype='float64')
+    keep = (codes >= 0) & (type_codes >= 0)
+    if not keep.any():
+        return pd.DataFrame(columns=['period', 'type', 'amount'])
+    # One bincount over (cycle, type) pairs instead of a groupby
+    width = len(type_values)
+    pairs = codes[keep] * width + type_codes[keep]
+    sums = np.bincount(pairs, weights=amounts[keep], minlength=len(labels) * width)
+    present = np.flatnonzero(np.bincount(pairs, minlength=len(labels) * width))
+    return pd.DataFrame({
+        'period': labels[present // width],
+        'type': np.asarray(type_values, dtype=object)[present % width],
+        'amount': sums[present],
+    })
@@ -0,0 +1,239 @@
+"""Benchmark every route of the app against synthetic ledgers.
+
+For each ledger size a fresh data directory is seeded with a generated
+ledger (see generate_ledger.py), then each route is driven through the
+Flask test client and timed. Read routes are measured both "cold" (parsed
+ledger and response caches emptied before every request) and "warm".
+
+    python scripts/bench.py --rows 1000,10000,100000 --output bench.json
+    python scripts/bench.py --rows 1000000 --repeat 5 --backend sqlite
+    python scripts/bench.py --rows 10000 --compare bench.json
+
+Results are written as JSON (one record per size/route/mode with p50, p95
+and p99 latency in ms, rows/sec and the process's peak RSS so far), stamped
+with the git commit, so runs from two commits can be diffed with --compare.
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from generate_ledger import generate_ledger  # noqa: E402
+
+USERNAME = 'bench'
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Bench:
+    def __init__(self, app_module, rows, repeat):
+        self.app_module = app_module
+        self.app = app_module.app
+        self.rows = rows
+        self.repeat = repeat
+        self.results = []
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as session:
+            session['_user_id'] = USERNAME
+            session['_fresh'] = True
+
+    def clear_caches(self):
+        self.app_module.ledger_cache.clear()
+        self.app_module.response_cache.clear()
+
+    def measure(self, route, mode, request, rows=None, repeat=None, setup=None):
+        """Time ``request()`` ``repeat`` times; ``rows`` is the work per call for rows/sec."""
+        timings = []
+        for _ in range(repeat or self.repeat):
+            if setup:
+                setup()
+            started = time.perf_counter()
+            response = request()
+            response.get_data()  # Drain streamed responses
+            timings.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{route} returned {response.status_code}")
+            response.close()
+        timings = np.array(timings)
+        p50, p95, p99 = np.percentile(timings, [50, 95, 99]) * 1000
+        rows = self.rows if rows is None else rows
+        result = {
+            'rows': self.rows,
+            'route': route,
+            'mode': mode,
+            'n': len(timings),
+            'p50_ms': round(float(p50), 3),
+            'p95_ms': round(float(p95), 3),
+            'p99_ms': round(float(p99), 3),
+            'rows_per_sec': round(rows / float(np.median(timings)), 1) if rows else None,
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+        }
+        self.results.append(result)
+        print(f"  {route:<40} {mode:<5} p50 {p50:9.2f}ms  p95 {p95:9.2f}ms  p99 {p99:9.2f}ms  "
+              f"{result['rows_per_sec'] or 0:>12,.0f} rows/s  rss {result['peak_rss_mb']:.0f}MB")
+        return result
+
+    def read(self, route, url):
+        for mode, setup in (('cold', self.clear_caches), ('warm', None)):
+            if mode == 'warm':
+                self.client.get(url).close()
+            self.measure(route, mode, lambda: self.client.get(url), setup=setup)
+
+    def run_reads(self):
+        year = pd.Timestamp.today().year
+        self.read('GET /dashboard', '/dashboard')
+        self.read('GET /analysis', '/analysis')
+        self.read('GET /expenses', '/expenses')
+        self.read('GET /api/expenses', '/api/expenses')
+        self.read('GET /api/expenses (filtered)', f'/api/expenses?type=Spend&category=Food&start_date={year}-01-01')
+        self.read('GET /api/expenses (search)', '/api/expenses?search=coffee')
+        self.read('GET /api/expenses/page', '/api/expenses/page?limit=50')
+        self.read('GET /api/expenses/page (amount)', '/api/expenses/page?limit=50&sort=amount&order=asc')
+        self.read('GET /api/expenses/page (deep)', f'/api/expenses/page?limit=50&offset={self.rows // 2}')
+        for name in self.app_module.CHARTS:
+            self.read(f'GET /api/charts/{name}', f'/api/charts/{name}')
+
+    def run_writes(self):
+        counter = iter(range(10 ** 9))
+        form = lambda: {'date': '2024-06-15', 'type': 'Spend', 'category': 'Food',
+                        'amount': str(next(counter) % 500 + 1), 'description': 'bench add'}
+        self.measure('POST /expenses', 'write', lambda: self.client.post('/expenses', data=form()), rows=1)
+
+        ids = iter(range(1, self.rows + 1))
+        self.measure('PUT /expenses/<id>', 'write',
+                     lambda: self.client.put(f'/expenses/{next(ids)}', json={'amount': 42.0}), rows=1)
+        self.measure('DELETE /expenses/<id>', 'write',
+                     lambda: self.client.delete(f'/expenses/{next(ids)}'), rows=1)
+
+    def run_import_export(self, ledger):
+        for fmt in ('csv', 'json'):
+            self.measure(f'POST /import_export (export {fmt})', 'cold',
+                         lambda: self.client.post('/import_export', data={'action': f'export_{fmt}'}),
+                         repeat=max(self.repeat // 4, 1), setup=self.clear_caches)
+        self.measure('POST /import_export (export gzip)', 'cold',
+                     lambda: self.client.post('/import_export', data={'action': 'export_csv', 'gzip': '1'}),
+                     repeat=max(self.repeat // 4, 1), setup=self.clear_caches)
+
+        upload = ledger.drop(columns='id').to_csv(index=False, date_format='%Y-%m-%d').encode('utf-8')
+        json_upload = ledger.drop(columns='id').assign(date=ledger['date'].dt.strftime('%Y-%m-%d')) \
+            .to_json(orient='records').encode('utf-8')
+        for fmt, body in (('csv', upload), ('json', json_upload)):
+            for mode in ('replace', 'merge'):
+                data = lambda: {'action': f'import_{fmt}', 'mode': mode,
+                                'file': (io.BytesIO(body), f'ledger.{fmt}')}
+                self.measure(f'POST /import_export (import {fmt} {mode})', 'write',
+                             lambda: self.client.post('/import_export', data=data(),
+                                                      content_type='multipart/form-data'),
+                             repeat=max(self.repeat // 10, 1))
+
+
+def run_size(rows, args):
+    import app as app_module
+
+    # Only warnings from the app: per-request log lines would be part of every timing
+    logging.getLogger().setLevel(logging.WARNING)
+    data_dir = tempfile.mkdtemp(prefix='bench-')
+    try:
+        app_module.app.config['DATA_DIR'] = data_dir
+        app_module.app.config['STORAGE_BACKEND'] = args.backend
+        app_module.app.config['TESTING'] = True
+        # Time the inline import/export paths rather than queueing background jobs
+        app_module.app.config['JOB_EXPORT_MIN_ROWS'] = float('inf')
+        app_module.app.config['JOB_IMPORT_MIN_MB'] = float('inf')
+        app_module.users[USERNAME] = app_module.User(USERNAME, USERNAME, '')
+        app_module.initialize_user_data(USERNAME)
+
+        print(f"{rows:,} rows ({args.backend})")
+        started = time.perf_counter()
+        ledger = generate_ledger(rows, seed=args.seed)
+        app_module.get_ledger_store().replace_all(USERNAME, ledger)
+        print(f"  generated and stored in {time.perf_counter() - started:.1f}s")
+
+        bench = Bench(app_module, rows, args.repeat)
+        bench.run_reads()
+        bench.run_writes()
+        if not args.skip_import_export:
+            bench.run_import_export(ledger)
+        return bench.results
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def compare(results, backend, baseline_path):
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+    if baseline.get('backend') != backend:
+        print(f"\nWarning: {baseline_path} was run against the {baseline.get('backend')} backend")
+    before = {(r['rows'], r['route'], r['mode']): r for r in baseline['results']}
+    print(f"\nCompared with {baseline_path} ({baseline.get('commit')}), p50 ratio (>1 is slower):")
+    for result in results:
+        old = before.get((result['rows'], result['route'], result['mode']))
+        if old and old['p50_ms']:
+            ratio = result['p50_ms'] / old['p50_ms']
+            flag = '  <-- slower' if ratio > 1.2 else ''
+            print(f"  {result['rows']:>9,} {result['route']:<40} {result['mode']:<5} "
+                  f"{old['p50_ms']:9.2f}ms -> {result['p50_ms']:9.2f}ms  x{ratio:.2f}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', default='1000,10000,100000',
+                        help='comma-separated ledger sizes, e.g. 1000,10000,100000,1000000')
+    parser.add_argument('--backend', choices=['csv', 'sqlite'], default=os.getenv('STORAGE_BACKEND', 'csv'))
+    parser.add_argument('--repeat', type=int, default=20, help='requests per route')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-import-export', action='store_true')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='earlier --output file to compare against')
+    args = parser.parse_args()
+
+    results = []
+    for rows in [int(value) for value in args.rows.split(',')]:
+        results += run_size(rows, args)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'backend': args.backend,
+        'repeat': args.repeat,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"\nWrote {len(results)} results to {args.output}")
+    if args.compare:
+        compare(results, args.backend, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Compare the compact in-memory ledger schema with default pandas dtypes.
+
+Builds a synthetic ledger, then times the groupbys behind the analysis page
+(the monthly rollup and per-category totals) and a typical filter on both
+representations, and prints their memory use.
+
+    python scripts/bench_dtypes.py --rows 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from generate_ledger import generate_ledger  # noqa: E402
+from storage import compact_expenses, compute_rollups, expand_expenses, filter_expenses, normalize_expenses  # noqa: E402
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    plain = expand_expenses(normalize_expenses(generate_ledger(args.rows)))
+    plain = plain.astype({'type': object, 'category': object, 'description': object})
+    compact = compact_expenses(plain)
+
+    cases = {
+        'monthly rollup (analysis)': compute_rollups,
+        'category totals': lambda df: df[df['type'] == 'Spend'].groupby('category', observed=True)['amount'].sum(),
+        'type totals': lambda df: df.groupby('type', observed=True)['amount'].sum(),
+        'filter type+category': lambda df: filter_expenses(df, expense_type='Spend', category='Food'),
+    }
+    print(f"{args.rows:,} rows")
+    for label, df in (('default', plain), ('compact', compact)):
+        print(f"  {label:<8} {df.memory_usage(deep=True).sum() / 1024 ** 2:8.1f} MiB  "
+              f"amount={df['amount'].dtype} id={df['id'].dtype} type={df['type'].dtype}")
+    for name, func in cases.items():
+        before = best_of(args.repeat, lambda: func(plain))
+        after = best_of(args.repeat, lambda: func(compact))
+        print(f"  {name:<28} {before:9.1f}ms -> {after:8.1f}ms  x{before / after:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Time the household report over many users' ledgers.
+
+Generates ``--users`` ledgers of ``--rows`` records each, then builds the
+report for a range that splits months (so every record is read) with the
+ledgers reduced one after another and in a process pool, and once more
+with every partial cached.
+
+    python scripts/bench_household.py --users 24 --rows 100000 --workers 4
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from generate_ledger import generate_ledger  # noqa: E402
+from household import HouseholdReport, combine  # noqa: E402
+from storage import LedgerCache, create_store  # noqa: E402
+
+
+def timed_report(report, usernames, window):
+    started = time.perf_counter()
+    partials, failed = report.partials(usernames, *window)
+    records = int(combine(partials.values())['count'].sum())
+    return (time.perf_counter() - started) * 1000, records, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=12)
+    parser.add_argument('--rows', type=int, default=50000, help='records per user')
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument('--backend', default='csv', choices=['csv', 'sqlite'])
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='bench-household-')
+    try:
+        store = create_store(args.backend, data_dir, LedgerCache(max_users=1, max_bytes=0))
+        usernames = [f"user{number}" for number in range(1, args.users + 1)]
+        for seed, username in enumerate(usernames):
+            store.initialize(username)
+            store.replace_all(username, generate_ledger(args.rows, seed=seed))
+            # Parse once so both runs start from the same files (CSV snapshots included)
+            store.dated_amounts(username)
+        for thread in threading.enumerate():
+            if thread.name.startswith('snapshot-'):
+                thread.join()
+        window = ('2000-01-15', None)
+
+        print(f"{args.users} users x {args.rows:,} records ({args.backend})")
+        for label, workers in (('serial', 1), (f"{args.workers} workers", args.workers)):
+            report = HouseholdReport(store, max_workers=workers)
+            if workers > 1:
+                # Start the pool outside the timing; a server pays this once
+                timed_report(report, usernames[:2], ('2000-01-02', '2000-01-03'))
+            elapsed, records, failed = timed_report(report, usernames, window)
+            print(f"  {label:<12} {elapsed:9.1f}ms  {records:,} records  {len(failed)} failed")
+            elapsed, _, _ = timed_report(report, usernames, window)
+            print(f"  {'cached':<12} {elapsed:9.1f}ms")
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
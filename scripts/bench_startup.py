@@ -0,0 +1,79 @@
+"""Measure how long a fresh worker takes to import the app and answer its first requests.
+
+Each run starts a new interpreter (as a gunicorn worker or CLI command
+would) against a generated config.yaml with ``--users`` users, first with
+no cached password hashes and then with the cache from the previous boot.
+
+    python scripts/bench_startup.py --users 10 --repeat 5
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Runs inside the child interpreter; prints one JSON line of timings in ms
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+pandas_at_boot = 'pandas' in sys.modules
+client = app.app.test_client()
+client.get('/login')
+first = time.perf_counter()
+with client.session_transaction() as session:
+    session['_user_id'] = next(iter(app.users))
+    session['_fresh'] = True
+client.get('/api/expenses')
+data = time.perf_counter()
+print(json.dumps({'import': (imported - started) * 1000, 'first_request': (first - imported) * 1000,
+                  'first_data_request': (data - first) * 1000, 'pandas_at_boot': pandas_at_boot}))
+"""
+
+
+def boot(env):
+    output = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env, capture_output=True,
+                            text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10, help='users in the generated config.yaml')
+    parser.add_argument('--repeat', type=int, default=5, help='boots per mode')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bench-startup-')
+    try:
+        config_path = os.path.join(work_dir, 'config.yaml')
+        with open(config_path, 'w') as file:
+            file.write('users:\n')
+            for number in range(1, args.users + 1):
+                file.write(f"  - id: '{number}'\n    username: 'user{number}'\n    password: 'password{number}'\n")
+        data_dir = os.path.join(work_dir, 'data')
+        env = dict(os.environ, CONFIG_FILE=config_path, DATA_DIR=data_dir, LOG_LEVEL='WARNING')
+        cache_path = os.path.join(data_dir, '.credentials_cache.json')
+
+        print(f"{args.users} configured users, {args.repeat} boots per mode")
+        for mode in ('cold', 'warm'):
+            runs = []
+            for _ in range(args.repeat):
+                if mode == 'cold' and os.path.exists(cache_path):
+                    os.remove(cache_path)
+                runs.append(boot(env))
+            line = f"  {mode:<5}"
+            for key in ('import', 'first_request', 'first_data_request'):
+                line += f"  {key} {statistics.median(run[key] for run in runs):8.1f}ms"
+            print(line + f"  pandas imported at boot: {any(run['pandas_at_boot'] for run in runs)}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Generate a synthetic expense ledger for benchmarks and load testing.
+
+The output has the same columns as a user's ``<user>_expenses.csv``
+(id, date, type, category, amount, description) and roughly the shape of
+a real household ledger: mostly small spends spread across the default
+categories, a monthly salary, and occasional investments and savings.
+
+    python scripts/generate_ledger.py --rows 100000 --output ledger.csv
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+CATEGORIES = {
+    # category: (share of spends, median amount)
+    'Food': (0.28, 350),
+    'Groceries': (0.20, 1200),
+    'Travel': (0.10, 900),
+    'Rent': (0.02, 25000),
+    'Utilities': (0.06, 2200),
+    'Entertainment': (0.10, 800),
+    'Healthcare': (0.05, 1500),
+    'Shopping': (0.12, 2500),
+    'Miscellaneous': (0.07, 400),
+}
+TYPE_SHARES = {'Spend': 0.86, 'Earning': 0.04, 'Investment': 0.06, 'Savings': 0.04}
+DESCRIPTION_WORDS = ['coffee', 'lunch', 'dinner', 'taxi', 'metro', 'movie', 'groceries', 'pharmacy',
+                     'electricity', 'internet', 'phone', 'books', 'shoes', 'gift', 'salary', 'bonus',
+                     'mutual fund', 'fixed deposit', 'rent', 'snacks', 'fuel', 'gym', 'doctor', 'flight']
+
+
+def generate_ledger(rows, seed=0, end_date=None, years=None):
+    """Return a DataFrame of ``rows`` synthetic records with ids 1..rows.
+
+    Dates cover ``years`` years up to ``end_date`` (default: today); by
+    default the span grows with the ledger so there are ~10 records a day.
+    """
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp(end_date or pd.Timestamp.today()).normalize()
+    if years is None:
+        years = min(max(rows / 3650, 1), 30)
+    days = max(int(years * 365), 1)
+    dates = end - pd.to_timedelta(np.sort(rng.integers(0, days, rows))[::-1], unit='D')
+
+    types = rng.choice(list(TYPE_SHARES), size=rows, p=list(TYPE_SHARES.values()))
+    names = list(CATEGORIES)
+    shares = np.array([share for share, _ in CATEGORIES.values()])
+    category_index = rng.choice(len(names), size=rows, p=shares / shares.sum())
+    categories = np.array(names, dtype=object)[category_index]
+    medians = np.array([median for _, median in CATEGORIES.values()])[category_index].astype(float)
+
+    categories[types == 'Earning'] = 'Income'
+    medians[types == 'Earning'] = 80000
+    categories[types == 'Investment'] = 'Miscellaneous'
+    medians[types == 'Investment'] = 10000
+    categories[types == 'Savings'] = 'Miscellaneous'
+    medians[types == 'Savings'] = 5000
+    amounts = np.round(medians * rng.lognormal(0, 0.6, rows), 2)
+
+    words = np.array(DESCRIPTION_WORDS, dtype=object)
+    descriptions = words[rng.integers(0, len(words), rows)] + ' ' + rng.integers(1, 1000, rows).astype(str)
+
+    return pd.DataFrame({
+        'id': np.arange(1, rows + 1),
+        'date': dates,
+        'type': types,
+        'category': categories,
+        'amount': amounts,
+        'description': descriptions,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--years', type=float, help='span of dates (default: ~10 records a day)')
+    parser.add_argument('--output', default='ledger.csv')
+    args = parser.parse_args()
+
+    df = generate_ledger(args.rows, seed=args.seed, years=args.years)
+    df.to_csv(args.output, index=False, date_format='%Y-%m-%d')
+    print(f"Wrote {len(df):,} records to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Hammer one user's ledger with concurrent writers and check nothing is lost.
+
+Runs several processes, each with several threads, that add, update and
+delete expenses through the storage layer at the same time. Afterwards the
+ledger must contain exactly the rows that were added and not deleted, with
+unique ids and the final amounts the updates wrote, and the Spend rollup
+must add up to the same total.
+
+    python scripts/stress_writes.py --processes 4 --threads 4 --ops 200
+    python scripts/stress_writes.py --unlocked   # the old, unlocked behaviour
+
+Pass --backend sqlite to exercise the SQLite store instead of the CSV one;
+it relies on SQLite's own locking, so --unlocked makes no difference there.
+"""
+import argparse
+import contextlib
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import storage  # noqa: E402
+from storage import LedgerCache, create_store  # noqa: E402
+
+USERNAME = 'stress'
+
+
+def make_store(backend, data_dir, unlocked):
+    store = create_store(backend, data_dir, LedgerCache(max_users=4, max_bytes=64 * 1024 * 1024))
+    if unlocked:
+        store.write_lock = lambda username: contextlib.nullcontext()
+    return store
+
+
+def worker(backend, data_dir, unlocked, worker_id, threads, ops, results):
+    store = make_store(backend, data_dir, unlocked)
+    errors = []
+
+    def run(thread_id):
+        rng = random.Random(worker_id * 1000 + thread_id)
+        tag = f"w{worker_id}t{thread_id}"
+        mine = {}  # description -> amount we last wrote
+        for op in range(ops):
+            try:
+                choice = rng.random()
+                if choice < 0.6 or not mine:
+                    description = f"{tag}-{op}"
+                    store.add(USERNAME, {'date': '2024-01-15', 'type': 'Spend', 'category': 'Food',
+                                         'amount': 1.0, 'description': description})
+                    mine[description] = 1.0
+                    continue
+                description = rng.choice(list(mine))
+                df = store.load(USERNAME)
+                rows = df[df['description'] == description]
+                if rows.empty:
+                    errors.append(f"{description} vanished")
+                    mine.pop(description)
+                    continue
+                expense_id = int(rows['id'].iloc[0])
+                if choice < 0.85:
+                    amount = float(op + 2)
+                    if store.update(USERNAME, expense_id, {'amount': amount}):
+                        mine[description] = amount
+                elif store.delete(USERNAME, expense_id):
+                    mine.pop(description)
+            except Exception as e:  # Unlocked runs can corrupt the file; count it and carry on
+                errors.append(f"{type(e).__name__}: {e}")
+        results.put((tag, mine))
+
+    pool = [threading.Thread(target=run, args=(thread_id,)) for thread_id in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    results.put(('errors', errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=sorted(storage.STORAGE_BACKENDS), default='csv')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--ops', type=int, default=100, help='operations per thread')
+    parser.add_argument('--unlocked', action='store_true',
+                        help='disable the per-user write lock to compare with the old behaviour')
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='stress-')
+    try:
+        make_store(args.backend, data_dir, False).initialize(USERNAME)
+        results = multiprocessing.Queue()
+        started = time.perf_counter()
+        processes = [multiprocessing.Process(target=worker, args=(args.backend, data_dir, args.unlocked,
+                                                                  worker_id, args.threads, args.ops, results))
+                     for worker_id in range(args.processes)]
+        for process in processes:
+            process.start()
+        expected, errors = {}, []
+        for _ in range(args.processes * (args.threads + 1)):
+            key, value = results.get()
+            if key == 'errors':
+                errors.extend(value)
+            else:
+                expected.update(value)
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - started
+
+        total_ops = args.processes * args.threads * args.ops
+        store = make_store(args.backend, data_dir, False)
+        df = store.load(USERNAME)
+        actual = dict(zip(df['description'], df['amount'].astype(float)))
+        lost = [description for description in expected if description not in actual]
+        resurrected = [description for description in actual if description not in expected]
+        wrong = [description for description, amount in expected.items()
+                 if description in actual and actual[description] != amount]
+        duplicate_ids = int(df['id'].duplicated().sum())
+        rollups = store.rollups(USERNAME)
+        rollup_total = float(rollups.loc[rollups['type'] == 'Spend', 'amount'].sum())
+        rollup_drift = abs(rollup_total - float(df['amount'].astype(float).sum())) > 0.005
+
+        mode = 'unlocked' if args.unlocked else 'locked'
+        print(f"{args.backend} ({mode}): {args.processes} processes x {args.threads} threads x {args.ops} ops")
+        print(f"  {total_ops} ops in {elapsed:.2f}s = {total_ops / elapsed:.0f} ops/sec")
+        print(f"  expected rows {len(expected)}, found {len(df)}")
+        print(f"  lost {len(lost)}, resurrected {len(resurrected)}, stale amounts {len(wrong)}, "
+              f"duplicate ids {duplicate_ids}, worker errors {len(errors)}")
+        print(f"  Spend rollup {rollup_total:.2f}{' (does not match the ledger)' if rollup_drift else ''}")
+        for error in errors[:5]:
+            print(f"    {error}")
+        ok = not (lost or resurrected or wrong or duplicate_ids or errors or rollup_drift)
+        print('  OK' if ok else '  FAILED')
+        return 0 if ok else 1
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,234 @@
+"""Inverted index over expense descriptions, for ranked ``q=`` searches.
+
+Ledgers repeat the same few thousand descriptions over and over, so the
+index works on distinct descriptions: each row holds the code of its
+description, and every token maps to the codes whose description contains
+it. Tokens are kept sorted with their postings laid out back to back, so
+every token starting with a prefix ("gro" -> groceries, grocery) is one
+contiguous slice found with two binary searches. A query marks the
+matching codes and maps them onto rows with a single gather, whatever the
+size of the ledger.
+
+Ranking sums, per query term, the idf of the best token it matched (full
+words score higher than prefixes, near-miss spellings lowest). All terms
+must match. Document frequencies count pending descriptions too and skip
+those no row uses any more, so an index carried through writes ranks
+exactly like one rebuilt from the same rows.
+
+Indexes are immutable: writes produce a new index via ``appended``,
+``replaced`` and ``removed``, so searches running on another thread keep a
+consistent view. Descriptions the index hasn't seen go to a small side
+list that is scanned directly and folded into the sorted postings once it
+grows past ``MAX_PENDING``.
+"""
+import difflib
+import math
+import re
+from collections import Counter
+
+from lazy_modules import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+TOKEN_PATTERN = re.compile(r'\w+')
+# Weight of a term that only matched as a prefix / as a near-miss spelling
+PREFIX_WEIGHT = 0.5
+FUZZY_WEIGHT = 0.3
+FUZZY_CUTOFF = 0.8
+
+
+def tokenize(text):
+    """Lowercase word tokens of ``text``."""
+    if not isinstance(text, str):
+        return []
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class SearchIndex:
+    """Token index over the descriptions of one ledger frame; see the module docstring."""
+
+    # Descriptions added since the last rebuild of the postings before folding them in
+    MAX_PENDING = 512
+
+    def __init__(self, ids, row_codes, descriptions, codes, vocab, offsets, postings, counts, pending):
+        self.ids = ids  # expense id per row
+        self.row_codes = row_codes  # description code per row, -1 if it has none
+        self.descriptions = descriptions  # code -> description text
+        self.codes = codes  # description text -> code
+        self.vocab = vocab  # sorted tokens
+        self.offsets = offsets  # postings of vocab[i] are postings[offsets[i]:offsets[i + 1]]
+        self.postings = postings  # description codes
+        self.counts = counts  # occurrences of the token in that description
+        self.pending = pending  # [(code, tokens)] for descriptions not in the postings yet
+        self._live = None  # (codes some row still uses, their count per vocab token), on first search
+
+    @classmethod
+    def build(cls, ids, descriptions):
+        """Index a frame's ``id`` and ``description`` columns."""
+        row_codes, uniques = pd.factorize(pd.Series(descriptions), use_na_sentinel=True)
+        return cls._from_codes(np.asarray(ids), row_codes.astype(np.int32),
+                               [str(value) for value in uniques])
+
+    @classmethod
+    def _from_codes(cls, ids, row_codes, descriptions):
+        tokens = pd.Series(descriptions, dtype=object).str.lower().str.findall(TOKEN_PATTERN.pattern)
+        pairs = tokens.explode().dropna()
+        if pairs.empty:
+            vocab = np.array([], dtype=object)
+            offsets = np.zeros(1, dtype=np.int64)
+            postings = counts = np.array([], dtype=np.int32)
+        else:
+            # One entry per (token, description) with how often the token occurs in it
+            grouped = pd.DataFrame({'token': pairs.to_numpy(dtype=object), 'code': pairs.index.to_numpy()}) \
+                .groupby(['token', 'code'], sort=True).size()
+            token_values = grouped.index.get_level_values('token')
+            vocab, starts = np.unique(token_values.to_numpy(dtype=object), return_index=True)
+            offsets = np.append(starts, len(grouped)).astype(np.int64)
+            postings = grouped.index.get_level_values('code').to_numpy().astype(np.int32)
+            counts = grouped.to_numpy().astype(np.int32)
+        codes = {description: code for code, description in enumerate(descriptions)}
+        return cls(ids, row_codes, descriptions, codes, vocab, offsets, postings, counts, [])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def covers(self, ids):
+        """True if this index was built over exactly these rows, in this order."""
+        ids = np.asarray(ids)
+        return len(ids) == len(self.ids) and bool(np.array_equal(ids, self.ids))
+
+    def position(self, expense_id):
+        """Row holding ``expense_id``, or None."""
+        found = np.flatnonzero(self.ids == expense_id)
+        return int(found[0]) if len(found) else None
+
+    def _copy(self, **changes):
+        # Fields only; what was worked out from them (``_live``) is recomputed
+        fields = {key: value for key, value in self.__dict__.items() if not key.startswith('_')}
+        fields.update(changes)
+        return SearchIndex(**fields)
+
+    def _code_for(self, description):
+        """(code, descriptions, codes, pending) after making sure ``description`` has a code."""
+        if not isinstance(description, str) or description == '':
+            return -1, self.descriptions, self.codes, self.pending
+        code = self.codes.get(description)
+        if code is not None:
+            return code, self.descriptions, self.codes, self.pending
+        code = len(self.descriptions)
+        return (code, self.descriptions + [description], dict(self.codes, **{description: code}),
+                self.pending + [(code, tokenize(description))])
+
+    def _settle(self, index):
+        # Fold pending descriptions into the sorted postings once there are enough of them
+        if len(index.pending) > self.MAX_PENDING:
+            return SearchIndex._from_codes(index.ids, index.row_codes, index.descriptions)
+        return index
+
+    def appended(self, ids, descriptions):
+        """Index with rows added at the end."""
+        index = self
+        new_codes = []
+        for description in descriptions:
+            code, all_descriptions, codes, pending = index._code_for(description)
+            index = index._copy(descriptions=all_descriptions, codes=codes, pending=pending)
+            new_codes.append(code)
+        return self._settle(index._copy(
+            ids=np.append(self.ids, np.asarray(ids, dtype=self.ids.dtype)),
+            row_codes=np.append(self.row_codes, np.asarray(new_codes, dtype=np.int32))))
+
+    def replaced(self, position, description):
+        """Index with the row at ``position`` given a new description."""
+        code, descriptions, codes, pending = self._code_for(description)
+        row_codes = self.row_codes.copy()
+        row_codes[position] = code
+        return self._settle(self._copy(row_codes=row_codes, descriptions=descriptions, codes=codes,
+                                       pending=pending))
+
+    def removed(self, position):
+        """Index without the row at ``position``."""
+        return self._copy(ids=np.delete(self.ids, position), row_codes=np.delete(self.row_codes, position))
+
+    def _live_codes(self):
+        """(mask of description codes some row uses, live codes per vocab token).
+
+        Edits and deletes leave descriptions no row uses any more; they are
+        left out of document frequencies, as they would be after a rebuild.
+        """
+        if self._live is None:
+            live = np.zeros(len(self.descriptions), dtype=bool)
+            live[self.row_codes[self.row_codes >= 0]] = True
+            if len(self.vocab):
+                frequencies = np.add.reduceat(live[self.postings].astype(np.int64), self.offsets[:-1])
+            else:
+                frequencies = np.zeros(0, dtype=np.int64)
+            self._live = (live, frequencies)
+        return self._live
+
+    def _term_scores(self, term, idf, pending_postings):
+        """Best weight per description code for one query term (0 where it doesn't match)."""
+        _, frequencies = self._live_codes()
+        scores = np.zeros(len(self.descriptions), dtype=np.float64)
+        # Every token starting with ``term`` sits in one slice of the sorted vocabulary
+        low = int(np.searchsorted(self.vocab, term, side='left'))
+        high = int(np.searchsorted(self.vocab, term + '\U0010ffff', side='left'))
+        expansions = {self.vocab[position]: PREFIX_WEIGHT for position in range(low, high) if frequencies[position]}
+        expansions.update((token, PREFIX_WEIGHT) for token in pending_postings if token.startswith(term))
+        if not expansions:
+            known = {token for token, frequency in zip(self.vocab.tolist(), frequencies) if frequency}
+            close = difflib.get_close_matches(term, known.union(pending_postings), n=3, cutoff=FUZZY_CUTOFF)
+            expansions = dict.fromkeys(close, FUZZY_WEIGHT)
+        if term in expansions:
+            expansions[term] = 1.0
+
+        weights, codes = [], []
+        for token, weight in expansions.items():
+            position = int(np.searchsorted(self.vocab, token))
+            start = end = 0
+            if position < len(self.vocab) and self.vocab[position] == token:
+                start, end = self.offsets[position], self.offsets[position + 1]
+            pending_codes, pending_counts = pending_postings.get(token, ((), ()))
+            # Document frequency counts the indexed and the pending descriptions alike
+            token_idf = idf((frequencies[position] if end else 0) + len(pending_codes))
+            codes += [self.postings[start:end], np.asarray(pending_codes, dtype=np.int32)]
+            weights += [weight * token_idf * (1 + np.log(self.counts[start:end])),
+                        weight * token_idf * (1 + np.log(np.asarray(pending_counts, dtype=np.float64)))]
+        if codes:
+            codes, weights = np.concatenate(codes), np.concatenate(weights)
+            # Keep the best expansion per description: assign in ascending order so the largest wins
+            order = np.argsort(weights, kind='stable')
+            scores[codes[order]] = weights[order]
+        return scores
+
+    def search(self, query):
+        """Rows matching every term of ``query``; returns (positions, scores), best first."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or len(self.ids) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+        live, _ = self._live_codes()
+        documents = int(live.sum())
+        idf = lambda frequency: math.log((documents + 1) / (frequency + 1)) + 1
+        # Postings of the live pending descriptions: token -> (codes, occurrences in each)
+        pending_postings = {}
+        for code, tokens in self.pending:
+            if live[code]:
+                for token, count in Counter(tokens).items():
+                    token_codes, token_counts = pending_postings.setdefault(token, ([], []))
+                    token_codes.append(code)
+                    token_counts.append(count)
+
+        total = np.zeros(len(self.descriptions), dtype=np.float64)
+        matched = np.ones(len(self.descriptions), dtype=bool)
+        for term in terms:
+            scores = self._term_scores(term, idf, pending_postings)
+            # A description must match every term
+            matched &= scores > 0
+            if not matched.any():
+                return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+            total += scores
+        # Row codes of -1 (no description) pick the trailing False
+        positions = np.flatnonzero(np.append(matched, False)[self.row_codes])
+        scores = total[self.row_codes[positions]]
+        order = np.argsort(-scores, kind='stable')
+        return positions[order], scores[order]
@@ -0,0 +1,127 @@
+"""Binary, memory-mapped snapshots of a compact ledger frame.
+
+A snapshot is a single file: a short JSON header followed by one raw NumPy
+array per column, each aligned so it can be mapped with np.memmap instead
+of being read and parsed. Categorical columns are stored as their codes plus
+the category list in the header; descriptions are dictionary-encoded (int32
+codes plus one UTF-8 blob of the distinct strings).
+
+Loading a million-row ledger this way costs tens of milliseconds instead of
+the seconds a CSV parse takes, because nothing but the distinct descriptions
+has to be decoded.
+"""
+import json
+import os
+import threading
+
+from lazy_modules import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+MAGIC = b'EXPSNAP1'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+
+class SnapshotError(ValueError):
+    """The file is not a snapshot this version can read."""
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _column_arrays(df):
+    arrays, categories = {}, {}
+    for column in df.columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            arrays[column] = values.cat.codes.to_numpy()
+            categories[column] = [str(category) for category in values.cat.categories]
+        elif column == 'description':
+            codes, uniques = pd.factorize(values, use_na_sentinel=True)
+            encoded = [str(value).encode('utf-8') for value in uniques]
+            arrays['description'] = codes.astype(np.int32)
+            arrays['description_offsets'] = np.cumsum([0] + [len(value) for value in encoded], dtype=np.int64)
+            arrays['description_values'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        elif values.dtype == object:
+            raise SnapshotError(f"Column {column} has no fixed-width representation")
+        else:
+            arrays[column] = values.to_numpy()
+    return arrays, categories
+
+
+def write_snapshot(path, df, **info):
+    """Write ``df`` (compact schema) to ``path`` atomically; ``info`` goes in the header."""
+    arrays, categories = _column_arrays(df)
+    columns, offset = [], 0
+    for name, array in arrays.items():
+        offset = _aligned(offset)
+        columns.append({'name': name, 'dtype': array.dtype.str, 'count': len(array), 'offset': offset})
+        offset += array.nbytes
+    header = {'format': FORMAT_VERSION, 'rows': len(df), 'order': list(df.columns),
+              'columns': columns, 'categories': categories, 'info': info}
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _aligned(len(MAGIC) + 8 + len(header_bytes))
+
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(len(header_bytes).to_bytes(8, 'little'))
+            f.write(header_bytes)
+            for column, (name, array) in zip(columns, arrays.items()):
+                f.seek(data_start + column['offset'])
+                f.write(np.ascontiguousarray(array).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_snapshot_info(path):
+    """Return (header, data offset) without touching the column data."""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise SnapshotError('Not a ledger snapshot')
+        length = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(length))
+    if header.get('format') != FORMAT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot format {header.get('format')}")
+    return header, _aligned(len(MAGIC) + 8 + length)
+
+
+def read_snapshot(path):
+    """Map a snapshot back into a DataFrame; returns (frame, header info).
+
+    Numeric columns are read-only views of the mapped file, so the frame
+    costs almost nothing until it is copied or modified.
+    """
+    header, data_start = read_snapshot_info(path)
+    arrays = {}
+    for column in header['columns']:
+        if column['count'] == 0:
+            arrays[column['name']] = np.empty(0, dtype=column['dtype'])
+            continue
+        arrays[column['name']] = np.memmap(path, dtype=np.dtype(column['dtype']), mode='r',
+                                           offset=data_start + column['offset'], shape=(column['count'],))
+
+    data = {}
+    for name in header['order']:
+        if name in header['categories']:
+            data[name] = pd.Categorical.from_codes(np.asarray(arrays[name]), header['categories'][name])
+        elif name == 'description':
+            blob = arrays['description_values'].tobytes()
+            offsets = arrays['description_offsets']
+            uniques = np.empty(len(offsets), dtype=object)
+            bounds = offsets.tolist()
+            uniques[:-1] = [blob[start:end].decode('utf-8') for start, end in zip(bounds[:-1], bounds[1:])]
+            uniques[-1] = np.nan  # Code -1 (missing) picks the last slot
+            data[name] = uniques[arrays['description']]
+        else:
+            data[name] = arrays[name]
+    return pd.DataFrame(data, copy=False), header['info']
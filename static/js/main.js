@@ -2,6 +2,20 @@
  * ExpenseTracker Main JavaScript File
  */
 
+// Fetch a chart's data from /api/charts/<name>; params may hold start_date,
+// end_date or last (the N most recent periods). Empty values are left out.
+window.fetchChart = function(name, params) {
+    const query = new URLSearchParams();
+    Object.entries(params || {}).forEach(([key, value]) => {
+        if (value) query.set(key, value);
+    });
+    const url = `/api/charts/${name}` + (query.toString() ? `?${query}` : '');
+    return fetch(url).then(response => {
+        if (!response.ok) throw new Error(`Chart ${name} failed with status ${response.status}`);
+        return response.json();
+    });
+};
+
 document.addEventListener('DOMContentLoaded', function() {
     // Theme Toggle Functionality
     const themeToggleBtn = document.getElementById('theme-toggle');
@@ -0,0 +1,1686 @@
+"""Ledger storage backends for the expense tracker.
+
+Every user's records live in one ledger. ``CsvLedgerStore`` keeps the
+original ``<user>_expenses.csv`` layout; ``SqliteLedgerStore`` keeps one
+indexed SQLite database per user. Both expose the same methods so the
+routes in app.py never touch files directly.
+"""
+import io
+import os
+import csv
+import glob
+import json
+import logging
+import math
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import metrics
+import periods
+from lazy_modules import lazy_import
+from search import SearchIndex
+from snapshot import SnapshotError, read_snapshot, write_snapshot
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialised within one process
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+EXPENSE_COLUMNS = ['id', 'date', 'type', 'category', 'amount', 'description']
+EXPENSE_TYPES = ['Earning', 'Spend', 'Investment', 'Savings']
+# Fields a client is allowed to change on an existing record
+EDITABLE_COLUMNS = ['date', 'type', 'category', 'amount', 'description']
+# <user>_journal.csv: 'patch' (full new record) or 'delete' entries
+JOURNAL_COLUMNS = ['op'] + EXPENSE_COLUMNS
+
+
+class LedgerCache:
+    """Process-wide LRU cache of parsed ledgers, keyed by username.
+
+    Each entry remembers the fingerprint of the file(s) it was parsed from, so
+    edits made by another process or by hand are picked up on the next read.
+    The app's own writes call invalidate() directly, since two writes in quick
+    succession can leave the fingerprint unchanged.
+    """
+
+    def __init__(self, max_users, max_bytes):
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # username -> (fingerprint, df, nbytes)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, username, fingerprint):
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None or entry[0] != fingerprint:
+                return None
+            self._entries.move_to_end(username)
+            return entry[1]
+
+    def put(self, username, fingerprint, df):
+        nbytes = estimate_frame_bytes(df)
+        with self._lock:
+            self._discard(username)
+            if nbytes > self.max_bytes:
+                # Larger than the whole budget; serve it uncached
+                return
+            self._entries[username] = (fingerprint, df, nbytes)
+            self._total_bytes += nbytes
+            while len(self._entries) > self.max_users or self._total_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+
+    def invalidate(self, username):
+        with self._lock:
+            self._discard(username)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def usage(self):
+        """(ledgers held, estimated bytes) right now."""
+        with self._lock:
+            return len(self._entries), self._total_bytes
+
+    def _discard(self, username):
+        entry = self._entries.pop(username, None)
+        if entry is not None:
+            self._total_bytes -= entry[2]
+
+
+class UserWriteLock:
+    """Exclusive lock on one user's ledger, across threads and processes.
+
+    Threads in this process queue on an RLock; other processes (gunicorn
+    workers, CLI commands) are kept out with flock() on a ``.lock`` file.
+    Re-entrant within a thread, so nested writes don't deadlock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._handle = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            handle = open(self.path, 'a')
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            except BaseException:
+                handle.close()
+                self._thread_lock.release()
+                raise
+            self._handle = handle
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0 and self._handle is not None:
+            fcntl.flock(self._handle, fcntl.LOCK_UN)
+            self._handle.close()
+            self._handle = None
+        self._thread_lock.release()
+
+
+def estimate_frame_bytes(df, samples=1000):
+    """Roughly df.memory_usage(deep=True).sum(), measuring a sample of each text column.
+
+    A deep count walks every string, which takes longer than loading a
+    snapshot of the whole ledger.
+    """
+    total = int(df.memory_usage(deep=False).sum())
+    step = max(len(df) // samples, 1)
+    for column in df.columns:
+        values = df[column]
+        if values.dtype == object or pd.api.types.is_string_dtype(values.dtype):
+            sample = values.iloc[::step]
+            extra = sample.memory_usage(deep=True, index=False) - sample.memory_usage(deep=False, index=False)
+            total += int(extra * len(values) / max(len(sample), 1))
+    return total
+
+
+def atomic_write_json(path, data, mode=None):
+    """Replace ``path`` with ``data`` as JSON.
+
+    With ``mode`` (e.g. 0o600 for secrets) the file has those permissions
+    from the moment it is created, before anything is written to it.
+    """
+    # Unique temp name so concurrent writers never share a half-written file
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    if mode is None:
+        file = open(tmp_path, 'w')
+    else:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        # A temp file left behind by a crashed write keeps its old permissions
+        os.fchmod(fd, mode)
+        file = open(fd, 'w')
+    with file:
+        # dumps() uses the C encoder; dump() streams through the pure-Python one
+        body = json.dumps(data)
+        file.write(body)
+    metrics.count_written(len(body))
+    os.replace(tmp_path, path)
+
+
+def _as_json(value):
+    """``value`` as it reads back from JSON (tuples become lists)."""
+    return json.loads(json.dumps(value))
+
+
+def get_file_fingerprint(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def empty_expenses_frame():
+    return pd.DataFrame(columns=EXPENSE_COLUMNS)
+
+
+def parse_expense_dates(values):
+    # Dates written by the app are ISO; fall back to flexible parsing for
+    # anything else (e.g. hand-edited files) instead of dropping the row
+    dates = pd.to_datetime(values, format='ISO8601', errors='coerce')
+    unparsed = dates.isna() & values.notna()
+    if unparsed.any():
+        dates[unparsed] = pd.to_datetime(values[unparsed], errors='coerce')
+    return dates
+
+
+def normalize_expenses(df):
+    """Give a raw ledger frame the types the rest of the app expects."""
+    df = expand_expenses(df)
+    df['date'] = parse_expense_dates(df['date'])
+    df['amount'] = pd.to_numeric(df['amount'], errors='coerce')
+    # Drop any rows with invalid dates
+    return df.dropna(subset=['date']).reset_index(drop=True)
+
+
+def _plain_amounts(amounts):
+    if amounts.dtype == np.float32:
+        # float32 was only chosen when every value was a whole number of cents
+        return amounts.astype('float64').round(2)
+    return amounts
+
+
+def compact_expenses(df, categories=None):
+    """Convert a normalized ledger frame to the compact in-memory schema.
+
+    ``type`` and ``category`` become categoricals (the user's ``categories``
+    first, then any other values found), ``id`` becomes int32 and ``amount``
+    float32 when every value survives the round trip to the cent (float32
+    stops resolving cents above ~131k, so big ledgers may stay float64).
+    ``date`` stays datetime64 and ``description`` a string column.
+    """
+    df = df.copy()
+    for column, known in (('type', EXPENSE_TYPES), ('category', categories or [])):
+        values = df[column].astype('category')
+        present = values.cat.categories.astype(str).tolist()
+        values = values.cat.rename_categories(present) if len(present) else values
+        df[column] = values.cat.set_categories(list(dict.fromkeys([*known, *sorted(present)])))
+
+    ids = pd.to_numeric(df['id'], errors='coerce')
+    if ids.notna().all() and (ids.empty or ids.abs().max() < 2 ** 31):
+        df['id'] = ids.astype(np.int32)
+
+    amounts = df['amount'].astype('float64')
+    narrowed = amounts.astype(np.float32)
+    restored = narrowed.astype('float64').round(2)
+    exact = (restored == amounts) | amounts.isna()
+    df['amount'] = narrowed if exact.all() else amounts
+    return df
+
+
+def expand_expenses(df):
+    """Undo compact_expenses: plain string type/category, int64 id, float64 amount.
+
+    Use before writing a frame back to storage or serialising it, so float32
+    amounts come out as exact cents rather than e.g. 983.1900024414062.
+    """
+    if 'amount' not in df or not (df['amount'].dtype == np.float32 or
+                                  isinstance(df['type'].dtype, pd.CategoricalDtype)):
+        return df
+    df = df.copy()
+    for column in ('type', 'category'):
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(object)
+    if df['id'].dtype == np.int32:
+        df['id'] = df['id'].astype(np.int64)
+    df['amount'] = _plain_amounts(df['amount'])
+    return df
+
+
+def append_compact(df, extra):
+    """Concatenate two compact frames, widening categories and dtypes where they differ."""
+    df, extra = df.copy(deep=False), extra.copy(deep=False)
+    for column in ('type', 'category'):
+        categories = df[column].cat.categories
+        if not categories.equals(extra[column].cat.categories):
+            categories = categories.union(extra[column].cat.categories, sort=False)
+            df[column] = df[column].cat.set_categories(categories)
+            extra[column] = extra[column].cat.set_categories(categories)
+    for column in ('id', 'amount'):
+        if df[column].dtype != extra[column].dtype:
+            dtype = np.result_type(df[column].dtype, extra[column].dtype)
+            df[column] = df[column].astype(dtype)
+            extra[column] = extra[column].astype(dtype)
+    return pd.concat([df, extra], ignore_index=True)
+
+
+def _fits_float32(values):
+    values = np.asarray(values, dtype='float64')
+    restored = values.astype(np.float32).astype('float64').round(2)
+    return bool(((restored == values) | np.isnan(values)).all())
+
+
+def apply_journal(df, journal):
+    """Apply journal entries (see CsvLedgerStore.read_journal) to a ledger frame.
+
+    ``journal`` is indexed by id and holds the last entry per id: ``patch``
+    rows carry the record's new values, ``delete`` rows remove it. Works on
+    compact or plain frames, and on any slice of the ledger.
+    """
+    if journal.empty or df.empty:
+        return df
+    ids = df['id'].to_numpy()
+    deleted = np.isin(ids, journal.index[journal['op'] == 'delete'])
+    patched = np.isin(ids, journal.index[journal['op'] == 'patch']) & ~deleted
+    if patched.any():
+        df = df.copy()
+        positions = np.flatnonzero(patched)
+        rows = journal.loc[ids[patched]]
+        for column in EDITABLE_COLUMNS:
+            values = rows[column].to_numpy()
+            target = df[column]
+            if isinstance(target.dtype, pd.CategoricalDtype):
+                missing = pd.Index(pd.unique(values)).dropna().difference(target.cat.categories)
+                if len(missing):
+                    df[column] = target.cat.add_categories(missing)
+            elif target.dtype == np.float32 and not _fits_float32(values):
+                df[column] = target.astype('float64')
+            df.iloc[positions, df.columns.get_loc(column)] = values
+    if deleted.any():
+        df = df[~deleted].reset_index(drop=True)
+    return df
+
+
+def expense_records(df):
+    """Records for a JSON response, with dates as YYYY-MM-DD and null for missing values."""
+    df = expand_expenses(df)
+    df = df.assign(date=df['date'].dt.strftime('%Y-%m-%d'))
+    # A blank CSV field reads back as NaN, which isn't valid JSON
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+def memory_report(df):
+    """Bytes used per column by ``df`` and by the same ledger with default dtypes."""
+    plain = expand_expenses(df)
+    compact_bytes = df.memory_usage(deep=True, index=False)
+    plain_bytes = plain.memory_usage(deep=True, index=False)
+    return {
+        'rows': len(df),
+        'columns': {column: {'dtype': str(df[column].dtype), 'bytes': int(compact_bytes[column]),
+                             'default_bytes': int(plain_bytes[column])}
+                    for column in df.columns},
+        'bytes': int(compact_bytes.sum()),
+        'default_bytes': int(plain_bytes.sum()),
+    }
+
+
+def format_expense_date(value):
+    """Render a date the way the ledger stores it: YYYY-MM-DD, plus the time if any."""
+    ts = pd.Timestamp(value)
+    if ts == ts.normalize():
+        return ts.strftime('%Y-%m-%d')
+    return ts.strftime('%Y-%m-%d %H:%M:%S')
+
+
+# Columns the paginated listing can be ordered by
+SORTABLE_COLUMNS = ['date', 'type', 'category', 'amount', 'description', 'id']
+
+
+def format_expense_dates(dates):
+    """Vectorised format_expense_date for a datetime Series."""
+    formatted = dates.dt.strftime('%Y-%m-%d')
+    has_time = dates != dates.dt.normalize()
+    if has_time.any():
+        formatted[has_time] = dates[has_time].dt.strftime('%Y-%m-%d %H:%M:%S')
+    return formatted
+
+
+@metrics.timed('filter')
+def filter_expenses(df, start_date=None, end_date=None, category=None, expense_type=None,
+                    min_amount=None, max_amount=None, search=None):
+    metrics.count_rows(len(df))
+    if start_date:
+        df = df[df['date'] >= pd.to_datetime(start_date)]
+    if end_date:
+        df = df[df['date'] <= pd.to_datetime(end_date)]
+    if category:
+        df = df[df['category'] == category]
+    if expense_type:
+        df = df[df['type'] == expense_type]
+    if min_amount is not None:
+        df = df[df['amount'] >= min_amount]
+    if max_amount is not None:
+        df = df[df['amount'] <= max_amount]
+    if search:
+        df = df[df['description'].fillna('').astype(str).str.contains(search, case=False, regex=False)]
+    return df
+
+
+def _sort_key(df, sort):
+    if sort == 'amount':
+        return df['amount'].fillna(0)
+    if sort in ('type', 'category', 'description'):
+        # By value, not by categorical code order
+        return df[sort].astype(object).fillna('').astype(str)
+    return df[sort]
+
+
+ROLLUP_KEYS = ['period', 'type', 'category']
+ROLLUP_COLUMNS = ROLLUP_KEYS + ['amount', 'count']
+
+
+@metrics.timed('aggregate')
+def compute_rollups(df, sign=1):
+    """Sum amounts and count records per (month, type, category).
+
+    ``sign=-1`` produces the delta that removes ``df`` from a rollup.
+    """
+    metrics.count_rows(len(df))
+    if df.empty:
+        return pd.DataFrame(columns=ROLLUP_COLUMNS)
+    # Group on an integer yyyymm and only format the (few) resulting months;
+    # strftime over every record costs more than the groupby itself
+    keyed = pd.DataFrame({
+        'month': df['date'].dt.year * 100 + df['date'].dt.month,
+        'type': df['type'],
+        'category': df['category'],
+        'amount': _plain_amounts(df['amount']).fillna(0) * sign,
+        'count': sign,
+    })
+    totals = keyed.groupby(['month', 'type', 'category'], dropna=False, observed=True,
+                           as_index=False)[['amount', 'count']].sum()
+    months = totals.pop('month')
+    totals.insert(0, 'period', [f"{month // 100:04d}-{month % 100:02d}" for month in months])
+    totals['type'] = totals['type'].astype(object)
+    totals['category'] = totals['category'].astype(object)
+    return totals
+
+
+def merge_rollups(rollups, *deltas):
+    frames = [frame for frame in (rollups, *deltas) if not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=ROLLUP_COLUMNS)
+    merged = pd.concat(frames, ignore_index=True)
+    merged = merged.groupby(ROLLUP_KEYS, dropna=False, as_index=False)[['amount', 'count']].sum()
+    return merged[merged['count'] > 0].reset_index(drop=True)
+
+
+class LedgerStore:
+    """Interface shared by the storage backends.
+
+    Records are plain dicts with the EXPENSE_COLUMNS keys; frames returned by
+    load() and query() have ``date`` as datetime64 and ``amount`` as float.
+    Full ledgers from load() use the compact schema (see compact_expenses);
+    ``categories(username)``, if given, supplies the user's category list.
+    """
+
+    name = None
+
+    def __init__(self, data_dir, cache, categories=None):
+        self.data_dir = data_dir
+        self.cache = cache
+        self.categories = categories
+        self._write_locks = {}
+        self._write_locks_guard = threading.Lock()
+        self._search_indexes = OrderedDict()  # username -> (data version, SearchIndex)
+        self._search_guard = threading.Lock()
+
+    def compact(self, username, df):
+        return compact_expenses(df, self.categories(username) if self.categories else None)
+
+    def write_lock(self, username):
+        """Return the lock that serialises writes to ``username``'s ledger."""
+        with self._write_locks_guard:
+            lock = self._write_locks.get(username)
+            if lock is None:
+                lock_path = os.path.join(self.data_dir, f"{username}.lock")
+                lock = self._write_locks[username] = UserWriteLock(lock_path)
+            return lock
+
+    def initialize(self, username):
+        raise NotImplementedError
+
+    def data_version(self, username):
+        """Return a short string that changes whenever the user's ledger does.
+
+        Cheap enough to call on every request (no records are read), so it
+        can key response caches and ETags.
+        """
+        raise NotImplementedError
+
+    def load(self, username):
+        """Return the user's full ledger as a DataFrame the caller may modify."""
+        raise NotImplementedError
+
+    def add(self, username, record):
+        """Store a new record and return the id assigned to it."""
+        raise NotImplementedError
+
+    def update(self, username, expense_id, changes):
+        """Apply ``changes`` to one record; return False if it does not exist."""
+        raise NotImplementedError
+
+    def delete(self, username, expense_id):
+        """Remove one record; return False if it does not exist."""
+        raise NotImplementedError
+
+    def replace_all(self, username, df):
+        """Swap the whole ledger for ``df`` (used by migrations)."""
+        raise NotImplementedError
+
+    def begin_import(self, username, replace=False):
+        """Return a bulk writer for streaming many records into the ledger.
+
+        Call ``write(df)`` once per chunk, then ``commit()``; nothing is
+        visible until the commit, and ``rollback()`` leaves the ledger as it
+        was. With ``replace`` the existing records are dropped on commit.
+        """
+        raise NotImplementedError
+
+    def query(self, username, **filters):
+        """Return the records matching ``filters`` (see filter_expenses)."""
+        return filter_expenses(self.load(username), **filters)
+
+    def iter_chunks(self, username, filters=None, chunk_size=10000):
+        """Yield the matching records in ledger order, ``chunk_size`` rows at a time."""
+        df = self.query(username, **(filters or {}))
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start + chunk_size]
+
+    @metrics.timed('filter')
+    def page(self, username, filters=None, sort='date', descending=True, limit=50, offset=0, cursor=None):
+        """Return one page of matching records as (frame, total matches, has_more).
+
+        Records are ordered by ``sort`` then ``id``. Pass either ``offset`` or
+        ``cursor``, the (sort value, id) of the last record already seen.
+        """
+        df = filter_expenses(self.load(username), **(filters or {}))
+        total = len(df)
+        key = _sort_key(df, sort)
+        if cursor is not None:
+            value, last_id = cursor
+            if sort == 'date':
+                value = pd.Timestamp(value)
+            if descending:
+                after = (key < value) | ((key == value) & (df['id'] < last_id))
+            else:
+                after = (key > value) | ((key == value) & (df['id'] > last_id))
+            df, key, offset = df[after], key[after], 0
+        ordered = df.assign(_key=key).sort_values(['_key', 'id'], ascending=not descending)
+        rows = ordered.iloc[offset:offset + limit + 1].drop(columns='_key')
+        return rows.head(limit), total, len(rows) > limit
+
+    @metrics.timed('filter')
+    def search(self, username, query, **filters):
+        """Records whose description matches ``query`` (see search.py), best match
+        first and then newest first, narrowed by ``filters`` (see filter_expenses)."""
+        # Version first: an index built from a newer frame is then merely rebuilt once more
+        version = self.data_version(username)
+        df = self.dated_amounts(username)
+        positions, scores = self.search_index(username, version, df).search(query)
+        metrics.count_rows(len(positions))
+        hits = filter_expenses(df.iloc[positions].assign(_score=scores), **filters)
+        order = np.lexsort((-hits['id'].to_numpy(dtype=np.int64),
+                            -hits['date'].to_numpy().astype(np.int64),
+                            -hits['_score'].to_numpy()))
+        return hits.iloc[order].drop(columns='_score').reset_index(drop=True)
+
+    def search_index(self, username, version, df):
+        """The description index over ``df``, the ledger at data version ``version``.
+
+        Built on the first search after a load and then carried across
+        writes (see _carry_search_index) instead of being rebuilt.
+        """
+        with self._search_guard:
+            cached = self._search_indexes.get(username)
+        if cached is not None and cached[0] == version and cached[1].covers(df['id'].to_numpy()):
+            return cached[1]
+        index = SearchIndex.build(df['id'], df['description'])
+        with self._search_guard:
+            self._search_indexes[username] = (version, index)
+            self._search_indexes.move_to_end(username)
+            # One index per cached ledger at most
+            while len(self._search_indexes) > max(self.cache.max_users, 1):
+                self._search_indexes.popitem(last=False)
+        return index
+
+    def _carry_search_index(self, username, version, new_version, change):
+        """After a write took the ledger from ``version`` to ``new_version``, apply
+        the same change to the search index: ``change(index)`` returns the new one."""
+        with self._search_guard:
+            cached = self._search_indexes.get(username)
+            if cached is not None and cached[0] == version:
+                self._search_indexes[username] = (new_version, change(cached[1]))
+            else:
+                self._search_indexes.pop(username, None)
+
+    def count(self, username):
+        return int(self.rollups(username)['count'].sum())
+
+    @metrics.timed('filter')
+    def latest(self, username, limit):
+        return self.load(username).sort_values(['date', 'id'], ascending=False).head(limit)
+
+    def rollups(self, username):
+        """Return the persisted (period, type, category) -> amount/count rollup.
+
+        The rollup is kept up to date by every write, so the aggregates below
+        cost O(months x types x categories) rather than O(records).
+        """
+        raise NotImplementedError
+
+    @metrics.timed('aggregate')
+    def totals_by_type(self, username):
+        rollups = self.rollups(username)
+        return rollups.groupby('type')['amount'].sum().to_dict()
+
+    def rebuild_indexes(self, username):
+        """Rebuild everything derived from the ledger (rollups and the like) from scratch."""
+        raise NotImplementedError
+
+    @staticmethod
+    def covers_whole_months(start_date=None, end_date=None):
+        """True if [start_date, end_date] starts and ends on month boundaries (open ends do)."""
+        start = pd.Timestamp(start_date) if start_date else None
+        end = pd.Timestamp(end_date) if end_date else None
+        return (start is None or start.day == 1) and (end is None or end.is_month_end)
+
+    def rollups_between(self, username, start_date=None, end_date=None):
+        """Rollup rows for the months in [start_date, end_date], or None when
+        the range cuts through a month and only the records can answer it."""
+        if not self.covers_whole_months(start_date, end_date):
+            return None
+        rollups = self.rollups(username)
+        start = pd.Timestamp(start_date) if start_date else None
+        end = pd.Timestamp(end_date) if end_date else None
+        if start is not None:
+            rollups = rollups[rollups['period'] >= f"{start.year:04d}-{start.month:02d}"]
+        if end is not None:
+            rollups = rollups[rollups['period'] <= f"{end.year:04d}-{end.month:02d}"]
+        return rollups
+
+    @metrics.timed('aggregate')
+    def period_totals(self, username, period='month', start_day=1,
+                      fiscal_start=periods.DEFAULT_FINANCIAL_YEAR_START, start_date=None, end_date=None):
+        """Sum of amounts per (cycle, type), in cycle order; see periods.py for the kinds.
+
+        Cycles made of whole calendar months are bucketed from the monthly
+        rollup; weeks, cycles starting mid-month and date ranges that split
+        a month need every record's date.
+        """
+        rollups = None
+        if periods.aligns_with_months(period, start_day):
+            rollups = self.rollups_between(username, start_date, end_date)
+        if rollups is not None:
+            dates = pd.to_datetime(rollups['period'], format='%Y-%m')
+            return periods.period_totals(dates, rollups['type'], rollups['amount'],
+                                         period, start_day, fiscal_start)
+        df = filter_expenses(self.dated_amounts(username), start_date=start_date, end_date=end_date)
+        return periods.period_totals(df['date'], df['type'], _plain_amounts(df['amount']).fillna(0),
+                                     period, start_day, fiscal_start)
+
+    @metrics.timed('aggregate')
+    def category_period_totals(self, username, expense_type, period='month', start_day=1,
+                               fiscal_start=periods.DEFAULT_FINANCIAL_YEAR_START, start_date=None, end_date=None):
+        """Cycles x categories frame of ``expense_type`` amounts, one row per cycle (see period_matrix)."""
+        rollups = None
+        if periods.aligns_with_months(period, start_day):
+            rollups = self.rollups_between(username, start_date, end_date)
+        if rollups is not None:
+            rollups = rollups[rollups['type'] == expense_type]
+            return periods.period_matrix(pd.to_datetime(rollups['period'], format='%Y-%m'), rollups['category'],
+                                         rollups['amount'], period, start_day, fiscal_start)
+        df = filter_expenses(self.dated_amounts(username), start_date=start_date, end_date=end_date,
+                             expense_type=expense_type)
+        return periods.period_matrix(df['date'], df['category'], _plain_amounts(df['amount']).fillna(0),
+                                     period, start_day, fiscal_start)
+
+    def dated_amounts(self, username):
+        """Frame with at least date, type, category, amount and description for every record (read-only)."""
+        return self.load(username)
+
+    @metrics.timed('aggregate')
+    def category_totals(self, username, expense_type, start_date=None, end_date=None):
+        rollups = self.rollups_between(username, start_date, end_date)
+        if rollups is None:
+            df = filter_expenses(self.dated_amounts(username), start_date=start_date, end_date=end_date,
+                                 expense_type=expense_type)
+            totals = _plain_amounts(df['amount']).groupby(df['category'], observed=True).sum()
+            return {category: float(amount) for category, amount in totals.items()}
+        return rollups[rollups['type'] == expense_type].groupby('category')['amount'].sum().to_dict()
+
+
+class CsvLedgerStore(LedgerStore):
+    """Flat ``<user>_expenses.csv`` files, the app's original format.
+
+    Rollups live next to the CSV in ``<user>_rollups.json``, stamped with the
+    CSV fingerprint they describe; a mismatch triggers a rebuild.
+
+    Edits and deletes don't rewrite the CSV: they append a full-row patch or
+    a tombstone to ``<user>_journal.csv``, found through an id -> row index,
+    and the journal is applied on top of the CSV whenever it is read. Once
+    the journal passes JOURNAL_COMPACT_BYTES a background thread folds it
+    into the CSV with a single rewrite.
+
+    Every write holds the user's write lock. Appends are single fsync'd
+    lines and rewrites go to a temp file that is swapped in with
+    os.replace(), so readers never need the lock and never see a partial file.
+
+    Parsing a big CSV is slow, so loads prefer ``<user>_expenses.snapshot``,
+    a memory-mapped binary copy (see snapshot.py). It records the CSV
+    fingerprint, size and rewrite epoch it was taken at: a CSV with that
+    exact fingerprint loads from it alone, rows the app appended since are
+    parsed from the tail of the CSV, and a rewrite (or an app write to a CSV
+    edited by hand) makes it stale. It is rebuilt in the background after
+    every full parse, including of ledgers the app never wrote, or once the
+    tail grows; the CSV remains the source of truth and the snapshot can be
+    deleted at any time.
+    """
+
+    name = 'csv'
+    # Rebuild the snapshot once this many rows have to be parsed from the CSV tail
+    SNAPSHOT_MAX_TAIL_ROWS = 5000
+    # Fold the journal into the CSV once it grows past this (roughly 5000 edits)
+    JOURNAL_COMPACT_BYTES = 256 * 1024
+
+    def __init__(self, data_dir, cache, categories=None):
+        super().__init__(data_dir, cache, categories)
+        self._rollups = {}  # username -> (ledger fingerprint, rollup frame)
+        self._id_index = {}  # username -> (ledger fingerprint, pd.Index of ids)
+        self._background = set()  # (task, username) pairs queued or running
+        self._background_guard = threading.Lock()
+
+    def data_path(self, username):
+        return os.path.join(self.data_dir, f"{username}_expenses.csv")
+
+    def meta_path(self, username):
+        return os.path.join(self.data_dir, f"{username}_meta.json")
+
+    def rollup_path(self, username):
+        return os.path.join(self.data_dir, f"{username}_rollups.json")
+
+    def snapshot_path(self, username):
+        return os.path.join(self.data_dir, f"{username}_expenses.snapshot")
+
+    def journal_path(self, username):
+        return os.path.join(self.data_dir, f"{username}_journal.csv")
+
+    def fingerprint(self, username):
+        return (get_file_fingerprint(self.data_path(username)),
+                get_file_fingerprint(self.journal_path(username)))
+
+    def initialize(self, username):
+        data_path = self.data_path(username)
+        if not os.path.exists(data_path):
+            with open(data_path, 'w', newline='') as file:
+                csv.writer(file).writerow(EXPENSE_COLUMNS)
+
+    def load(self, username):
+        # Callers are free to add columns or edit rows; keep the cached frame intact
+        return self._load_shared(username)[1].copy()
+
+    @metrics.timed('load')
+    def _load_shared(self, username):
+        """Return (fingerprint, ledger frame) straight from the cache; don't modify the frame."""
+        data_path = self.data_path(username)
+        fingerprint = self.fingerprint(username)
+        ledger_fingerprint = fingerprint[0]
+        if ledger_fingerprint is None:
+            return fingerprint, empty_expenses_frame()
+
+        df = self.cache.get(username, fingerprint)
+        if df is None:
+            if ledger_fingerprint[1] == 0:  # If file is empty, initialize it
+                df = empty_expenses_frame()
+                df.to_csv(data_path, index=False)
+                return fingerprint, df
+            df = self._load_snapshot(username, ledger_fingerprint)
+            if df is None:
+                try:
+                    df = pd.read_csv(data_path, encoding='utf-8')
+                except pd.errors.EmptyDataError:
+                    return fingerprint, empty_expenses_frame()
+                metrics.count_read(ledger_fingerprint[1])
+                metrics.count_rows(len(df))
+                log.debug('Loaded %d records from %s', len(df), data_path)
+                df = self.compact(username, normalize_expenses(df))
+                self._refresh_snapshot(username, ledger_fingerprint, df)
+            df = apply_journal(df, self.read_journal(username))
+            self.cache.put(username, fingerprint, df)
+        return fingerprint, df
+
+    def dated_amounts(self, username):
+        return self._load_shared(username)[1]
+
+    def read_journal(self, username):
+        """Return the last journal entry per id, indexed by id (empty if no journal)."""
+        columns = {'type': str, 'category': str, 'description': str, 'op': str}
+        try:
+            journal = pd.read_csv(self.journal_path(username), dtype=columns, encoding='utf-8')
+        except (OSError, pd.errors.EmptyDataError):
+            return pd.DataFrame(columns=JOURNAL_COLUMNS).set_index('id')
+        metrics.count_read(os.path.getsize(self.journal_path(username)))
+        journal['id'] = pd.to_numeric(journal['id'], errors='coerce')
+        # A torn last line (crash mid-append) has no usable id or op
+        journal = journal.dropna(subset=['id', 'op'])
+        journal['id'] = journal['id'].astype(np.int64)
+        journal['date'] = parse_expense_dates(journal['date'])
+        journal['amount'] = pd.to_numeric(journal['amount'], errors='coerce')
+        return journal.drop_duplicates('id', keep='last').set_index('id')
+
+    def _position(self, username, fingerprint, df, expense_id):
+        """Row of ``expense_id`` in the cached frame, via a hashed id index."""
+        cached = self._id_index.get(username)
+        if cached is None or cached[0] != fingerprint:
+            cached = self._id_index[username] = (fingerprint, pd.Index(df['id']))
+        try:
+            position = cached[1].get_loc(expense_id)
+        except KeyError:
+            return None
+        if isinstance(position, slice):  # Duplicate ids: use the first, as before
+            return position.start
+        if isinstance(position, np.ndarray):
+            return int(np.flatnonzero(position)[0])
+        return position
+
+    def _append_journal(self, username, fingerprint, df, entries):
+        """Append ``entries`` (JOURNAL_COLUMNS) to the journal and patch the cached frame."""
+        journal_path = self.journal_path(username)
+        edited = self._edited_outside(username)
+        if os.path.exists(journal_path):
+            self.recover_tail(journal_path, (self.load_meta(username).get('journal') or [None, None])[1])
+        with open(journal_path, 'a', newline='', encoding='utf-8') as f:
+            start = f.tell()
+            if start == 0:
+                csv.writer(f).writerow(JOURNAL_COLUMNS)
+            lines = entries.assign(date=entries['date'].map(
+                lambda value: '' if pd.isna(value) else format_expense_date(value)))
+            lines.to_csv(f, header=False, index=False, columns=JOURNAL_COLUMNS)
+            f.flush()
+            os.fsync(f.fileno())
+            metrics.count_written(f.tell() - start)
+        self.save_meta(username, self.max_id(username), rewritten=edited)
+
+        # Same change to the frame we hold, so the next read needn't reload
+        patched = apply_journal(df, entries.set_index('id'))
+        new_fingerprint = self.fingerprint(username)
+        self.cache.put(username, new_fingerprint, patched)
+        index = self._id_index.get(username)
+        if len(patched) == len(df) and index is not None and index[0] == fingerprint:
+            self._id_index[username] = (new_fingerprint, index[1])
+        if os.path.getsize(journal_path) > self.JOURNAL_COMPACT_BYTES:
+            self._in_background('compact', username, self.compact_journal)
+
+    def compact_journal(self, username):
+        """Fold the journal into the CSV with one rewrite; returns False if there was none."""
+        with self.write_lock(username):
+            if not os.path.exists(self.journal_path(username)):
+                return False
+            rollups = self.rollups(username)
+            version = self.data_version(username)
+            _, df = self._load_shared(username)
+            self._write_frame(username, df)
+            # Same records, new file: the rollup and search index still hold
+            self.save_rollups(username, rollups)
+            self._carry_search_index(username, version, self.data_version(username), lambda index: index)
+            return True
+
+    def rebuild_indexes(self, username):
+        """Fold in the journal, then rebuild the rollup and snapshot from the CSV itself."""
+        with self.write_lock(username):
+            self.compact_journal(username)
+            for path in (self.snapshot_path(username), self.rollup_path(username)):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.cache.invalidate(username)
+            self._rollups.pop(username, None)
+            self._id_index.pop(username, None)
+            # Parses the CSV (queueing a fresh snapshot) and persists the rollup
+            return int(self.rollups(username)['count'].sum())
+
+    def _in_background(self, task, username, func, *args):
+        """Run ``func(username, *args)`` on a daemon thread unless ``task`` already is."""
+        key = (task, username)
+        with self._background_guard:
+            if key in self._background:
+                return
+            self._background.add(key)
+
+        def run():
+            try:
+                func(username, *args)
+            except (OSError, SnapshotError) as e:
+                log.warning('Background %s failed for %s: %s', task, username, e)
+            finally:
+                with self._background_guard:
+                    self._background.discard(key)
+
+        threading.Thread(target=run, name=f"{task}-{username}", daemon=True).start()
+
+    def _load_snapshot(self, username, fingerprint):
+        """Return the ledger from its snapshot plus the CSV tail, or None if unusable."""
+        try:
+            df, info = read_snapshot(self.snapshot_path(username))
+        except (OSError, SnapshotError, ValueError, KeyError):
+            return None
+        metrics.count_read(os.path.getsize(self.snapshot_path(username)))
+        if info.get('ledger') == list(fingerprint):
+            return df  # Taken from exactly this file
+        meta = self.load_meta(username)
+        if meta.get('ledger') != list(fingerprint):
+            return None  # Mid-write, or edited outside the app
+        covered = info.get('size', 0)
+        if info.get('epoch') != meta.get('epoch', 0) or covered > fingerprint[1]:
+            return None
+        if covered < fingerprint[1]:
+            tail = self._read_tail(username, covered)
+            if not tail.empty:
+                df = append_compact(df, self.compact(username, tail))
+            if len(tail) >= self.SNAPSHOT_MAX_TAIL_ROWS:
+                self._refresh_snapshot(username, fingerprint, df)
+        return df
+
+    def _read_tail(self, username, offset):
+        with open(self.data_path(username), 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        metrics.count_read(len(data))
+        text_columns = {'type': str, 'category': str, 'description': str}
+        try:
+            tail = pd.read_csv(io.BytesIO(data), names=EXPENSE_COLUMNS, header=None,
+                               dtype=text_columns, encoding='utf-8')
+        except pd.errors.EmptyDataError:
+            return empty_expenses_frame()
+        return normalize_expenses(tail)
+
+    def _refresh_snapshot(self, username, fingerprint, df):
+        """Write a snapshot of ``df``, parsed from the CSV at ``fingerprint``, in the background.
+
+        Skipped if the CSV has changed since. The app needn't have written
+        that state (an old ledger, a hand edit): the snapshot is keyed on the
+        fingerprint, and any write to such a file bumps the epoch first.
+        """
+        if get_file_fingerprint(self.data_path(username)) != fingerprint:
+            return
+        epoch = self.load_meta(username).get('epoch', 0)
+        self._in_background('snapshot', username, lambda username: write_snapshot(
+            self.snapshot_path(username), df, size=fingerprint[1], epoch=epoch, ledger=list(fingerprint)))
+
+    def _edited_outside(self, username):
+        """True if the CSV isn't the one the meta file recorded (hand edit, old ledger, crash).
+
+        A write to such a file must retire the snapshot (``rewritten``), or
+        the next load would take the edited bytes as the snapshot's prefix.
+        """
+        fingerprint = get_file_fingerprint(self.data_path(username))
+        return self.load_meta(username).get('ledger') != (list(fingerprint) if fingerprint else None)
+
+    def iter_chunks(self, username, filters=None, chunk_size=10000):
+        # Read straight from the file so exports never hold the whole ledger
+        data_path = self.data_path(username)
+        if not os.path.exists(data_path) or os.path.getsize(data_path) == 0:
+            return
+        text_columns = {'type': str, 'category': str, 'description': str}
+        journal = self.read_journal(username)
+        metrics.count_read(os.path.getsize(data_path))
+        try:
+            reader = pd.read_csv(data_path, encoding='utf-8', dtype=text_columns, chunksize=chunk_size)
+            for chunk in reader:
+                chunk = apply_journal(normalize_expenses(chunk), journal)
+                chunk = filter_expenses(chunk, **(filters or {}))
+                if not chunk.empty:
+                    yield chunk
+        except pd.errors.EmptyDataError:
+            return
+
+    def load_meta(self, username):
+        try:
+            with open(self.meta_path(username), 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def save_meta(self, username, max_id, rewritten=False):
+        """Persist the highest id together with the CSV size it was taken at.
+
+        A size mismatch on the next append means the CSV was changed behind
+        our back (hand edit, crash between the two writes), so the id gets
+        rescanned. Every call is a write, so it also bumps the data version;
+        ``rewritten`` (anything but an append) also bumps the epoch, which
+        retires the snapshot.
+        """
+        data_path = self.data_path(username)
+        previous = self.load_meta(username)
+        meta = {
+            'max_id': int(max_id),
+            'size': os.path.getsize(data_path),
+            'version': previous.get('version', 0) + 1,
+            'epoch': previous.get('epoch', 0) + (1 if rewritten else 0),
+            'ledger': get_file_fingerprint(data_path),
+            'journal': get_file_fingerprint(self.journal_path(username)),
+        }
+        atomic_write_json(self.meta_path(username), meta)
+
+    def data_version(self, username):
+        meta = self.load_meta(username)
+        version = meta.get('version', 0)
+        fingerprint = _as_json(self.fingerprint(username))
+        if fingerprint[0] is not None and fingerprint != [meta.get('ledger'), meta.get('journal')]:
+            # Edited outside the app since our last write
+            stamp = '.'.join(str(value) for part in fingerprint if part for value in part)
+            return f"{version}.{stamp}"
+        return str(version)
+
+    def max_id(self, username):
+        data_path = self.data_path(username)
+        meta = self.load_meta(username)
+        if meta.get('size') == os.path.getsize(data_path):
+            return meta['max_id']
+        return self.scan_max_id(data_path)
+
+    @staticmethod
+    def scan_max_id(data_path):
+        try:
+            ids = pd.read_csv(data_path, usecols=['id'], encoding='utf-8')['id']
+        except (pd.errors.EmptyDataError, ValueError):
+            return 0
+        ids = pd.to_numeric(ids, errors='coerce').dropna()
+        return int(ids.max()) if not ids.empty else 0
+
+    @staticmethod
+    def recover_tail(data_path, good_size=None):
+        """Mend a last line that doesn't end in a newline.
+
+        A crash during an append leaves a torn line, which is trimmed. But
+        files saved by hand or by a spreadsheet often just lack the final
+        newline, so a last line with every field of a record gets the
+        newline instead, and nothing within ``good_size`` (the length the
+        app last wrote, known to be whole) is ever trimmed.
+        """
+        with open(data_path, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b'\n':
+                return
+            # Walk back to the last complete line
+            pos, line_start = size, 0
+            while pos > 0:
+                step = min(65536, pos)
+                pos -= step
+                f.seek(pos)
+                last_newline = f.read(step).rfind(b'\n')
+                if last_newline != -1:
+                    line_start = pos + last_newline + 1
+                    break
+            f.seek(0)
+            header = f.readline()
+            f.seek(line_start)
+            last_line = f.read()
+            torn = line_start >= (good_size or 0) and not CsvLedgerStore._is_whole_record(header, last_line)
+            if not torn:
+                f.write(b'\n')
+                log.info('Added the missing final newline to %s', data_path)
+            elif line_start:
+                f.truncate(line_start)
+                log.warning('Trimmed torn line from %s', data_path)
+            else:
+                # Not even the header survived
+                f.truncate(0)
+
+    @staticmethod
+    def _is_whole_record(header, line):
+        """True if the CSV ``line`` has every column of ``header`` and a usable amount."""
+        try:
+            columns = next(csv.reader([header.decode('utf-8').strip()]))
+            fields = next(csv.reader([line.decode('utf-8')]))
+        except (UnicodeDecodeError, csv.Error, StopIteration):
+            return False
+        if len(fields) != len(columns) or 'amount' not in columns:
+            return False
+        amount = fields[columns.index('amount')].strip()
+        try:
+            return amount == '' or math.isfinite(float(amount))
+        except ValueError:
+            return False
+
+    @metrics.timed('write')
+    def add(self, username, record):
+        """Append a single record to the CSV and return its new id.
+
+        The next id comes from the sidecar meta file, so adding a record costs
+        the same whatever the size of the ledger.
+        """
+        with self.write_lock(username):
+            data_path = self.data_path(username)
+            edited = self._edited_outside(username)
+            if os.path.exists(data_path):
+                self.recover_tail(data_path, self.load_meta(username).get('size'))
+            if not os.path.exists(data_path) or os.path.getsize(data_path) == 0:
+                with open(data_path, 'w', newline='', encoding='utf-8') as f:
+                    csv.writer(f).writerow(EXPENSE_COLUMNS)
+            rollups = self.rollups(username)
+            version = self.data_version(username)
+            new_id = self.max_id(username) + 1
+
+            row = dict(record, id=str(new_id))
+            with open(data_path, 'a', newline='', encoding='utf-8') as f:
+                start = f.tell()
+                csv.DictWriter(f, fieldnames=EXPENSE_COLUMNS).writerow(row)
+                f.flush()
+                os.fsync(f.fileno())
+                metrics.count_written(f.tell() - start)
+
+            self.save_meta(username, new_id, rewritten=edited)
+            self.cache.invalidate(username)
+            added = normalize_expenses(pd.DataFrame([row], columns=EXPENSE_COLUMNS))
+            self.save_rollups(username, merge_rollups(rollups, compute_rollups(added)))
+            # The reloaded ledger is the old one plus this row at the end
+            self._carry_search_index(username, version, self.data_version(username),
+                                     lambda index: index.appended([new_id], [record.get('description')]))
+            return new_id
+
+    def _write_frame(self, username, df):
+        """Atomically replace the CSV with ``df``; caller holds the write lock."""
+        df = expand_expenses(df)
+        data_path = self.data_path(username)
+        tmp_path = f"{data_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+                df.to_csv(f, index=False, columns=EXPENSE_COLUMNS)
+                f.flush()
+                os.fsync(f.fileno())
+                metrics.count_written(f.tell())
+            os.replace(tmp_path, data_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        # The rewritten CSV already has the journal's changes in it
+        if os.path.exists(self.journal_path(username)):
+            os.remove(self.journal_path(username))
+        ids = pd.to_numeric(df['id'], errors='coerce').dropna()
+        self.save_meta(username, ids.max() if not ids.empty else 0, rewritten=True)
+        self.cache.invalidate(username)
+
+    @metrics.timed('write')
+    def update(self, username, expense_id, changes):
+        with self.write_lock(username):
+            rollups = self.rollups(username)
+            version = self.data_version(username)
+            fingerprint, df = self._load_shared(username)
+            position = self._position(username, fingerprint, df, expense_id)
+            if position is None:
+                return False
+            # Plain dtypes, so a new category can be assigned
+            before = expand_expenses(df.iloc[[position]]).reset_index(drop=True)
+            after = before.copy()
+            for key, value in changes.items():
+                if key == 'date':
+                    value = pd.to_datetime(value)
+                elif key == 'amount':
+                    value = float(value)
+                if key in EDITABLE_COLUMNS:
+                    after.at[0, key] = value
+            self._append_journal(username, fingerprint, df, after.assign(op='patch'))
+            self.save_rollups(username, merge_rollups(
+                rollups, compute_rollups(before, sign=-1), compute_rollups(after)))
+            description = after.at[0, 'description']
+            self._carry_search_index(username, version, self.data_version(username),
+                                     lambda index: index.replaced(position, description))
+            return True
+
+    @metrics.timed('write')
+    def delete(self, username, expense_id):
+        with self.write_lock(username):
+            rollups = self.rollups(username)
+            version = self.data_version(username)
+            fingerprint, df = self._load_shared(username)
+            position = self._position(username, fingerprint, df, expense_id)
+            if position is None:
+                return False
+            removed = expand_expenses(df.iloc[[position]]).reset_index(drop=True)
+            tombstone = pd.DataFrame({'op': ['delete'], 'id': [int(removed.at[0, 'id'])],
+                                      'date': [pd.NaT]}).reindex(columns=JOURNAL_COLUMNS)
+            self._append_journal(username, fingerprint, df, tombstone)
+            self.save_rollups(username, merge_rollups(rollups, compute_rollups(removed, sign=-1)))
+            self._carry_search_index(username, version, self.data_version(username),
+                                     lambda index: index.removed(position))
+            return True
+
+    @metrics.timed('write')
+    def replace_all(self, username, df):
+        df = normalize_expenses(df[EXPENSE_COLUMNS].copy())
+        with self.write_lock(username):
+            self._write_frame(username, df)
+            self.save_rollups(username, compute_rollups(df))
+
+    def begin_import(self, username, replace=False):
+        return CsvBulkWriter(self, username, replace)
+
+    def rollups(self, username):
+        fingerprint = self.fingerprint(username)
+        cached = self._rollups.get(username)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+
+        try:
+            with open(self.rollup_path(username), 'r') as file:
+                text = file.read()
+            metrics.count_read(len(text))
+            stored = json.loads(text)
+        except (OSError, ValueError):
+            stored = None
+        if stored is not None and stored.get('ledger') == _as_json(fingerprint):
+            rollups = pd.DataFrame(stored['rows'], columns=ROLLUP_COLUMNS)
+            self._rollups[username] = (fingerprint, rollups)
+            return rollups
+
+        # Missing, or the CSV changed outside the app: rebuild from the ledger.
+        # Only persist it if no write landed while we were reading.
+        rollups = compute_rollups(self.load(username))
+        if self.fingerprint(username) == fingerprint:
+            self.save_rollups(username, rollups, fingerprint)
+        return rollups
+
+    def save_rollups(self, username, rollups, fingerprint=None):
+        """Persist ``rollups`` as describing the CSV and journal at ``fingerprint`` (default: now)."""
+        if fingerprint is None:
+            fingerprint = self.fingerprint(username)
+        atomic_write_json(self.rollup_path(username),
+                          {'ledger': fingerprint, 'rows': rollups.values.tolist()})
+        self._rollups[username] = (fingerprint, rollups)
+
+
+class CsvBulkWriter:
+    """Streams imported chunks into a CSV ledger.
+
+    Replacing writes to a side file that is swapped in on commit; merging
+    appends in place and truncates back to the original size on rollback.
+    """
+
+    def __init__(self, store, username, replace):
+        self.store = store
+        self.username = username
+        self.replace = replace
+        self.edited = False  # appending to a CSV changed outside the app
+        # Held until commit() or rollback()
+        self.lock = store.write_lock(username)
+        self.lock.__enter__()
+        try:
+            self._start()
+        except BaseException:
+            self.lock.__exit__(None, None, None)
+            raise
+
+    def _start(self):
+        store, username, replace = self.store, self.username, self.replace
+        data_path = store.data_path(username)
+        if replace:
+            self.path = f"{data_path}.importing"
+            with open(self.path, 'w', newline='', encoding='utf-8') as f:
+                csv.writer(f).writerow(EXPENSE_COLUMNS)
+            self.original_size = 0
+            self.next_id = 1
+            self.rollups = pd.DataFrame(columns=ROLLUP_COLUMNS)
+        else:
+            self.edited = store._edited_outside(username)
+            store.initialize(username)
+            store.recover_tail(data_path, store.load_meta(username).get('size'))
+            self.path = data_path
+            self.original_size = os.path.getsize(data_path)
+            self.next_id = store.max_id(username) + 1
+            self.rollups = store.rollups(username)
+
+    @metrics.timed('write')
+    def write(self, df):
+        """Append ``df`` (typed like load(), without ids) and return the rows written."""
+        df = df.assign(id=np.arange(self.next_id, self.next_id + len(df)))[EXPENSE_COLUMNS]
+        df.assign(date=format_expense_dates(df['date'])).to_csv(
+            self.path, mode='a', header=False, index=False, encoding='utf-8')
+        self.next_id += len(df)
+        self.rollups = merge_rollups(self.rollups, compute_rollups(df))
+        return len(df)
+
+    @metrics.timed('write')
+    def commit(self):
+        try:
+            with open(self.path, 'rb+') as f:
+                os.fsync(f.fileno())
+                metrics.count_written(f.seek(0, os.SEEK_END) - self.original_size)
+            if self.replace:
+                os.replace(self.path, self.store.data_path(self.username))
+                journal_path = self.store.journal_path(self.username)
+                if os.path.exists(journal_path):
+                    os.remove(journal_path)
+            self.store.save_meta(self.username, self.next_id - 1, rewritten=self.replace or self.edited)
+            self.store.cache.invalidate(self.username)
+            self.store.save_rollups(self.username, self.rollups)
+        finally:
+            self.lock.__exit__(None, None, None)
+
+    def rollback(self):
+        try:
+            if self.replace:
+                os.remove(self.path)
+            else:
+                with open(self.path, 'rb+') as f:
+                    f.truncate(self.original_size)
+            self.store.cache.invalidate(self.username)
+        finally:
+            self.lock.__exit__(None, None, None)
+
+
+class SqliteLedgerStore(LedgerStore):
+    """One SQLite database per user (``<user>_expenses.db``) in WAL mode.
+
+    Filters run as SQL against indexes on (date), (type, date) and
+    (category, date) instead of scanning a DataFrame. The rollups table is
+    maintained by triggers, inside the same transaction as each write, and
+    so is the one-row ledger_version counter behind data_version().
+    """
+
+    name = 'sqlite'
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS expenses (
+            id INTEGER PRIMARY KEY,
+            date TEXT NOT NULL,
+            type TEXT NOT NULL,
+            category TEXT NOT NULL,
+            amount REAL,
+            description TEXT NOT NULL DEFAULT ''
+        );
+        CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses (date);
+        CREATE INDEX IF NOT EXISTS idx_expenses_type_date ON expenses (type, date);
+        CREATE INDEX IF NOT EXISTS idx_expenses_category_date ON expenses (category, date);
+
+        CREATE TABLE IF NOT EXISTS rollups (
+            period TEXT NOT NULL,
+            type TEXT NOT NULL,
+            category TEXT NOT NULL,
+            amount REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (period, type, category)
+        );
+        CREATE TRIGGER IF NOT EXISTS rollups_insert AFTER INSERT ON expenses BEGIN
+            INSERT INTO rollups (period, type, category, amount, count)
+            VALUES (substr(NEW.date, 1, 7), NEW.type, NEW.category, COALESCE(NEW.amount, 0), 1)
+            ON CONFLICT (period, type, category)
+            DO UPDATE SET amount = amount + excluded.amount, count = count + 1;
+        END;
+        -- Replaced by the keyed triggers below; theirs scanned every rollup per row
+        DROP TRIGGER IF EXISTS rollups_delete;
+        DROP TRIGGER IF EXISTS rollups_update;
+        CREATE TRIGGER IF NOT EXISTS rollups_delete_keyed AFTER DELETE ON expenses BEGIN
+            UPDATE rollups SET amount = amount - COALESCE(OLD.amount, 0), count = count - 1
+            WHERE period = substr(OLD.date, 1, 7) AND type = OLD.type AND category = OLD.category;
+            DELETE FROM rollups
+            WHERE period = substr(OLD.date, 1, 7) AND type = OLD.type AND category = OLD.category AND count <= 0;
+        END;
+        CREATE TRIGGER IF NOT EXISTS rollups_update_keyed
+        AFTER UPDATE OF date, type, category, amount ON expenses BEGIN
+            UPDATE rollups SET amount = amount - COALESCE(OLD.amount, 0), count = count - 1
+            WHERE period = substr(OLD.date, 1, 7) AND type = OLD.type AND category = OLD.category;
+            INSERT INTO rollups (period, type, category, amount, count)
+            VALUES (substr(NEW.date, 1, 7), NEW.type, NEW.category, COALESCE(NEW.amount, 0), 1)
+            ON CONFLICT (period, type, category)
+            DO UPDATE SET amount = amount + excluded.amount, count = count + 1;
+            DELETE FROM rollups
+            WHERE period = substr(OLD.date, 1, 7) AND type = OLD.type AND category = OLD.category AND count <= 0;
+        END;
+
+        CREATE TABLE IF NOT EXISTS ledger_version (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            version INTEGER NOT NULL
+        );
+        CREATE TRIGGER IF NOT EXISTS ledger_version_insert AFTER INSERT ON expenses BEGIN
+            INSERT INTO ledger_version (id, version) VALUES (0, 1)
+            ON CONFLICT (id) DO UPDATE SET version = version + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS ledger_version_delete AFTER DELETE ON expenses BEGIN
+            INSERT INTO ledger_version (id, version) VALUES (0, 1)
+            ON CONFLICT (id) DO UPDATE SET version = version + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS ledger_version_update AFTER UPDATE ON expenses BEGIN
+            INSERT INTO ledger_version (id, version) VALUES (0, 1)
+            ON CONFLICT (id) DO UPDATE SET version = version + 1;
+        END;
+    """
+
+    def __init__(self, data_dir, cache, categories=None):
+        super().__init__(data_dir, cache, categories)
+        self._local = threading.local()
+
+    def db_path(self, username):
+        return os.path.join(self.data_dir, f"{username}_expenses.db")
+
+    def connect(self, username):
+        """Return this thread's connection to the user's database."""
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        path = self.db_path(username)
+        conn = connections.get(path)
+        if conn is None:
+            # SQLite does its own locking; wait for other writers rather than fail
+            conn = sqlite3.connect(path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(self.SCHEMA)
+            self._backfill_rollups(conn)
+            connections[path] = conn
+        return conn
+
+    FILL_ROLLUPS = ('INSERT INTO rollups (period, type, category, amount, count) '
+                    'SELECT substr(date, 1, 7), type, category, SUM(COALESCE(amount, 0)), COUNT(*) '
+                    'FROM expenses GROUP BY 1, 2, 3')
+
+    @classmethod
+    def _backfill_rollups(cls, conn):
+        # Databases created before the rollups table existed start out empty
+        if conn.execute('SELECT 1 FROM rollups LIMIT 1').fetchone() is None:
+            with conn:
+                # Re-check under the write lock: another connection may have beaten us to it
+                conn.execute('BEGIN IMMEDIATE')
+                if conn.execute('SELECT 1 FROM rollups LIMIT 1').fetchone() is None:
+                    conn.execute(cls.FILL_ROLLUPS)
+
+    def rebuild_indexes(self, username):
+        """Recompute the rollups table, then rebuild the indexes and planner statistics."""
+        conn = self.connect(username)
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM rollups')
+            conn.execute(self.FILL_ROLLUPS)
+        conn.execute('REINDEX')
+        conn.execute('ANALYZE')
+        return conn.execute('SELECT COUNT(*) FROM expenses').fetchone()[0]
+
+    def fingerprint(self, username):
+        path = self.db_path(username)
+        return (get_file_fingerprint(path), get_file_fingerprint(f"{path}-wal"))
+
+    def initialize(self, username):
+        self.connect(username)
+
+    def data_version(self, username):
+        row = self.connect(username).execute('SELECT version FROM ledger_version').fetchone()
+        return str(row[0] if row else 0)
+
+    @metrics.timed('load')
+    def _read_frame(self, username, sql, params=()):
+        df = pd.read_sql_query(sql, self.connect(username), params=params)
+        metrics.count_rows(len(df))
+        return normalize_expenses(df)
+
+    def load(self, username):
+        return self.dated_amounts(username).copy()
+
+    def dated_amounts(self, username):
+        # The cached frame itself; callers must not modify it
+        fingerprint = self.fingerprint(username)
+        df = self.cache.get(username, fingerprint)
+        if df is None:
+            df = self._read_frame(username, 'SELECT id, date, type, category, amount, description '
+                                            'FROM expenses ORDER BY id')
+            df = self.compact(username, df)
+            self.cache.put(username, fingerprint, df)
+        return df
+
+    @staticmethod
+    def _written_version(conn):
+        """(before, after) data versions of a single-row write, read inside its transaction."""
+        version = conn.execute('SELECT version FROM ledger_version').fetchone()[0]
+        return str(version - 1), str(version)
+
+    @metrics.timed('write')
+    def add(self, username, record):
+        conn = self.connect(username)
+        description = record.get('description') or ''
+        with conn:
+            cursor = conn.execute(
+                'INSERT INTO expenses (date, type, category, amount, description) VALUES (?, ?, ?, ?, ?)',
+                (format_expense_date(record['date']), record['type'], record['category'],
+                 float(record['amount']), description))
+            versions = self._written_version(conn)
+        self.cache.invalidate(username)
+        # Ids only grow, so the new row comes last in the id-ordered ledger
+        self._carry_search_index(username, *versions,
+                                 lambda index: index.appended([cursor.lastrowid], [description]))
+        return cursor.lastrowid
+
+    @metrics.timed('write')
+    def update(self, username, expense_id, changes):
+        changes = {key: value for key, value in changes.items() if key in EDITABLE_COLUMNS}
+        if 'date' in changes:
+            changes['date'] = format_expense_date(changes['date'])
+        if 'amount' in changes:
+            # Same check as the CSV backend: a bad amount fails before anything is written
+            changes['amount'] = float(changes['amount'])
+        conn = self.connect(username)
+        if not changes:
+            return conn.execute('SELECT 1 FROM expenses WHERE id = ?', (expense_id,)).fetchone() is not None
+        assignments = ', '.join(f"{key} = ?" for key in changes)
+        with conn:
+            cursor = conn.execute(f'UPDATE expenses SET {assignments} WHERE id = ?',
+                                  (*changes.values(), expense_id))
+            if cursor.rowcount == 0:
+                return False
+            versions = self._written_version(conn)
+        self.cache.invalidate(username)
+
+        def change(index):
+            position = index.position(expense_id)
+            if 'description' not in changes or position is None:
+                return index
+            return index.replaced(position, changes['description'])
+
+        self._carry_search_index(username, *versions, change)
+        return True
+
+    @metrics.timed('write')
+    def delete(self, username, expense_id):
+        conn = self.connect(username)
+        with conn:
+            cursor = conn.execute('DELETE FROM expenses WHERE id = ?', (expense_id,))
+            if cursor.rowcount == 0:
+                return False
+            versions = self._written_version(conn)
+        self.cache.invalidate(username)
+
+        def change(index):
+            position = index.position(expense_id)
+            return index if position is None else index.removed(position)
+
+        self._carry_search_index(username, *versions, change)
+        return True
+
+    @staticmethod
+    def _frame_rows(df):
+        for row in df.itertuples(index=False):
+            amount = None if pd.isna(row.amount) else float(row.amount)
+            description = '' if pd.isna(row.description) else str(row.description)
+            yield (int(row.id), format_expense_date(row.date), row.type, row.category,
+                   amount, description)
+
+    @metrics.timed('write')
+    def replace_all(self, username, df):
+        df = normalize_expenses(df[EXPENSE_COLUMNS].copy())
+        conn = self.connect(username)
+        with conn:
+            conn.execute('DELETE FROM expenses')
+            conn.executemany('INSERT INTO expenses (id, date, type, category, amount, description) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', self._frame_rows(df))
+        self.cache.invalidate(username)
+
+    @staticmethod
+    def _filter_clauses(start_date=None, end_date=None, category=None, expense_type=None,
+                        min_amount=None, max_amount=None, search=None):
+        clauses, params = [], []
+        if start_date:
+            clauses.append('date >= ?')
+            params.append(format_expense_date(start_date))
+        if end_date:
+            clauses.append('date <= ?')
+            params.append(format_expense_date(end_date))
+        if category:
+            clauses.append('category = ?')
+            params.append(category)
+        if expense_type:
+            clauses.append('type = ?')
+            params.append(expense_type)
+        if min_amount is not None:
+            clauses.append('amount >= ?')
+            params.append(min_amount)
+        if max_amount is not None:
+            clauses.append('amount <= ?')
+            params.append(max_amount)
+        if search:
+            escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            clauses.append("description LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+        return clauses, params
+
+    def begin_import(self, username, replace=False):
+        return SqliteBulkWriter(self, username, replace)
+
+    @metrics.timed('filter')
+    def query(self, username, **filters):
+        clauses, params = self._filter_clauses(**filters)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        return self._read_frame(username, 'SELECT id, date, type, category, amount, description '
+                                          f'FROM expenses {where} ORDER BY id', params)
+
+    def iter_chunks(self, username, filters=None, chunk_size=10000):
+        clauses, params = self._filter_clauses(**(filters or {}))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        cursor = self.connect(username).execute(
+            f'SELECT id, date, type, category, amount, description FROM expenses {where} ORDER BY id', params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield normalize_expenses(pd.DataFrame(rows, columns=EXPENSE_COLUMNS))
+
+    @metrics.timed('filter')
+    def page(self, username, filters=None, sort='date', descending=True, limit=50, offset=0, cursor=None):
+        if sort not in SORTABLE_COLUMNS:
+            raise ValueError(f"Cannot sort by '{sort}'")
+        clauses, params = self._filter_clauses(**(filters or {}))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        total = self.connect(username).execute(f'SELECT COUNT(*) FROM expenses {where}', params).fetchone()[0]
+
+        key = 'COALESCE(amount, 0)' if sort == 'amount' else sort
+        direction, comparison = ('DESC', '<') if descending else ('ASC', '>')
+        if cursor is not None:
+            value, last_id = cursor
+            if sort == 'date':
+                value = format_expense_date(value)
+            clauses.append(f'({key} {comparison} ? OR ({key} = ? AND id {comparison} ?))')
+            params += [value, value, last_id]
+            where, offset = f"WHERE {' AND '.join(clauses)}", 0
+        rows = self._read_frame(username, 'SELECT id, date, type, category, amount, description '
+                                          f'FROM expenses {where} ORDER BY {key} {direction}, id {direction} '
+                                          'LIMIT ? OFFSET ?', (*params, limit + 1, offset))
+        return rows.head(limit), total, len(rows) > limit
+
+    def latest(self, username, limit):
+        return self._read_frame(username, 'SELECT id, date, type, category, amount, description '
+                                          'FROM expenses ORDER BY date DESC, id DESC LIMIT ?', (limit,))
+
+    @metrics.timed('load')
+    def rollups(self, username):
+        return pd.read_sql_query('SELECT period, type, category, amount, count FROM rollups',
+                                 self.connect(username))
+
+
+class SqliteBulkWriter:
+    """Streams imported chunks into a SQLite ledger inside one transaction."""
+
+    def __init__(self, store, username, replace):
+        self.store = store
+        self.username = username
+        self.conn = store.connect(username)
+        self.conn.execute('BEGIN IMMEDIATE')
+        if replace:
+            self.conn.execute('DELETE FROM expenses')
+
+    @metrics.timed('write')
+    def write(self, df):
+        rows = zip(format_expense_dates(df['date']), df['type'], df['category'],
+                   df['amount'].astype(float), df['description'])
+        self.conn.executemany('INSERT INTO expenses (date, type, category, amount, description) '
+                              'VALUES (?, ?, ?, ?, ?)', rows)
+        return len(df)
+
+    @metrics.timed('write')
+    def commit(self):
+        self.conn.commit()
+        self.store.cache.invalidate(self.username)
+
+    def rollback(self):
+        self.conn.rollback()
+
+
+STORAGE_BACKENDS = {
+    CsvLedgerStore.name: CsvLedgerStore,
+    SqliteLedgerStore.name: SqliteLedgerStore,
+}
+
+
+def create_store(backend, data_dir, cache, categories=None):
+    try:
+        store_class = STORAGE_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown storage backend '{backend}', "
+                         f"expected one of: {', '.join(STORAGE_BACKENDS)}")
+    return store_class(data_dir, cache, categories)
+
+
+def migrate_csv_ledgers(data_dir, target, overwrite=False):
+    """Copy every ``*_expenses.csv`` in ``data_dir`` into the ``target`` store.
+
+    Returns a list of (username, record count) for the ledgers migrated.
+    Users that already have data in the target are skipped unless
+    ``overwrite`` is set. The CSV files are left in place.
+    """
+    source = CsvLedgerStore(data_dir, LedgerCache(max_users=1, max_bytes=0))
+    migrated = []
+    for path in sorted(glob.glob(os.path.join(data_dir, '*_expenses.csv'))):
+        username = os.path.basename(path)[:-len('_expenses.csv')]
+        if not overwrite and not target.load(username).empty:
+            log.info('Skipping %s: target already has records', username)
+            continue
+        df = source.load(username)
+        target.replace_all(username, df)
+        migrated.append((username, len(df)))
+    return migrated
@@ -0,0 +1,206 @@
+"""Per-user settings (``<user>_settings.json``), cached in memory and written atomically.
+
+Settings are read on nearly every page, so each user's file is parsed and
+validated against ``SCHEMA`` once and then served from memory. Every read
+still stats the file, and since writes replace it with a new file (a new
+inode), a write by another worker process is picked up straight away.
+
+Writes go through ``SettingsStore.update``, which merges only the changed
+fields and validates the result before replacing the file under the
+user's lock. Updates that arrive while one is being written are folded
+into the next write instead of each rewriting the file in turn.
+"""
+import json
+import logging
+import math
+import os
+import threading
+
+import periods
+from storage import UserWriteLock, atomic_write_json
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CATEGORIES = [
+    "Food", "Groceries", "Travel", "Rent", "Utilities",
+    "Entertainment", "Healthcare", "Shopping", "Miscellaneous", "Income"
+]
+DEFAULT_CURRENCY = 'INR (₹)'
+
+
+class SettingsError(ValueError):
+    """A settings value that doesn't fit the schema."""
+
+
+def default_settings():
+    return {
+        'categories': list(DEFAULT_CATEGORIES),
+        'currency': DEFAULT_CURRENCY,
+        'start_date': 1,  # Day of month to start tracking
+        'financial_year_start': periods.DEFAULT_FINANCIAL_YEAR_START,  # Month the financial year begins
+        'budgets': {},  # category -> spend per billing cycle
+    }
+
+
+def _bounded_int(value, low, high, name):
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int) or not low <= value <= high:
+        raise SettingsError(f'{name} must be a whole number from {low} to {high}')
+    return value
+
+
+def _categories(value):
+    if not isinstance(value, (list, tuple)):
+        raise SettingsError('Categories must be a list')
+    categories = list(dict.fromkeys(str(category).strip() for category in value if str(category).strip()))
+    if not categories:
+        raise SettingsError('Keep at least one category')
+    return categories
+
+
+def _currency(value):
+    if not isinstance(value, str) or not value.strip():
+        raise SettingsError('Choose a currency')
+    return value.strip()
+
+
+def _budgets(value):
+    if not isinstance(value, dict):
+        raise SettingsError('Budgets must map categories to amounts')
+    budgets = {}
+    for category, amount in value.items():
+        try:
+            amount = float(amount)
+        except (TypeError, ValueError):
+            amount = -1.0
+        if not 0 <= amount < math.inf:
+            raise SettingsError(f'Invalid budget for {category}: {value[category]}')
+        budgets[str(category)] = round(amount, 2)
+    return budgets
+
+
+# field -> check returning the normalised value or raising SettingsError
+SCHEMA = {
+    'categories': _categories,
+    'currency': _currency,
+    'start_date': lambda value: _bounded_int(value, 1, 31, 'Month start day'),
+    'financial_year_start': lambda value: _bounded_int(value, 1, 12, 'Financial year start'),
+    'budgets': _budgets,
+}
+
+
+def validate_settings(data, strict=True):
+    """Return ``data`` with every SCHEMA field checked and normalised, and missing ones defaulted.
+
+    With ``strict``, an invalid field raises SettingsError; otherwise (a file
+    edited by hand) it falls back to its default with a warning. Fields the
+    schema doesn't know are kept as they are.
+    """
+    if not isinstance(data, dict):
+        if strict:
+            raise SettingsError('Settings must be an object')
+        data = {}
+    settings = dict(data)
+    defaults = default_settings()
+    for field, check in SCHEMA.items():
+        if field not in settings:
+            settings[field] = defaults[field]
+            continue
+        try:
+            settings[field] = check(settings[field])
+        except SettingsError as e:
+            if strict:
+                raise
+            log.warning('Ignoring invalid %s in settings: %s', field, e)
+            settings[field] = defaults[field]
+    # Budgets only apply to categories that still exist
+    settings['budgets'] = {category: amount for category, amount in settings['budgets'].items()
+                           if category in settings['categories']}
+    return settings
+
+
+def _file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class SettingsStore:
+    """Every user's settings in one data directory; see the module docstring."""
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self._cache = {}  # username -> (file stamp, settings)
+        self._pending = {}  # username -> changes waiting for the next write
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def path(self, username):
+        return os.path.join(self.data_dir, f"{username}_settings.json")
+
+    def _lock(self, username):
+        with self._guard:
+            lock = self._locks.get(username)
+            if lock is None:
+                lock = self._locks[username] = UserWriteLock(
+                    os.path.join(self.data_dir, f"{username}_settings.lock"))
+            return lock
+
+    def _read(self, username):
+        """(file stamp, validated settings) from disk; defaults if there is no file."""
+        path = self.path(username)
+        stamp = _file_stamp(path)
+        if stamp is None:
+            return None, default_settings()
+        try:
+            with open(path, 'r') as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            log.warning('Could not read %s, using default settings: %s', path, e)
+            data = {}
+        return stamp, validate_settings(data, strict=False)
+
+    def get(self, username):
+        """The user's validated settings. Shared with other requests: don't modify it, use update()."""
+        cached = self._cache.get(username)
+        if cached is not None and cached[0] == _file_stamp(self.path(username)):
+            return cached[1]
+        stamp, settings = self._read(username)
+        self._cache[username] = (stamp, settings)
+        return settings
+
+    def initialize(self, username):
+        """Write the default settings if the user has none yet."""
+        if os.path.exists(self.path(username)):
+            return
+        with self._lock(username):
+            if not os.path.exists(self.path(username)):
+                self._write(username, default_settings())
+
+    def update(self, username, changes):
+        """Merge ``changes`` (field -> value) into the user's settings and save them.
+
+        Raises SettingsError, writing nothing, if a changed field is invalid.
+        Returns the settings as saved.
+        """
+        # Check against the current settings first, so an invalid change is
+        # reported to its own caller and never spoils a write shared with others
+        validate_settings({**self.get(username), **changes})
+        with self._guard:
+            self._pending.setdefault(username, {}).update(changes)
+        with self._lock(username):
+            with self._guard:
+                pending = self._pending.pop(username, None)
+            # Empty when the write before ours picked our changes up as well
+            if pending:
+                _, current = self._read(username)
+                self._write(username, validate_settings({**current, **pending}, strict=False))
+        return self.get(username)
+
+    def _write(self, username, settings):
+        path = self.path(username)
+        atomic_write_json(path, settings)
+        self._cache[username] = (_file_stamp(path), settings)